@@ -0,0 +1,119 @@
+"""Time to build the race tables of every state page: the per-point loop vs. the vectorized build.
+
+    python benchmarks/bench_build_state.py --states 50 --house 8 --timestamps 300
+
+`build_state_dataframe` used to walk every race's timeseries in Python, parsing two timestamps per
+point to drop the out-of-order ones, and ran a `merge_asof` per house/senate race against the
+presidential dates.  It now parses all timestamps at once, drops out-of-order points with one
+mask and aligns every race in a single asof join.  The loop is kept below as the reference, and
+both builds are checked to give identical tables on synthetic pages with out-of-order points,
+races that start after the presidential race and races missing a candidate.
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.scripts import load_script
+from tests.synthetic import STATES, state_page_races
+
+
+def build_state_dataframe_loop(state_data, eval_candidates):
+    vote_dfs = {}
+    for race in state_data:
+        race_records = []
+        state = race['race_id'][:2]
+        race_type = race['race_id'][3:7]
+        race_id = race['race_id'][:-11]
+        if race_type in ('G-P-', 'G-S-', 'S-S-', 'G-H-'):
+            past_elections_data = {}
+            if race_type == 'G-P-':
+                past_elections_data['votes2016']   = race['votes2016']
+                past_elections_data['margin2016']  = race['margin2016']
+                past_elections_data['votes2012']   = race['votes2012']
+                past_elections_data['margin2012']  = race['margin2012']
+
+            candidates = {}
+            N = len(race['timeseries'])
+            for i, vote_dict in enumerate(race['timeseries']):
+                if i == 0:
+                    candidate_names = [*vote_dict['vote_shares'].keys()]
+                    candidates = eval_candidates(race['candidates'], candidate_names)
+                curr_timestamp = vote_dict['timestamp']
+                if i < N - 1:
+                    next_timestamp = race['timeseries'][i + 1]['timestamp']
+                    if pd.Timestamp(curr_timestamp) > pd.Timestamp(next_timestamp):
+                        continue
+                vote_record = {}
+                vote_record['timestamp']     = curr_timestamp
+                vote_record['votes2020']     = vote_dict['votes']
+                vote_record['vf_dem']        = vote_dict['vote_shares'].get(candidates.get('dem'), 0)
+                vote_record['vf_rep']        = vote_dict['vote_shares'].get(candidates.get('rep'), 0)
+                vote_record['vf_extra']      = vote_dict['vote_shares'].get(candidates.get('extra'), 0)
+                vote_record.update(past_elections_data)
+                race_records.append(vote_record)
+
+            if len(race_records) == 0:
+                continue
+            race_df = pd.DataFrame.from_records(race_records)
+            race_df.set_index(pd.to_datetime(race_df['timestamp']), drop=False, inplace=True)
+            race_df.index.rename('date', inplace=True)
+            if race_type == 'G-P-':
+                vote_dfs[race_id[3:]] = race_df
+                synced_dates = race_df.index.to_frame(index=False, name='date')
+            else:
+                race_df = pd.merge_asof(synced_dates, race_df, left_on='date',
+                                        right_index=True, direction='backward')
+                vote_dfs[race_id[3:]] = race_df.set_index('date')
+    return state, pd.concat(vote_dfs.values(), keys=vote_dfs.keys())
+
+def messy_page(state, num_timestamps, num_house, seed):
+    #a synthetic page with a few of the quirks of the real ones
+    races = state_page_races(state, num_timestamps, num_house, seed=seed)
+    rng = np.random.default_rng(seed)
+    for race in races[1:]:
+        #a point that's later than the next one (besides the first point)
+        i = rng.integers(2, num_timestamps - 1)
+        race['timeseries'][i]['timestamp'] = race['timeseries'][i + 1]['timestamp'].replace('2020-11-04', '2020-11-05')
+    #a race that starts after the presidential race, and one without a third party candidate
+    races[1]['timeseries'] = races[1]['timeseries'][:1] + races[1]['timeseries'][num_timestamps // 2:]
+    for vote_dict in races[-1]['timeseries']:
+        vote_dict['vote_shares'].pop('jorgensenj')
+    #and a race that isn't built
+    races.append({'race_id': '{}-G-A-2020-11-03'.format(state), 'timeseries': []})
+    return races
+
+def timed(func, pages):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tables = [func(page) for page in pages]
+    return tables, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--house', type=int, default=8, help='house races per state (~450 races in all by default)')
+    parser.add_argument('--timestamps', type=int, default=300)
+    args = parser.parse_args()
+
+    scraper = load_script('races')
+    pages = [messy_page(state, args.timestamps, args.house, seed=i) for i, state in enumerate(STATES[:args.states])]
+    num_races = sum(len(page) - 1 for page in pages)
+
+    loop_tables, t_loop = timed(lambda page: build_state_dataframe_loop(page, scraper.eval_candidates), pages)
+    vectorized_tables, t_vectorized = timed(scraper.build_state_dataframe, pages)
+    for (state, expected), (vectorized_state, df) in zip(loop_tables, vectorized_tables):
+        assert state == vectorized_state
+        pd.testing.assert_frame_equal(df, expected)
+
+    num_rows = sum(len(df) for _, df in vectorized_tables)
+    print('{} states, {} races, {} rows (identical tables)'.format(len(pages), num_races, num_rows))
+    print('  per-point loop: {:6.2f} s'.format(t_loop))
+    print('  vectorized:     {:6.2f} s ({:.1f}x)'.format(t_vectorized, t_loop / t_vectorized))
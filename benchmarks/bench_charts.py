@@ -0,0 +1,105 @@
+"""Time to chart every state and county curve: the README's matplotlib snippets, one chart at a time, vs. `render_charts`.
+
+    python benchmarks/bench_charts.py --states 10 --counties 30 --timestamps 3000 --baseline-charts 60
+
+A synthetic county output (see benchmarks/bench_rollup.py) is rolled up, and the cumulative,
+delta and margin charts of every state and county are rendered from the rollups with one worker
+and with one per cpu, and checked to all be written.  The reference draws each chart the way the
+README's snippets do (select the county's rows, difference them, `plt.subplots`, plot every
+point, lay out and close the figure); it's timed on the first --baseline-charts charts and
+projected to the whole set.  `downsample` is also checked to keep the extremes of a spiky series.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.charts import KINDS, downsample, render_charts
+from election2020.rollup import RollupCache
+from benchmarks.bench_rollup import county_output
+
+
+def readme_chart(counties, state, county, kind, path):
+    #a county's rows, differenced and plotted whole, as in the README
+    df = counties[(counties['state'] == state) & ((counties['county'] == county) if county else True)]
+    df = df.assign(date=pd.to_datetime(df['timestamp'], utc=True)).sort_values('date')
+    columns = ['votes2020', 'votes_dem', 'votes_rep']
+    if not county:
+        wide = df.pivot_table(index='date', columns='county', values=columns, aggfunc='last').ffill().fillna(0)
+        df = wide.T.groupby(level=0).sum().T.reset_index()
+    if kind == 'delta':
+        df[columns] = df[columns].diff()
+    fig, ax = plt.subplots(1, 1)
+    if kind == 'margin':
+        ax.plot(df['date'], (df['votes_rep'] - df['votes_dem']) / df['votes2020'] * 100, color='k')
+    else:
+        ax.axhline(0, color='k', linestyle='--')
+        df.plot('date', 'votes_dem', marker='o', color='b', ax=ax)
+        df.plot('date', 'votes_rep', marker='D', color='r', ax=ax)
+    ax.set_title('{} {} {}'.format(state, county, kind))
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=10)
+    parser.add_argument('--counties', type=int, default=30)
+    parser.add_argument('--timestamps', type=int, default=3000)
+    parser.add_argument('--baseline-charts', type=int, default=60)
+    args = parser.parse_args()
+
+    #min-max decimation keeps every column's extremes, and the first and last point
+    rng = np.random.default_rng(0)
+    series = rng.normal(size=(100000, 2)).cumsum(axis=0)
+    series[rng.integers(len(series), size=20)] += rng.choice([-1000, 1000], size=(20, 2))
+    keep = downsample(series, 1000)
+    assert len(keep) <= 2 * 1000 + 2 and keep[0] == 0 and keep[-1] == len(series) - 1
+    assert set(series.argmin(axis=0)) <= set(keep) and set(series.argmax(axis=0)) <= set(keep)
+
+    counties = county_output(args.states, args.counties, args.timestamps)
+    tmp_dir = Path(tempfile.mkdtemp())
+    rollup_path = tmp_dir / 'election2020_rollups.sqlite'
+    cache = RollupCache(rollup_path)
+    cache.add('counties', counties)
+    curves = cache.curves()
+    cache.close()
+    num_expected = len(curves) * len(KINDS)
+
+    baseline = [(state, county, kind) for state, county in curves[['state', 'county']].itertuples(index=False)
+                for kind in KINDS][:args.baseline_charts]
+    (tmp_dir / 'readme').mkdir()
+    start = time.perf_counter()
+    for i, (state, county, kind) in enumerate(baseline):
+        readme_chart(counties, state, county, kind, tmp_dir / 'readme' / '{}.png'.format(i))
+    t_baseline = (time.perf_counter() - start) / len(baseline)
+
+    workers = os.cpu_count() or 1
+    num_serial, t_serial = timed(render_charts, rollup_path, tmp_dir / 'serial', workers=1)
+    num_pool, t_pool = timed(render_charts, rollup_path, tmp_dir / 'pool', workers=workers)
+    for charts_dir, num_charts in ((tmp_dir / 'serial', num_serial), (tmp_dir / 'pool', num_pool)):
+        assert num_charts == num_expected and len(list(charts_dir.rglob('*.png'))) == num_expected
+
+    print('{} curves ({} states x {} counties + states, {} minutes): {} charts written'.format(
+        len(curves), args.states, args.counties, args.timestamps, num_expected))
+    print('  README snippets:            {:6.2f} s ({:.0f} ms per chart, projected from {})'.format(
+        t_baseline * num_expected, t_baseline * 1000, len(baseline)))
+    print('  render_charts, 1 process:   {:6.2f} s ({:.0f} ms per chart, {:.1f}x)'.format(
+        t_serial, t_serial / num_expected * 1000, t_baseline * num_expected / t_serial))
+    print('  render_charts, {:<2} processes:{:6.2f} s ({:.1f}x)'.format(
+        workers, t_pool, t_baseline * num_expected / t_pool))
@@ -0,0 +1,164 @@
+"""Time to harvest the timestamped urls of archived results pages: the serial crawler vs. `harvest_urls`.
+
+    python benchmarks/bench_crawler.py --pages 200 --urls 200 --latency 0.05
+
+A `StandinServer` serves --pages synthetic results pages (about the size of the NYT's, with the
+e-map-data script after a lot of markup, each listing --urls timestamped urls that mostly repeat
+the previous page's), answering each request after --latency seconds.  The original crawler
+fetched the pages one at a time, parsed each whole page with a pure-Python html parser (what
+BeautifulSoup's 'html.parser' runs on) and deduplicated with lists; it's reproduced below as the
+reference.  The new harvest is killed (its engine interrupted) once half the pages are done,
+resumed and checked to write exactly the reference's urls, each once (in the order the pages
+finish).
+"""
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from html.parser import HTMLParser
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.fetch import FetchEngine
+from election2020.manifest import ScrapeManifest
+from election2020.scripts import load_script
+from election2020.standin import StandinServer
+
+
+DATA_URL = ('https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/precincts/'
+            '{}General-2020-11-{:02d}T{:02d}:{:02d}:00.000Z.json')
+
+
+def results_page(urls, markup_rows=4000):
+    #a results page: lots of markup, then the e-map-data script with the timestamped urls
+    rows = ''.join('<div class="e-row"><span class="e-name">County {0}</span><span class="e-votes">{0}</span></div>\n'
+                   .format(i) for i in range(markup_rows))
+    entries = ','.join('{{"id":{},"timestamped_url":"{}","label":"x"}}'.format(i, url) for i, url in enumerate(urls))
+    return ('<html><head><title>Results</title><script>var x = 1;</script></head><body>{}'
+            '<script class="e-map-data" type="application/json">{{"files":[{}]}}</script>'
+            '</body></html>').format(rows, entries).encode('utf-8')
+
+class MapDataParser(HTMLParser):
+    #finds the text of <script class="e-map-data"> like `soup.find('script', class_='e-map-data').string`
+    def __init__(self):
+        super().__init__()
+        self.in_script = False
+        self.script_text = None
+
+    def handle_starttag(self, tag, attrs):
+        self.in_script = tag == 'script' and ('class', 'e-map-data') in attrs
+
+    def handle_data(self, data):
+        if self.in_script and self.script_text is None:
+            self.script_text = data
+
+class KilledEngine(FetchEngine):
+    #a fetch engine whose harvest is interrupted, like a ctrl-c, after `kill_after` pages
+    def __init__(self, kill_after, **kwargs):
+        super().__init__(**kwargs)
+        self.kill_after = kill_after
+
+    def map(self, func, items):
+        with contextlib.closing(super().map(func, items)) as results:
+            for i, result in enumerate(results):
+                if i == self.kill_after:
+                    raise KeyboardInterrupt
+                yield result
+
+def crawl_serial(archived_urls):
+    #the original crawler
+    data_urls = []
+    visited_urls = []
+    for archived_url in archived_urls:
+        if archived_url in visited_urls:
+            continue
+        visited_urls.append(archived_url)
+        parser = MapDataParser()
+        parser.feed(requests.get(archived_url).content.decode('utf-8'))
+        for url_str in parser.script_text.split('"timestamped_url":"')[1:]:
+            nyt_url = url_str[:171].split('"')[0]
+            if not nyt_url in data_urls:
+                data_urls.append(nyt_url)
+    return data_urls
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--urls', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+    crawler = load_script('crawler')
+    temp_dir = Path(tempfile.mkdtemp())
+
+    #every page lists the files of a sliding window of timestamps, so most urls repeat
+    fixture_dir = temp_dir / 'pages'
+    fixture_dir.mkdir()
+    timestamps = [(4 + m // 1440, m // 60 % 24, m % 60) for m in range(0, 10 * (args.pages + args.urls), 10)]
+    for page in range(args.pages):
+        urls = [DATA_URL.format(state, *timestamps[page + i // 5]) for i, state in
+                zip(range(args.urls), ['GA', 'PA', 'MI', 'FL', 'NC'] * args.urls)]
+        (fixture_dir / 'page-{}.html'.format(page)).write_bytes(results_page(urls))
+    page_bytes = (fixture_dir / 'page-0.html').stat().st_size
+
+    with StandinServer(fixture_dir, latency=args.latency) as server:
+        archived_urls = [server.url('web/2020110{}000000/page-{}.html'.format(page % 9 + 1, page))
+                         for page in range(args.pages)]
+        #repeated lines in the list of pages (the original list has some)
+        archived_urls += archived_urls[:args.pages // 10]
+
+        start = time.perf_counter()
+        expected = crawl_serial(archived_urls)
+        t_serial = time.perf_counter() - start
+
+        output_path = temp_dir / 'archived_nyt_timestamped_data_urls.txt'
+        manifest = ScrapeManifest(temp_dir / 'url_harvest_manifest.sqlite')
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with KilledEngine(args.pages // 2, max_workers=args.workers, rate=1000, burst=1000,
+                              per_host=args.workers) as engine:
+                #killed halfway through ...
+                try:
+                    crawler.harvest_urls(archived_urls, output_path, engine, manifest=manifest)
+                except KeyboardInterrupt:
+                    pass
+                else:
+                    raise AssertionError('the harvest was not killed')
+            num_killed = len(output_path.read_text().split())
+            num_remaining = len(manifest.remaining('timestamped_urls', list(dict.fromkeys(archived_urls))))
+            with FetchEngine(max_workers=args.workers, rate=1000, burst=1000, per_host=args.workers) as engine:
+                #... and resumed
+                failed_urls = crawler.harvest_urls(archived_urls, output_path, engine, manifest=manifest)
+        t_harvest = time.perf_counter() - start
+        manifest.close()
+
+    harvested = output_path.read_text().split()
+    assert 0 < num_killed < len(expected) and num_remaining == args.pages - args.pages // 2
+    assert not failed_urls and len(harvested) == len(set(harvested)) and set(harvested) == set(expected)
+    print('{} pages ({:.0f} kB each, {} listed twice), {} distinct urls, {:.0f} ms latency'.format(
+        args.pages, page_bytes / 1e3, args.pages // 10, len(expected), 1000 * args.latency))
+    print('  serial crawl:            {:6.2f} s'.format(t_serial))
+    print('  harvest ({} workers):     {:6.2f} s ({:.1f}x, killed and resumed halfway)'.format(
+        args.workers, t_harvest, t_serial / t_harvest))
+
+    #extraction alone, on one page (whose script's class may also be single-quoted or one of several)
+    content = (fixture_dir / 'page-0.html').read_bytes()
+    for script_class in (b"class='e-map-data'", b'class="e-map-data g-hidden"', b'class="g-hidden e-map-data"'):
+        page = content.replace(b'class="e-map-data"', script_class)
+        assert crawler.extract_timestamped_urls(page) == crawler.extract_timestamped_urls(content)
+    start = time.perf_counter()
+    for _ in range(10):
+        parser = MapDataParser()
+        parser.feed(content.decode('utf-8'))
+    t_parse = (time.perf_counter() - start) / 10
+    start = time.perf_counter()
+    for _ in range(10):
+        crawler.extract_timestamped_urls(content)
+    t_scan = (time.perf_counter() - start) / 10
+    print('  per page: html parser {:.1f} ms, targeted scan {:.2f} ms ({:.0f}x)'.format(
+        1000 * t_parse, 1000 * t_scan, t_parse / t_scan))
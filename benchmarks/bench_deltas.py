@@ -0,0 +1,60 @@
+"""Stored rows and time of delta-only ingestion (`DeltaSink`) vs. appending every snapshot.
+
+    python benchmarks/bench_deltas.py --precincts 9000 --timestamps 100 --update-fraction 0.05
+
+Snapshots are written in order (or, with --shuffle, in the random order concurrent downloads
+complete in), and the materialized timeseries is checked to be identical to the dense rows.
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.deltas import DeltaSink
+from election2020.sinks import CsvSink
+from tests.synthetic import precinct_frame
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--precincts', type=int, default=9000)
+    parser.add_argument('--timestamps', type=int, default=100)
+    parser.add_argument('--update-fraction', type=float, default=0.05)
+    parser.add_argument('--shuffle', action='store_true', help='write the snapshots in a random order')
+    args = parser.parse_args()
+
+    df = precinct_frame(args.precincts, args.timestamps, update_fraction=args.update_fraction, seed=3)
+    df['fips'] = df['fips'].astype(str)
+    snapshots = [snapshot_df for _, snapshot_df in df.groupby('timestamp')]
+    if args.shuffle:
+        random.Random(0).shuffle(snapshots)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dense = CsvSink(Path(tmp_dir) / 'GA_dense.csv')
+        _, t_dense = timed(lambda: [dense.write(snapshot_df) for snapshot_df in snapshots])
+        deltas = DeltaSink(CsvSink(Path(tmp_dir) / 'GA_deltas.csv'))
+        _, t_deltas = timed(lambda: [deltas.write(snapshot_df, key=i) for i, snapshot_df in enumerate(snapshots)])
+        materialized, t_read = timed(DeltaSink(deltas.output).read, 'GA')
+        dense_size, deltas_size = dense.path.stat().st_size, deltas.path.stat().st_size
+
+    sort_by = ['timestamp', 'county', 'precinct', 'vote_type']
+    expected_df = df.sort_values(sort_by).reset_index(drop=True)
+    actual_df = materialized.sort_values(sort_by).reset_index(drop=True)[expected_df.columns]
+    pd.testing.assert_frame_equal(expected_df, actual_df, check_dtype=False)
+
+    print('{} snapshots, {} dense rows'.format(len(snapshots), len(df)))
+    print('  every row:   {:9d} rows stored, {:7.1f} MB, written in {:.1f} s'.format(
+          len(df), dense_size / 1e6, t_dense))
+    print('  delta-only:  {:9d} rows stored, {:7.1f} MB, written in {:.1f} s, materialized in {:.1f} s'.format(
+          int(deltas.index['changed'].sum()), deltas_size / 1e6, t_deltas, t_read))
@@ -0,0 +1,100 @@
+"""Peak memory of the out-of-core dedup and totals vs. reading the whole csv file.
+
+    python benchmarks/bench_external.py --states 50 --counties 60 --snapshots 200 --budget 16
+    python benchmarks/bench_external.py --precincts 9000 --timestamps 100 --budget 16
+
+The county output is deduplicated with `remove_duplicates` (in memory, then with a memory budget
+of --budget MB) and a state's unprocessed precinct rows get their missing totals with
+`fill_missing_totals` and `iter_missing_totals`.  Both files are made a bit messy (numeric-looking
+precinct ids, missing counties and vote types, a column that's only missing near the end) so
+that chunks infer different dtypes than the whole file, and each out-of-core output is checked to
+be byte-for-byte identical to the in-memory one.  Peak is the peak of Python allocations
+(tracemalloc).
+"""
+import argparse
+import filecmp
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.sinks import CsvSink
+from election2020.scripts import load_script
+from tests.synthetic import county_frame, precinct_frame
+
+
+def profiled(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+def report(name, rows, in_memory, out_of_core, identical):
+    print('{} ({} rows): {}'.format(name, rows, 'identical' if identical else '!!! OUTPUTS DIFFER !!!'))
+    print('  in memory:   {:7.1f} MB peak, {:.1f} s'.format(in_memory[1] / 1e6, in_memory[0]))
+    print('  out of core: {:7.1f} MB peak, {:.1f} s'.format(out_of_core[1] / 1e6, out_of_core[0]))
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--counties', type=int, default=60)
+    parser.add_argument('--snapshots', type=int, default=100)
+    parser.add_argument('--precincts', type=int, default=3000)
+    parser.add_argument('--timestamps', type=int, default=100)
+    parser.add_argument('--budget', type=float, default=16, help='memory budget in MB')
+    args = parser.parse_args()
+    budget = int(args.budget * 1024**2)
+    warnings.simplefilter('ignore', FutureWarning)
+    temp_dir = Path(tempfile.mkdtemp())
+    rng = np.random.default_rng(0)
+    identical = True
+
+    #county output, appended one snapshot at a time like the scraper does (so the index repeats)
+    county_scraper = load_script('county')
+    df = county_frame(args.states, args.counties, args.snapshots)
+    df['county'] = df['county'].where(rng.random(len(df)) >= 0.001)
+    df.loc[df.index[-len(df) // 10:], 'margin2020'] = 1.5
+    source = CsvSink(temp_dir / 'county_source.csv')
+    for _, snapshot in df.groupby(np.arange(len(df)) // (args.states * args.counties)):
+        source.write(snapshot.reset_index(drop=True))
+    outputs = [temp_dir / 'county_in_memory.csv', temp_dir / 'county_out_of_core.csv']
+    for path in outputs:
+        shutil.copy(source.path, path)
+    _, *in_memory = profiled(county_scraper.remove_duplicates, CsvSink(outputs[0]))
+    _, *out_of_core = profiled(county_scraper.remove_duplicates, CsvSink(outputs[1]), memory_budget=budget)
+    same = filecmp.cmp(*outputs, shallow=False)
+    identical &= same
+    report('remove_duplicates', len(df), in_memory, out_of_core, same)
+
+    #a state's unprocessed precinct rows, some without a total row
+    precinct_scraper = load_script('precincts_improved')
+    df = precinct_frame(args.precincts, args.timestamps, vote_types=['absentee', 'electionday', 'total'])
+    df = df[(df['vote_type'] != 'total') | (rng.random(len(df)) >= 0.3)].reset_index(drop=True)
+    numeric = df['precinct'].str.endswith('7')
+    df.loc[numeric, 'precinct'] = df.loc[numeric, 'precinct'].str.replace('precinct-', '000')
+    df['vote_type'] = df['vote_type'].where(rng.random(len(df)) >= 0.01)
+    df['county'] = df['county'].where(rng.random(len(df)) >= 0.001)
+    df['votes_jorgensen'] = df['votes_jorgensen'].astype(float)
+    df.loc[df.index[-len(df) // 10:], 'votes_jorgensen'] = np.nan
+    df.iloc[::2].to_csv(temp_dir / 'precincts_unprocessed.csv')
+    outputs = [temp_dir / 'precincts_in_memory.csv', temp_dir / 'precincts_out_of_core.csv']
+    unprocessed = temp_dir / 'precincts_unprocessed.csv'
+    _, *in_memory = profiled(precinct_scraper.fill_missing_totals, unprocessed, outputs[0], state='GA')
+    _, *out_of_core = profiled(lambda: sum(len(df) for df in precinct_scraper.iter_missing_totals(
+        unprocessed, outputs[1], state='GA', memory_budget=budget)))
+    same = filecmp.cmp(*outputs, shallow=False)
+    identical &= same
+    report('fill_missing_totals', len(df) // 2, in_memory, out_of_core, same)
+
+    shutil.rmtree(temp_dir)
+    sys.exit(0 if identical else 1)
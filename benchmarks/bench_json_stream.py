@@ -0,0 +1,93 @@
+"""Peak memory of whole-document vs. streaming extraction of a precinct file.
+
+    python benchmarks/bench_json_stream.py --precincts 9000
+
+Both precinct scrapers are measured on the same synthetic file (about the size of the largest
+PA/FL snapshots), and the two paths are checked to produce the same rows.  The file is served
+from disk like a streamed download: the whole-document paths read the body whole, and the
+streaming ones a chunk at a time.  Peak memory is the peak of Python allocations (tracemalloc),
+the raw body included.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.scripts import load_script
+from election2020.sinks import uncategorize
+from tests.synthetic import precinct_json
+
+
+URL = ('https://web.archive.org/web/20201104052000if_/https://static01.nyt.com/elections-assets/'
+       '2020/data/api/2020-11-03/precincts/PAGeneralConcatenator-2020-11-04T05:18:09.130Z.json')
+
+
+class FileResponse:
+    #a response whose body is read from a file, whole (`content`) or a chunk at a time like a
+    #streamed `requests.Response`
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def content(self):
+        return self.path.read_bytes()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        with open(self.path, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+def profiled(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+def report(name, whole, streaming):
+    (whole_df, t_whole, m_whole), (stream_df, t_stream, m_stream) = whole, streaming
+    #streamed labels are interned as (string) categoricals, e.g. the improved scraper's -9999 fips
+    whole_df = whole_df.reset_index(drop=True).astype({'fips': str})
+    whole_df = whole_df.where(whole_df.notna(), np.nan)
+    pd.testing.assert_frame_equal(whole_df, uncategorize(stream_df), check_dtype=False)
+    print('{}: {} rows\n  whole document: {:6.1f} MB peak, {:.1f} s\n  streaming:      {:6.1f} MB peak, '
+          '{:.1f} s'.format(name, len(stream_df), m_whole / 1e6, t_whole, m_stream / 1e6, t_stream))
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--precincts', type=int, default=9000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    path = Path(tempfile.mkdtemp()) / 'PAGeneralConcatenator.json'
+    path.write_bytes(precinct_json(args.precincts))
+    print('synthetic file: {:.1f} MB'.format(path.stat().st_size / 1e6))
+    fetch = lambda url, **kwargs: FileResponse(path)
+
+    scraper = load_script('precincts')
+    whole = profiled(lambda: pd.DataFrame.from_records(scraper.load_data(URL, 'PA', fetch=fetch)))
+    streaming = profiled(scraper.load_data_streaming, URL, 'PA', fetch=fetch, batch_size=args.batch_size)
+    report('precincts_presidential_scraper.py', whole, streaming)
+
+    improved = load_script('precincts_improved')
+    def whole_document(url, state):
+        records = []
+        for record_type, record in fetch(url).json().items():
+            if record_type != 'meta':
+                records += [improved.extract_vote_record(state, url[-29:-5], row) for row in record]
+        return pd.DataFrame.from_records(records)
+    whole = profiled(whole_document, URL, 'PA')
+    streaming = profiled(improved.extract_precinct_data, URL, 'PA', fetch=fetch, batch_size=args.batch_size)
+    report('precincts_presidential_scraper_improved.py', whole, streaming)
@@ -0,0 +1,108 @@
+"""Cost of polling a live feed: conditional requests against a stand-in replaying snapshots.
+
+    python benchmarks/bench_live.py --snapshots 10 --polls-per-snapshot 5 --update-fraction 0.2
+
+A `ReplayServer` serves a national page (50 states) whose snapshots each update the results of
+--update-fraction of the states, and `poll_county_results` polls it --polls-per-snapshot times
+per snapshot.  Polls of an unchanged page get a `304 Not Modified` and parse nothing; a changed
+page appends only the counties of the states that were updated.  With --ignore-validators the
+server always sends the full body, so unchanged pages are caught by their digest instead.  The
+appended rows are checked against extracting the updated states of every snapshot directly.
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.fetch import FetchEngine
+from election2020.live import LivePoller
+from election2020.metrics import METRICS
+from election2020.records import RecordBuffer, COUNTY_SCHEMA
+from election2020.scripts import load_script
+from election2020.sinks import CsvSink
+from election2020.standin import ReplayServer
+from tests.synthetic import county_page_json, precinct_timestamps
+
+
+def page_snapshots(num_snapshots, update_fraction, seed=0):
+    #the national page at every snapshot: each one updates the votes of a few states
+    rng = np.random.default_rng(seed)
+    page = json.loads(county_page_json())
+    timestamps = [t + 'Z' for t in precinct_timestamps(num_snapshots, freq='5min')]
+    snapshots, updated = [], []
+    for i, timestamp in enumerate(timestamps):
+        races = page['data']['races']
+        changed = range(len(races)) if i == 0 else np.flatnonzero(rng.random(len(races)) < update_fraction)
+        for r in changed:
+            races[r]['last_updated'] = timestamp
+            for county in races[r]['counties']:
+                county['last_updated'] = timestamp
+                county['votes'] += int(rng.integers(0, 1000))
+        snapshots.append(json.dumps(page).encode('utf-8'))
+        updated.append([races[r]['race_id'] for r in changed])
+    return snapshots, updated
+
+def expected_rows(scraper, snapshots, updated):
+    vote_records = RecordBuffer(COUNTY_SCHEMA)
+    for snapshot, race_ids in zip(snapshots, updated):
+        for race in json.loads(snapshot)['data']['races']:
+            if race['race_id'] in race_ids:
+                vote_records.extend(*scraper.get_archived_county_columns(race))
+    return vote_records.to_frame()
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshots', type=int, default=10)
+    parser.add_argument('--polls-per-snapshot', type=int, default=5)
+    parser.add_argument('--update-fraction', type=float, default=0.2)
+    parser.add_argument('--ignore-validators', action='store_true')
+    args = parser.parse_args()
+
+    scraper = load_script('county')
+    snapshots, updated = page_snapshots(args.snapshots, args.update_fraction)
+    temp_dir = Path(tempfile.mkdtemp())
+    output = CsvSink(temp_dir / 'county_live.csv')
+
+    timings = {'changed': [], 'unchanged': []}
+    with ReplayServer({'president.json': snapshots}, conditional=not args.ignore_validators) as server, \
+         FetchEngine(rate=1000, burst=1000) as engine:
+        poller = LivePoller(engine, temp_dir / 'live.sqlite')
+        url = server.url('elections-assets/2020/data/api/2020-11-03/national-map-page/national/president.json')
+        for i in range(args.snapshots):
+            for j in range(args.polls_per_snapshot):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    num_rows = scraper.poll_county_results(url, output, poller)
+                timings['changed' if j == 0 else 'unchanged'].append(time.perf_counter() - start)
+                assert (num_rows > 0) == (j == 0 and len(updated[i]) > 0)
+            server.advance()
+        poller.close()
+
+    appended = pd.read_csv(output.path, index_col=0, dtype={'fips': str})
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = expected_rows(scraper, snapshots, updated)
+    np.testing.assert_array_equal(appended[['state', 'county', 'timestamp']].to_numpy(),
+                                  expected[['state', 'county', 'timestamp']].astype(str).to_numpy())
+    np.testing.assert_array_equal(appended['votes2020'].to_numpy(), expected['votes2020'].astype(int).to_numpy())
+
+    series = {(s['name'], tuple(sorted(s['labels'].items()))): s for s in METRICS.snapshot()}
+    polls = {result: series.get(('live_polls_total', (('result', result),)), {}).get('value', 0)
+             for result in ('changed', 'not_modified', 'unchanged')}
+    fetched = sum(s['value'] for s in series.values() if s['name'] == 'fetch_bytes_total')
+    print('{} polls of {} snapshots ({:.0f} kB each): {} changed, {} not modified, {} unchanged'.format(
+        args.snapshots * args.polls_per_snapshot, args.snapshots, np.mean([len(s) for s in snapshots]) / 1e3,
+        polls['changed'], polls['not_modified'], polls['unchanged']))
+    print('  {} rows appended (of {} in the snapshots), identical to the updated states'.format(
+        len(appended), args.snapshots * len(json.loads(snapshots[0])['data']['races'][0]['counties']) * 50))
+    print('  {:.1f} MB fetched in all'.format(fetched / 1e6))
+    print('  changed poll:   {:6.1f} ms'.format(1000 * np.median(timings['changed'])))
+    print('  unchanged poll: {:6.1f} ms'.format(1000 * np.median(timings['unchanged'])))
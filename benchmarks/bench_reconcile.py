@@ -0,0 +1,138 @@
+"""Time to attribute every state-level update to county updates: a per-update loop vs. `reconcile`.
+
+    python benchmarks/bench_reconcile.py --states 50 --counties 60 --timestamps 300
+
+Synthetic outputs where each county updates at random times, the state-level presidential race
+reports the sum of its counties (with vote fractions rounded like the NYT's) and a few precincts
+report each of GA's first counties.  One GA county is reported 7 minutes late, like Bibb County on
+election night, and one state update has votes that no county explains.  Both the loop (which
+walks the state updates and sums the county updates in each window, like reconciling by hand)
+and `reconcile` are checked to give the same residuals, and only the planted anomalies are left
+unexplained (or only the state jump, with a 10 minute `lag`).  It needs GA among the --states,
+4 --counties and 70 --timestamps at least.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.reconcile import reconcile
+from election2020.updates import vote_updates
+from tests.synthetic import STATES, precinct_timestamps
+
+
+def outputs(num_states, num_counties, num_timestamps, update_fraction=0.05, precincts_per_county=10, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Series(precinct_timestamps(num_timestamps, freq='1min')) + 'Z'
+    updated = rng.random((num_states, num_counties, num_timestamps)) < update_fraction
+    updated[:, :, 0] = True
+    votes = np.where(updated[..., None], rng.poisson(200, size=updated.shape + (3,)), 0).cumsum(axis=2)
+
+    #one row per county update, stamped (`timestamp`) with the state's time like the scraper's
+    s, c, t = np.nonzero(updated)
+    counties = pd.DataFrame({
+        'state': np.asarray(STATES, dtype=object)[s], 'county': pd.Series(c).map('county-{}'.format),
+        'timestamp': timestamps.to_numpy()[t], 'last_updated': timestamps.to_numpy()[t],
+        'votes_dem': votes[s, c, t, 0], 'votes_rep': votes[s, c, t, 1],
+        'votes_jorgensen': votes[s, c, t, 2], 'votes2020': votes[s, c, t].sum(axis=1),
+    })
+
+    #the state-level race at every time a county updated
+    totals = votes.sum(axis=1)
+    s, t = np.nonzero(updated.any(axis=1))
+    state_votes = totals[s, t].sum(axis=1)
+    races = pd.DataFrame({
+        'state': np.asarray(STATES, dtype=object)[s], 'race_id': 'G-P', 'timestamp': timestamps.to_numpy()[t],
+        'votes2020': state_votes, 'vf_dem': (totals[s, t, 0] / state_votes).round(3),
+        'vf_rep': (totals[s, t, 1] / state_votes).round(3), 'vf_extra': (totals[s, t, 2] / state_votes).round(3),
+    })
+
+    #GA's first county at 7 minutes late (in its latest update before the last hour) ...
+    late = (counties['state'] == 'GA') & (counties['county'] == 'county-0') & (counties['timestamp'] < timestamps.iloc[-60])
+    late = counties.index[late][-1]
+    late_time = pd.Timestamp(counties.at[late, 'last_updated']) + pd.Timedelta('7min')
+    counties.at[late, 'last_updated'] = late_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+    #... and votes that no county explains in one of AL's updates (and every later one)
+    jump = races.index[races['state'] == 'AL'][len(races[races['state'] == 'AL']) // 2]
+    races.loc[jump:races.index[races['state'] == 'AL'][-1], 'votes2020'] += 5000
+
+    #GA's first counties split between precincts
+    ga = counties[(counties['state'] == 'GA') & counties['county'].isin(['county-1', 'county-2', 'county-3'])]
+    shares = rng.dirichlet(np.ones(precincts_per_county), size=len(ga))
+    columns = ['votes2020', 'votes_dem', 'votes_rep', 'votes_jorgensen']
+    #cumulative counts split so that every precinct is non-decreasing and they sum to the county
+    split = {}
+    for column in columns:
+        deltas = ga.groupby('county')[column].diff().fillna(ga[column]).to_numpy()
+        parts = np.floor(deltas[:, None] * shares).astype(int)
+        parts[:, 0] += deltas.astype(int) - parts.sum(axis=1)
+        split[column] = pd.DataFrame(parts).groupby(ga['county'].to_numpy()).cumsum().to_numpy()
+    precincts = pd.DataFrame({
+        'state': 'GA', 'county': np.repeat(ga['county'].to_numpy(), precincts_per_county),
+        'precinct': np.tile(['{:04d}'.format(p) for p in range(precincts_per_county)], len(ga)),
+        'vote_type': 'total', 'timestamp': np.repeat(ga['last_updated'].to_numpy(), precincts_per_county),
+        'votes': split['votes2020'].ravel(), 'votes_biden': split['votes_dem'].ravel(),
+        'votes_trump': split['votes_rep'].ravel(), 'votes_jorgensen': split['votes_jorgensen'].ravel(),
+        'votes_other': 0,
+    })
+    return races, counties, precincts
+
+def reconcile_loop(races, counties):
+    #per state update, the county updates in its window (one boolean mask per update)
+    states = vote_updates(races, 'races')
+    county_updates = vote_updates(counties.assign(timestamp=counties['last_updated']), 'counties')
+    county_times = pd.to_datetime(county_updates['timestamp'], utc=True)
+    residuals = []
+    for state, state_updates in states.groupby('state', sort=False):
+        in_state = (county_updates['state'] == state).to_numpy()
+        first = True
+        for update in state_updates.itertuples():
+            end = pd.Timestamp(update.timestamp)
+            window = in_state & (county_times <= end).to_numpy()
+            if not first:
+                window &= (county_times > pd.Timestamp(update.prev_timestamp)).to_numpy()
+            first = False
+            residuals.append(update.d_votes - county_updates.loc[window, 'd_votes'].sum())
+    return np.array(residuals)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--counties', type=int, default=60)
+    parser.add_argument('--timestamps', type=int, default=300)
+    args = parser.parse_args()
+    #the anomalies are planted in GA (the 10th state) and AL, GA's late county before the last hour,
+    #and its first 3 counties are split between precincts
+    if not STATES.index('GA') < args.states <= len(STATES):
+        parser.error('--states must be between {} and {}'.format(STATES.index('GA') + 1, len(STATES)))
+    if args.counties < 4 or args.timestamps < 70:
+        parser.error('at least 4 counties and 70 timestamps are needed')
+
+    races, counties, precincts = outputs(args.states, args.counties, args.timestamps)
+    expected, t_loop = timed(reconcile_loop, races, counties)
+    (states, county_updates), t_vectorized = timed(reconcile, races, counties, precincts)
+    np.testing.assert_array_equal(states['residual_votes'].to_numpy(), expected)
+    (lagged, lagged_counties), _ = timed(reconcile, races, counties, lag=pd.Timedelta('10min'))
+
+    unexplained = states[~states['explained']]
+    assert set(unexplained['state']) == {'GA', 'AL'} and (unexplained['state'] == 'GA').sum() == 2
+    assert set(lagged.loc[~lagged['explained'], 'state']) == {'AL'}
+    assert lagged_counties.loc[lagged_counties['late'], 'county'].tolist() == ['county-0']
+    precinct_counties = county_updates[county_updates['precincts'] > 0]
+    assert precinct_counties['explained'].all() and precinct_counties['county'].nunique() == 3
+
+    print('{} state updates, {} county updates, {} precinct rows'.format(len(states), len(county_updates), len(precincts)))
+    print('  unexplained state updates: {} (the late county and the jump), {} with a 10 minute lag'.format(
+        len(unexplained), (~lagged['explained']).sum()))
+    print('  per-update loop: {:6.2f} s'.format(t_loop))
+    print('  reconcile:       {:6.2f} s ({:.0f}x, with precincts)'.format(t_vectorized, t_loop / t_vectorized))
@@ -0,0 +1,78 @@
+"""Memory of a state's accumulated precinct rows: a dict per row vs. the compact record layer.
+
+    python benchmarks/bench_records.py --precincts 9000 --snapshots 10
+
+The original scraper's `load_data` builds a dict per row for every snapshot and turns them into
+a DataFrame; `load_data_streaming` accumulates the rows in a `RecordBuffer` (interned categorical
+labels, nullable integer counts) and the snapshots are merged with `concat_records`.  Peak is
+the peak of Python allocations (tracemalloc) while accumulating all snapshots, resident is the
+final DataFrame's `memory_usage(deep=True)`.  Both are checked to hold the same rows.
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.cache import CachedResponse
+from election2020.records import concat_records
+from election2020.scripts import load_script
+from election2020.sinks import uncategorize
+from tests.synthetic import precinct_json, precinct_timestamps
+
+
+URL = ('https://web.archive.org/web/20201104052000if_/https://static01.nyt.com/elections-assets/'
+       '2020/data/api/2020-11-03/precincts/PAGeneralConcatenator-{}.130Z.json')
+
+
+def profiled(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--precincts', type=int, default=9000)
+    parser.add_argument('--snapshots', type=int, default=10)
+    args = parser.parse_args()
+
+    scraper = load_script('precincts')
+    files = {URL.format(timestamp): precinct_json(args.precincts, seed=i)
+             for i, timestamp in enumerate(precinct_timestamps(args.snapshots))}
+    fetch = lambda url, **kwargs: CachedResponse(url, files[url], {})
+
+    def per_row_dicts():
+        records = []
+        for url in files:
+            scraper.load_data(url, 'PA', out=records, fetch=fetch)
+        return pd.DataFrame.from_records(records)
+
+    def compact():
+        return concat_records(scraper.load_data_streaming(url, 'PA', fetch=fetch) for url in files)
+
+    dicts_df, t_dicts, m_dicts = profiled(per_row_dicts)
+    compact_df, t_compact, m_compact = profiled(compact)
+
+    #same rows: labels as strings (missing as ''), counts as floats
+    vote_columns = ['votes', 'votes_biden', 'votes_trump', 'votes_jorgensen', 'votes_other']
+    def labels(df):
+        df = uncategorize(df).drop(columns=vote_columns).astype(object)
+        return df.where(df.notna(), '').astype(str)
+    pd.testing.assert_frame_equal(labels(dicts_df), labels(compact_df))
+    np.testing.assert_array_equal(dicts_df[vote_columns].to_numpy(dtype=float),
+                                  compact_df[vote_columns].astype(float).to_numpy())
+
+    r_dicts = dicts_df.memory_usage(deep=True).sum()
+    r_compact = compact_df.memory_usage(deep=True).sum()
+    print('{} rows from {} snapshots'.format(len(compact_df), len(files)))
+    print('  dict per row: {:7.1f} MB peak, {:7.1f} MB resident, {:.1f} s'.format(m_dicts / 1e6, r_dicts / 1e6, t_dicts))
+    print('  record layer: {:7.1f} MB peak, {:7.1f} MB resident, {:.1f} s'.format(m_compact / 1e6, r_compact / 1e6, t_compact))
@@ -0,0 +1,111 @@
+"""Time to draw a state's curve over a time window: re-aggregating the county rows vs. reading the `RollupCache`.
+
+    python benchmarks/bench_rollup.py --states 50 --counties 60 --timestamps 3000
+
+A synthetic county output (every county updating at random minutes over about two days) is
+rolled up, and each state's curve is checked against re-aggregating the county rows with pandas
+the way the README's figures do (every county's latest counts summed at each time, then the last
+value in each bucket).  The rollups of the last 20 timestamps are then rebuilt one live snapshot
+at a time with `refresh` and checked to be identical to a full `add`.  The times to get the
+curve of a whole state and of a 30 minute window (from the state's first update 5 hours into the
+night, or its last update on a shorter night) are compared.
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.rollup import RollupCache
+from tests.synthetic import STATES, precinct_timestamps
+
+
+def county_output(num_states, num_counties, num_timestamps, update_fraction=0.02, seed=0):
+    #one row per county update (like `remove_duplicates`'s output), with cumulative counts
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Series(precinct_timestamps(num_timestamps, freq='1min')) + 'Z'
+    updated = rng.random((num_states, num_counties, num_timestamps)) < update_fraction
+    updated[:, :, 0] = True
+    votes = np.where(updated[..., None], rng.poisson(200, size=updated.shape + (3,)), 0).cumsum(axis=2)
+    s, c, t = np.nonzero(updated)
+    return pd.DataFrame({
+        'state': np.asarray(STATES, dtype=object)[s], 'county': pd.Series(c).map('county-{}'.format),
+        'timestamp': timestamps.to_numpy()[t], 'votes_dem': votes[s, c, t, 0], 'votes_rep': votes[s, c, t, 1],
+        'votes_jorgensen': votes[s, c, t, 2], 'votes2020': votes[s, c, t].sum(axis=1),
+    })
+
+def state_curve(counties, state, resolution, start=None, end=None):
+    #every county's latest votes, summed at each time, and the last sum in each bucket
+    df = counties[counties['state'] == state]
+    df = df.assign(time=pd.to_datetime(df['timestamp'], utc=True))
+    wide = df.pivot_table(index='time', columns='county', values='votes2020', aggfunc='last').ffill().fillna(0)
+    curve = wide.sum(axis=1)
+    curve = curve.groupby(curve.index.floor(resolution)).last()
+    if start is not None:
+        curve = curve[(curve.index >= pd.Timestamp(start).floor(resolution)) & (curve.index <= pd.Timestamp(end))]
+    return curve
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--counties', type=int, default=60)
+    parser.add_argument('--timestamps', type=int, default=3000)
+    args = parser.parse_args()
+    if not 1 <= args.states <= len(STATES):
+        parser.error('--states must be between 1 and {}'.format(len(STATES)))
+    if args.counties < 1 or args.timestamps < 2:
+        parser.error('at least 1 county and 2 timestamps are needed')
+
+    counties = county_output(args.states, args.counties, args.timestamps)
+    tmp_dir = Path(tempfile.mkdtemp())
+    cache = RollupCache(tmp_dir / 'rollups.sqlite')
+    _, t_add = timed(cache.add, 'counties', counties)
+
+    for state in STATES[:args.states:10]:
+        for resolution in ('5min', '1h'):
+            rollups = cache.rollups('counties', 'state', state, resolution=resolution)
+            expected = state_curve(counties, state, resolution)
+            np.testing.assert_array_equal(rollups['time'].to_numpy(), expected.index.to_numpy())
+            np.testing.assert_array_equal(rollups['votes'].to_numpy(), expected.to_numpy())
+
+    #the last timestamps (all of them, for a short night), one live snapshot at a time
+    times = np.sort(counties['timestamp'].unique())
+    num_live = min(20, len(times))
+    live = RollupCache(tmp_dir / 'live.sqlite')
+    live.add('counties', counties[counties['timestamp'] < times[-num_live]])
+    start = time.perf_counter()
+    for timestamp in times[-num_live:]:
+        live.refresh('counties', counties[counties['timestamp'] == timestamp])
+    t_refresh = (time.perf_counter() - start) / num_live
+    query = 'SELECT * FROM rollups ORDER BY dataset, level, resolution, state, county, race_id, bucket'
+    pd.testing.assert_frame_equal(pd.read_sql_query(query, live.db), pd.read_sql_query(query, cache.db))
+
+    state = STATES[0]
+    night_start = pd.Timestamp(times[0])
+    state_times = pd.to_datetime(np.sort(counties.loc[counties['state'] == state, 'timestamp'].unique()), utc=True)
+    window_start = state_times[min(state_times.searchsorted(night_start + pd.Timedelta('5h')), len(state_times) - 1)]
+    window_end = window_start + pd.Timedelta('30min')
+    _, t_raw_all = timed(state_curve, counties, state, '1h')
+    all_buckets, t_cache_all = timed(cache.rollups, 'counties', 'state', state)
+    _, t_raw_window = timed(state_curve, counties, state, '1min', window_start, window_end)
+    window, t_cache_window = timed(cache.rollups, 'counties', 'state', state, start=window_start, end=window_end)
+
+    print('{} county rows ({} states x {} counties, {} minutes): state curves match pandas, refresh matches add'.format(
+        len(counties), args.states, args.counties, args.timestamps))
+    print('  add:                {:8.2f} s, refresh with one snapshot: {:6.1f} ms'.format(t_add, t_refresh * 1000))
+    print('  whole state, pandas: {:7.1f} ms, rollups ({} {} buckets): {:6.1f} ms'.format(
+        t_raw_all * 1000, len(all_buckets), all_buckets['resolution'].iloc[0], t_cache_all * 1000))
+    print('  30 minutes, pandas:  {:7.1f} ms, rollups ({} {} buckets): {:6.1f} ms'.format(
+        t_raw_window * 1000, len(window), window['resolution'].iloc[0], t_cache_window * 1000))
+    cache.close()
+    live.close()
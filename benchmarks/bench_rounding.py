@@ -0,0 +1,98 @@
+"""Time to bound every update's candidate votes from rounded vote fractions: a per-row loop vs. `vote_bounds`.
+
+    python benchmarks/bench_rounding.py --states 50 --races 10 --timestamps 300
+
+Synthetic race outputs (like `state_table`'s) are made from exact cumulative counts of each
+candidate, with the vote fractions rounded to three decimals like the NYT's.  The bounds of every
+row and update are computed by a Python loop over the rows with exact fractions (the way the
+README's interval reasoning is done by hand, for one update at a time) and by `vote_bounds`; they
+are checked to be identical and to contain the true counts, and their width is reported.
+"""
+import argparse
+import math
+import sys
+import time
+from fractions import Fraction
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.rounding import PARTIES, vote_bounds
+from tests.synthetic import STATES, precinct_timestamps
+
+
+def race_frame(num_states, num_races, num_timestamps, seed=0):
+    #cumulative counts of dem, rep, extra and other candidates, and the rounded fractions
+    rng = np.random.default_rng(seed)
+    size = (num_states, num_races, num_timestamps)
+    batches = rng.poisson(lam=[3000, 3000, 100, 20], size=size + (4,)) * (rng.random(size + (1,)) < 0.7)
+    counts = batches.cumsum(axis=2).reshape(-1, 4)
+    votes = counts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(votes[:, None] > 0, counts[:, :3] / votes[:, None], 0).round(3)
+    s, r, t = np.unravel_index(np.arange(len(votes)), size)
+    races = pd.DataFrame({
+        'state': np.asarray(STATES, dtype=object)[s], 'race_id': pd.Series(r).map('G-H-{:02d}'.format),
+        'timestamp': (pd.Series(precinct_timestamps(num_timestamps, freq='3min')) + 'Z').to_numpy()[t],
+        'votes2020': votes, 'vf_dem': shares[:, 0], 'vf_rep': shares[:, 1], 'vf_extra': shares[:, 2],
+    })
+    return races, counts[:, :3]
+
+def vote_bounds_loop(races):
+    #the bounds of every row, one candidate at a time, with exact fractions
+    half = Fraction(1, 2000)
+    rows, previous = [], {}
+    for row in races.itertuples(index=False):
+        votes = int(row.votes2020)
+        bounds = {}
+        for party in PARTIES:
+            share = Fraction(round(getattr(row, 'vf_' + party) * 1000), 1000)
+            bounds[party] = [max(0, math.ceil((share - half) * votes)), min(votes, math.floor((share + half) * votes))]
+        for party in PARTIES:
+            others = sum(bounds[other][0] for other in PARTIES if other != party)
+            bounds[party][1] = min(bounds[party][1], votes - others)
+        record = {}
+        prev = previous.get((row.state, row.race_id))
+        for party in PARTIES:
+            record['votes_{}_min'.format(party)], record['votes_{}_max'.format(party)] = bounds[party]
+            record['d_{}_min'.format(party)] = bounds[party][0] - prev[party][1] if prev else np.nan
+            record['d_{}_max'.format(party)] = bounds[party][1] - prev[party][0] if prev else np.nan
+        previous[row.state, row.race_id] = bounds
+        rows.append(record)
+    return pd.DataFrame(rows)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--races', type=int, default=10)
+    parser.add_argument('--timestamps', type=int, default=300)
+    args = parser.parse_args()
+
+    races, truth = race_frame(args.states, args.races, args.timestamps)
+    start = time.perf_counter()
+    expected = vote_bounds_loop(races)
+    t_loop = time.perf_counter() - start
+    start = time.perf_counter()
+    bounds = vote_bounds(races)
+    t_vectorized = time.perf_counter() - start
+
+    #the synthetic rows are already in state, race and timestamp order
+    pd.testing.assert_frame_equal(bounds[expected.columns], expected.astype(float), check_dtype=False)
+    widths = []
+    for i, party in enumerate(PARTIES):
+        low, high = bounds['votes_{}_min'.format(party)], bounds['votes_{}_max'.format(party)]
+        assert ((low <= truth[:, i]) & (truth[:, i] <= high)).all()
+        d_truth = pd.Series(truth[:, i]).groupby([races['state'], races['race_id']]).diff()
+        d_low, d_high = bounds['d_{}_min'.format(party)], bounds['d_{}_max'.format(party)]
+        assert ((d_low <= d_truth) & (d_truth <= d_high) | d_truth.isna()).all()
+        widths.append((d_high - d_low).median())
+
+    print('{} rows ({} states x {} races x {} timestamps), true counts within every bound'.format(
+        len(races), args.states, args.races, args.timestamps))
+    print('  median width of an update\'s bounds: {}'.format(
+        ', '.join('{} {:.0f} votes'.format(party, width) for party, width in zip(PARTIES, widths))))
+    print('  per-row loop: {:7.2f} s'.format(t_loop))
+    print('  vote_bounds:  {:7.2f} s ({:.0f}x)'.format(t_vectorized, t_loop / t_vectorized))
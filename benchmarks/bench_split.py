@@ -0,0 +1,94 @@
+"""Time to split a precinct output into one file per county: a line-by-line splitter vs. `split_csv`.
+
+    python benchmarks/bench_split.py --precincts 9000 --timestamps 40
+
+A synthetic precinct output (written like `postprocess_state`'s csv) is split by county with a
+Python port of `PS/get-csvSplit.ps1` (which reads the file once to find the values and again to
+write them out, line by line) and with `split_csv`, plain and gzipped and with few open files.
+Every partition is checked against reading the whole file with pandas and filtering it.  A block
+of lines with a quoted county (and a comma in it) is added to check the csv module fallback.
+"""
+import argparse
+import gzip
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.split import csv_stem, partition_path, split_csv
+from tests.synthetic import precinct_frame
+
+
+def split_lines(path, column, output_dir):
+    #one pass to find the values, then every line is appended to its value's file as it's read
+    stem = csv_stem(path)
+    with open(path) as f:
+        header = f.readline()
+        index = header.rstrip('\n').split(',').index(column)
+        values = set(line.rstrip('\n').split(',')[index] for line in f)
+    paths = {value: partition_path(output_dir, stem, value) for value in values}
+    for value, value_path in paths.items():
+        with open(value_path, 'w') as out:
+            out.write(header)
+    with open(path) as f:
+        f.readline()
+        for line in f:
+            with open(paths[line.rstrip('\n').split(',')[index]], 'a') as out:
+                out.write(line)
+    return paths
+
+def check(partitions, expected):
+    assert set(partitions) == set(expected['county'].unique())
+    for county, (partition_file, num_rows) in partitions.items():
+        df = pd.read_csv(partition_file, dtype=str, keep_default_na=False)
+        pd.testing.assert_frame_equal(df, expected[expected['county'] == county].reset_index(drop=True))
+        assert num_rows == len(df)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--precincts', type=int, default=9000)
+    parser.add_argument('--timestamps', type=int, default=40)
+    parser.add_argument('--line-by-line', action='store_true', help='also time the line-by-line splitter (slow)')
+    args = parser.parse_args()
+
+    tmp_dir = Path(tempfile.mkdtemp())
+    try:
+        df = precinct_frame(args.precincts, args.timestamps, vote_types=['absentee', 'electionday', 'provisional', 'total'])
+        quoted = df.head(1000).assign(county='Bibb, GA')
+        df = pd.concat([df.iloc[:len(df) // 2], quoted, df.iloc[len(df) // 2:]], ignore_index=True)
+        path = tmp_dir / 'GA_precincts_timeseries_2020_processed.csv'
+        df.to_csv(path, index=False)
+        with open(path, 'rb') as f, gzip.open(tmp_dir / (path.name + '.gz'), 'wb') as out:
+            shutil.copyfileobj(f, out)
+        expected = pd.read_csv(path, dtype=str, keep_default_na=False)
+        size = path.stat().st_size / 1024**2
+
+        partitions, t_split = timed(split_csv, path, 'county', output_dir=tmp_dir / 'plain')
+        check(partitions, expected)
+        partitions, t_few = timed(split_csv, path, 'county', output_dir=tmp_dir / 'few', max_open_files=4,
+                                  buffer_size=64 * 1024)
+        check(partitions, expected)
+        partitions, t_gzip = timed(split_csv, tmp_dir / (path.name + '.gz'), 'county', output_dir=tmp_dir / 'gzip',
+                                   compress=True)
+        check(partitions, expected)
+
+        print('{:.0f} MB, {} rows, {} counties: every partition matches pandas'.format(size, len(df), len(partitions)))
+        if args.line_by_line:
+            (tmp_dir / 'lines').mkdir()
+            _, t_lines = timed(split_lines, path, 'county', tmp_dir / 'lines')
+            print('  line by line:            {:6.2f} s ({:5.1f} MB/s)'.format(t_lines, size / t_lines))
+        print('  split_csv:               {:6.2f} s ({:5.1f} MB/s)'.format(t_split, size / t_split))
+        print('  split_csv, 4 open files: {:6.2f} s ({:5.1f} MB/s)'.format(t_few, size / t_few))
+        print('  split_csv, gzip in/out:  {:6.2f} s ({:5.1f} MB/s)'.format(t_gzip, size / t_gzip))
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,71 @@
+"""Time until a quick check answers: importing the scraper scripts vs. `python -m election2020`.
+
+    python benchmarks/bench_startup.py --repeat 5
+
+Checking a manifest or the response cache used to mean importing a scraper script (and with it
+pandas, numpy, requests and, for the improved precinct scraper, matplotlib) or opening the
+SQLite files by hand.  Each command runs in a fresh interpreter --repeat times against a data
+directory holding a manifest and a cached response; the best wall time is reported, along with
+the heavy modules each one imported.
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.cache import ResponseCache
+from election2020.manifest import ScrapeManifest
+
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'requests', 'bs4']
+PRECINCT_URL = ('https://web.archive.org/web/20201104052000/https://static01.nyt.com/elections-assets/'
+                '2020/data/api/2020-11-03/precincts/GAGeneral-2020-11-04T05:18:09.130Z.json')
+
+#the heavy modules a command imported, printed by the interpreter on its way out
+REPORT_MODULES = ('import atexit, sys; atexit.register(lambda: print(sorted(m for m in {} if m in sys.modules), '
+                  'file=sys.stderr))').format(HEAVY_MODULES)
+
+
+def data_dir():
+    path = Path(tempfile.mkdtemp())
+    manifest = ScrapeManifest(path / 'precincts_manifest.sqlite')
+    manifest.add('GA', [PRECINCT_URL])
+    manifest.mark('GA', PRECINCT_URL, 'written', rows=1000)
+    manifest.close()
+    cache = ResponseCache(path / 'archive_cache')
+    cache.put(PRECINCT_URL, b'{"precincts": []}')
+    cache.close()
+    return path
+
+def timed_command(code, repeat):
+    best, modules = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', REPORT_MODULES + '\n' + code], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True)
+        best = min(best, time.perf_counter() - start)
+        modules = result.stderr.strip().splitlines()[-1]
+    return best, modules
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = data_dir()
+    commands = {
+        'import the improved precinct scraper': "from election2020.scripts import load_script; "
+                                                "load_script('precincts_improved')",
+        'import the county scraper':            "from election2020.scripts import load_script; load_script('county')",
+        'python -m election2020 status':        "from election2020.cli import main; main(['status', '-o', {!r}])".format(str(path)),
+        'python -m election2020 cache':         "from election2020.cli import main; main(['cache', '-o', {!r}])".format(str(path)),
+    }
+    print('Best of {} runs in a fresh interpreter:'.format(args.repeat))
+    for name, code in commands.items():
+        seconds, modules = timed_command(code, args.repeat)
+        print('  {:<38} {:6.2f} s  imports {}'.format(name + ':', seconds, modules))
@@ -0,0 +1,108 @@
+"""Time of common slices of the outputs: parsing the csv files with pandas vs. the results store.
+
+    python benchmarks/bench_store.py --states 50 --counties 60 --snapshots 200
+
+A deduplicated county output (like `remove_duplicates`') and a race output whose presidential
+rows are the sums of the counties (like `state_table`'s) are loaded into a `ResultsStore`.  Two
+queries are then timed both ways: one county's updates in a four hour window (the README's Bibb
+County example) and the reconciliation of a state's county totals with its state-level totals.
+The results are checked to agree, and the reconciled totals to match exactly.
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.sinks import CsvSink
+from election2020.store import ResultsStore
+from tests.synthetic import county_frame
+
+
+def race_frame(counties):
+    #the presidential race of every state at every county timestamp, with rounded vote fractions
+    totals = counties.groupby(['state', 'timestamp'], as_index=False)[['votes2020', 'votes_dem', 'votes_rep']].sum()
+    return pd.DataFrame({
+        'state':     totals['state'],
+        'race_id':   'G-P',
+        'date':      pd.to_datetime(totals['timestamp'], utc=True),
+        'timestamp': totals['timestamp'] + 'Z',
+        'votes2020': totals['votes2020'],
+        'vf_dem':    (totals['votes_dem'] / totals['votes2020']).round(3),
+        'vf_rep':    (totals['votes_rep'] / totals['votes2020']).round(3),
+        'vf_extra':  0.0,
+    })
+
+def timed(func, *args, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = func(*args)
+    return out, (time.perf_counter() - start) / repeat
+
+def county_updates_csv(path, state, county, start, end):
+    df = pd.read_csv(path, index_col=0)
+    df = df[(df['state'] == state) & (df['county'] == county)].sort_values('timestamp')
+    df['d_votes2020'] = df['votes2020'].diff()
+    dates = pd.to_datetime(df['timestamp'], utc=True)
+    return df[(dates >= start) & (dates <= end)]
+
+def reconcile_csv(county_path, race_path, state):
+    counties = pd.read_csv(county_path, index_col=0)
+    counties = counties[counties['state'] == state].groupby('timestamp')['votes2020'].sum()
+    races = pd.read_csv(race_path)
+    races = races[(races['state'] == state) & (races['race_id'] == 'G-P')]
+    races.index = pd.to_datetime(races['date'])
+    return counties.to_numpy() - races['votes2020'].asof(pd.to_datetime(counties.index, utc=True)).to_numpy()
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--counties', type=int, default=60)
+    parser.add_argument('--snapshots', type=int, default=200)
+    parser.add_argument('--budget', type=float, default=64, help='memory budget of the csv load in MB')
+    args = parser.parse_args()
+    temp_dir = Path(tempfile.mkdtemp())
+
+    counties = county_frame(args.states, args.counties, args.snapshots)
+    counties = counties.drop_duplicates(['state', 'timestamp', 'county'], keep='last').reset_index(drop=True)
+    counties.to_csv(temp_dir / 'county_presidential.csv')
+    races = race_frame(counties)
+    races.to_csv(temp_dir / 'election2020_house-senate-president.csv', index=False)
+
+    store = ResultsStore(temp_dir / 'election2020_results.sqlite')
+    start = time.perf_counter()
+    store.load('counties', CsvSink(temp_dir / 'county_presidential.csv'), memory_budget=int(args.budget * 1024**2))
+    store.add('races', races)
+    t_load = time.perf_counter() - start
+
+    #GA's county-7 at the default scale, or a state and county of the smaller ones
+    state = 'GA' if (counties['state'] == 'GA').any() else counties['state'].iloc[0]
+    state_counties = counties.loc[counties['state'] == state, 'county'].unique()
+    county = 'county-7' if 'county-7' in state_counties else state_counties[0]
+    window = pd.Timestamp('2020-11-04T05Z'), pd.Timestamp('2020-11-04T09Z')
+    expected, t_county_csv = timed(county_updates_csv, temp_dir / 'county_presidential.csv', state, county, *window)
+    updates, t_county_store = timed(store.county_updates, state, county, *window)
+    np.testing.assert_array_equal(updates['votes2020'].to_numpy(), expected['votes2020'].to_numpy())
+    np.testing.assert_array_equal(updates['d_votes2020'].to_numpy(), expected['d_votes2020'].to_numpy())
+
+    expected, t_reconcile_csv = timed(reconcile_csv, temp_dir / 'county_presidential.csv',
+                                      temp_dir / 'election2020_house-senate-president.csv', state)
+    reconciled, t_reconcile_store = timed(store.reconcile, state)
+    np.testing.assert_array_equal(reconciled['diff_votes'].to_numpy(), expected)
+    assert (reconciled['diff_votes'] == 0).all()
+    assert (reconciled['diff_dem'].abs() <= reconciled['state_votes'] * 0.0005 + 1).all()
+    store.close()
+
+    print('{} county rows, {} race rows: loaded in {:.1f} s ({:.0f} MB)'.format(
+        len(counties), len(races), t_load, (temp_dir / 'election2020_results.sqlite').stat().st_size / 1e6))
+    print('  {} updates of one county in four hours:'.format(len(updates)))
+    print('    csv:   {:8.1f} ms'.format(1000 * t_county_csv))
+    print('    store: {:8.1f} ms ({:.0f}x)'.format(1000 * t_county_store, t_county_csv / t_county_store))
+    print('  county vs. state totals of one state ({} timestamps, all reconciled):'.format(len(reconciled)))
+    print('    csv:   {:8.1f} ms'.format(1000 * t_reconcile_csv))
+    print('    store: {:8.1f} ms ({:.0f}x)'.format(1000 * t_reconcile_store, t_reconcile_csv / t_reconcile_store))
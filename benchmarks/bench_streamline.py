@@ -0,0 +1,50 @@
+"""Parity check and benchmark of `streamline_precincts` against the original `streamline_data`.
+
+    python benchmarks/bench_streamline.py --precincts 100000 --timestamps 200
+
+The original implementation takes hours at full scale, so it is only run (and compared
+row-for-row with the vectorized engine) on the smaller `--reference-*` dataset.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.scripts import load_script
+from election2020.streamline import streamline_precincts
+from tests.synthetic import assert_same_output, precinct_frame
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--precincts', type=int, default=100000)
+    parser.add_argument('--timestamps', type=int, default=200)
+    parser.add_argument('--vote-types', type=int, default=4)
+    parser.add_argument('--reference-precincts', type=int, default=300)
+    parser.add_argument('--reference-timestamps', type=int, default=50)
+    args = parser.parse_args()
+
+    streamline_data = load_script('precincts').streamline_data
+
+    for sum_counties in (True, False):
+        records = precinct_frame(args.reference_precincts, args.reference_timestamps, seed=1).to_dict('records')
+        expected_df, t_orig = timed(streamline_data, records, sum_counties=sum_counties)
+        actual_df, t_fast = timed(streamline_precincts, records, sum_counties=sum_counties)
+        assert_same_output(expected_df, actual_df)
+        print('parity ok (sum_counties={}): {} precincts x {} timestamps, {} rows; '
+              'original {:.2f} s, vectorized {:.2f} s ({:.0f}x)'.format(
+              sum_counties, args.reference_precincts, args.reference_timestamps, len(actual_df),
+              t_orig, t_fast, t_orig / t_fast))
+
+    vote_types = ['absentee', 'early', 'electionday', 'provisional'][:args.vote_types]
+    df = precinct_frame(args.precincts, args.timestamps, vote_types=vote_types, seed=2)
+    results_df, t_fast = timed(streamline_precincts, df, sum_counties=True)
+    print('vectorized: {} precincts x {} timestamps ({} input rows -> {} rows) in {:.1f} s'.format(
+          args.precincts, args.timestamps, len(df), len(results_df), t_fast))
@@ -0,0 +1,66 @@
+"""Time to pivot a precinct output to the wide table with change columns: the Power Query steps vs. `wide_table`.
+
+    python benchmarks/bench_wide.py --precincts 9000 --timestamps 40
+
+The steps of `ga_test` in PQ/script.pq.txt are replayed with pandas (unpivot the vote columns,
+merge each vote type and column name, pivot with a sum, then merge the table with itself offset
+by a row to subtract each row's previous values within its `fips_and_precinct`), and checked to
+give the same table as `wide_table` on a synthetic precinct output with a few duplicate rows.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.streamline import VOTE_COLUMNS
+from election2020.wide import ROW_COLUMNS, wide_table
+from tests.synthetic import precinct_frame
+
+
+def power_query_steps(df):
+    unpivoted = df.melt(id_vars=ROW_COLUMNS + ['vote_type'], value_vars=VOTE_COLUMNS,
+                        var_name='Attribute', value_name='Value').dropna(subset=['Value'])
+    unpivoted['Merged'] = unpivoted['vote_type'] + '.' + unpivoted['Attribute']
+    pivoted = unpivoted.pivot_table(index=ROW_COLUMNS, columns='Merged', values='Value', aggfunc='sum').reset_index()
+    pivoted.columns.name = None
+    #the pivoted columns in the order the unpivoted rows first show them (List.Distinct), not sorted
+    merged = ['{}.{}'.format(vote_type, column) for vote_type in dict.fromkeys(df['vote_type']) for column in VOTE_COLUMNS]
+    pivoted = pivoted[ROW_COLUMNS + merged]
+    pivoted['Index'] = np.arange(len(pivoted))
+    pivoted['fips_and_precinct'] = pivoted['fips'].astype(str) + '-' + pivoted['precinct']
+    vote_columns = [column for column in pivoted.columns if 'vote' in column]
+
+    #fnAddPreviousValueColumns: the table next to itself shifted down by a row
+    previous = pivoted.copy()
+    previous['Index'] += 1
+    with_previous = pivoted.merge(previous, on='Index', how='left', suffixes=('', '.Prev'))
+    for column in vote_columns:
+        same = with_previous['fips_and_precinct'] == with_previous['fips_and_precinct.Prev']
+        with_previous[column + '_change'] = np.where(same, with_previous[column] - with_previous[column + '.Prev'], 0)
+    return with_previous[ROW_COLUMNS + ['fips_and_precinct'] + vote_columns + [c + '_change' for c in vote_columns]]
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--precincts', type=int, default=9000)
+    parser.add_argument('--timestamps', type=int, default=40)
+    args = parser.parse_args()
+
+    df = precinct_frame(args.precincts, args.timestamps, vote_types=['absentee', 'electionday', 'provisional', 'total'])
+    df = pd.concat([df, df.sample(100, random_state=0)], ignore_index=True)
+    wide, t_vectorized = timed(wide_table, df)
+    expected, t_steps = timed(power_query_steps, df)
+
+    pd.testing.assert_frame_equal(wide, expected, check_dtype=False)
+    print('{} rows -> {} rows x {} columns, same table'.format(len(df), len(wide), len(wide.columns)))
+    print('  Power Query steps: {:6.2f} s'.format(t_steps))
+    print('  wide_table:        {:6.2f} s ({:.0f}x)'.format(t_vectorized, t_steps / t_vectorized))
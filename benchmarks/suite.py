@@ -0,0 +1,328 @@
+"""Offline benchmark suite: times and memory-profiles every scraper stage on fixed fixtures.
+
+    python benchmarks/suite.py --scales small pa national --output bench.json
+    python benchmarks/suite.py --baseline bench.json --threshold 0.25
+    python benchmarks/suite.py --recorded archive_cache --stages extract_precinct_data
+
+Each stage runs on the fixtures of every scale that has them: synthetic files shaped like the
+NYT's at the size of a small GA county ('small'), of the full PA files ('pa') and of all 50 state
+pages ('national'), or the archived responses recorded by a scraper's `ResponseCache` ('recorded',
+with --recorded).  A stage's time is the best of --repeat runs, and its peak memory the peak of
+Python allocations (tracemalloc) in one more run.  Results are written as JSON and, with a
+--baseline, any stage more than --threshold slower (or hungrier) than the baseline is flagged
+and the suite exits with status 1.
+"""
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.cache import CachedResponse, ResponseCache
+from election2020.records import concat_records
+from election2020.scripts import load_script
+from election2020.sinks import CsvSink, uncategorize
+from election2020.streamline import streamline_precincts
+from tests.synthetic import (STATES, county_frame, county_page_json, precinct_frame, precinct_json,
+                                  state_page_races)
+
+
+PRECINCT_URL = ('https://web.archive.org/web/20201104052000if_/https://static01.nyt.com/elections-assets/'
+                '2020/data/api/2020-11-03/precincts/{}GeneralConcatenator-2020-11-04T05:18:09.130Z.json')
+COUNTY_URL = ('https://web.archive.org/web/20201104052000if_/https://static01.nyt.com/elections-assets/'
+              '2020/data/api/2020-11-03/national-map-page/national/president.json')
+
+#fixture sizes of each synthetic scale (stages whose fixtures a scale doesn't define are skipped)
+SCALES = {
+    'small':    {'state': 'GA', 'precincts': 150, 'counties': 1, 'timestamps': 30,
+                 'states': 1, 'house': 14, 'counties_per_state': 159, 'snapshots': 50},
+    'pa':       {'state': 'PA', 'precincts': 9000, 'counties': 67, 'timestamps': 30,
+                 'states': 1, 'house': 18, 'counties_per_state': 67, 'snapshots': 200},
+    'national': {'states': 50, 'house': 9, 'counties_per_state': 62, 'snapshots': 200},
+}
+
+
+class Fixtures:
+    """The inputs of every stage at one scale, generated (or loaded) on first use."""
+
+    def __init__(self, scale, params, recorded=None):
+        self.scale = scale
+        self.params = params
+        self.recorded = recorded
+        self.cache = {}
+
+    def get(self, name):
+        if name not in self.cache:
+            self.cache[name] = getattr(self, '_' + name)()
+        return self.cache[name]
+
+    def _precinct_files(self):
+        #{archived url: raw json} of precinct files
+        if self.recorded is not None:
+            return self.recorded.get('precincts')
+        if 'precincts' not in self.params:
+            return None
+        p = self.params
+        return {PRECINCT_URL.format(p['state']): precinct_json(p['precincts'], num_counties=p['counties'])}
+
+    def _precinct_rows(self):
+        #the rows of a state's precinct files, as extracted by the original scraper
+        if self.recorded is not None:
+            files = self.get('precinct_files')
+            if not files:
+                return None
+            scraper = load_script('precincts')
+            fetch = lambda url, **kwargs: CachedResponse(url, files[url], {})
+            with contextlib.redirect_stdout(io.StringIO()):
+                frames = [scraper.load_data_streaming(url, url.split('/')[-1][:2], fetch=fetch) for url in files]
+            return concat_records(frames)
+        if 'precincts' not in self.params:
+            return None
+        p = self.params
+        return precinct_frame(p['precincts'], p['timestamps'], num_counties=p['counties'], state=p['state'])
+
+    def _state_pages(self):
+        #{state: the races of its state page}
+        if self.recorded is not None:
+            return self.recorded.get('state_pages')
+        p = self.params
+        return {state: state_page_races(state, 100, p['house'], seed=i)
+                for i, state in enumerate(([p['state']] if 'state' in p else STATES)[:p['states']])}
+
+    def _county_pages(self):
+        #{archived url: raw json} of national map pages
+        if self.recorded is not None:
+            return self.recorded.get('county_pages')
+        p = self.params
+        return {COUNTY_URL: county_page_json(p['states'], p['counties_per_state'])}
+
+    def _county_rows(self):
+        #the county scraper's output before `remove_duplicates`
+        if self.recorded is not None:
+            return None
+        p = self.params
+        return county_frame(p['states'], p['counties_per_state'], p['snapshots'])
+
+
+def recorded_fixtures(cache_dir):
+    """Sorts the responses recorded in a `ResponseCache` into precinct files, state pages and
+    national map pages."""
+    cache = ResponseCache(cache_dir)
+    recorded = {'precincts': {}, 'state_pages': {}, 'county_pages': {}}
+    for meta in cache.entries():
+        url, original = meta['archived_url'], meta['original']
+        if meta.get('statuscode', 200) >= 400:
+            continue
+        if '/precincts/' in original:
+            recorded['precincts'][url] = cache.get(url).content
+        elif '/state-page/' in original:
+            recorded['state_pages'][original.split('/')[-1][:-5]] = cache.get(url).json()['data']['races']
+        elif '/national-map-page/' in original or '/race-page/' in original:
+            recorded['county_pages'][url] = cache.get(url).content
+    cache.close()
+    return {name: files or None for name, files in recorded.items()}
+
+
+#every stage takes the fixtures and returns a function that runs it (and returns the number of
+#rows it produced), or None when the scale has no fixtures for it
+
+def stage_load_data(fixtures):
+    files = fixtures.get('precinct_files')
+    if not files:
+        return None
+    scraper = load_script('precincts')
+    fetch = lambda url, **kwargs: CachedResponse(url, files[url], {})
+    def run():
+        return sum(len(scraper.load_data(url, url.split('/')[-1][:2], fetch=fetch)) for url in files)
+    return run
+
+def stage_load_data_streaming(fixtures):
+    files = fixtures.get('precinct_files')
+    if not files:
+        return None
+    scraper = load_script('precincts')
+    fetch = lambda url, **kwargs: CachedResponse(url, files[url], {})
+    def run():
+        return sum(len(scraper.load_data_streaming(url, url.split('/')[-1][:2], fetch=fetch)) for url in files)
+    return run
+
+def stage_extract_precinct_data(fixtures):
+    files = fixtures.get('precinct_files')
+    if not files:
+        return None
+    improved = load_script('precincts_improved')
+    fetch = lambda url, **kwargs: CachedResponse(url, files[url], {})
+    def run():
+        return sum(len(improved.extract_precinct_data(url, url.split('/')[-1][:2], fetch=fetch)) for url in files)
+    return run
+
+def stage_streamline_precincts(fixtures):
+    rows = fixtures.get('precinct_rows')
+    if rows is None:
+        return None
+    def run():
+        return sum(len(streamline_precincts(state_rows)) for _, state_rows in rows.groupby('state', observed=True))
+    return run
+
+def stage_add_missing_totals(fixtures):
+    rows = fixtures.get('precinct_rows')
+    if rows is None:
+        return None
+    improved = load_script('precincts_improved')
+    #as `fill_missing_totals` reads them back from the unprocessed output
+    def run():
+        return sum(len(improved.add_missing_totals(uncategorize(state_rows)))
+                   for _, state_rows in rows.groupby('state', observed=True))
+    return run
+
+def stage_build_state_dataframe(fixtures):
+    pages = fixtures.get('state_pages')
+    if not pages:
+        return None
+    races = load_script('races')
+    def run():
+        return sum(len(races.build_state_dataframe(state_races)[1]) for state_races in pages.values())
+    return run
+
+def stage_extract_county_data(fixtures):
+    pages = fixtures.get('county_pages')
+    if not pages:
+        return None
+    county = load_script('county')
+    #the scraper pops the results out of the parsed json, so each run parses the body again
+    fetch = lambda url, **kwargs: CachedResponse(url, pages[url], {})
+    def run():
+        return sum(len(county.extract_county_data(url, fetch=fetch)) for url in pages)
+    return run
+
+def stage_remove_duplicates(fixtures):
+    rows = fixtures.get('county_rows')
+    if rows is None:
+        return None
+    county = load_script('county')
+    temp_dir = Path(tempfile.mkdtemp(prefix='bench_'))
+    atexit.register(shutil.rmtree, temp_dir, ignore_errors=True)
+    original = temp_dir / 'county_presidential_original.csv'
+    CsvSink(original).write(rows)
+    output = temp_dir / 'county_presidential.csv'
+    def run():
+        #`remove_duplicates` rewrites its output in place, so each run starts from a fresh copy
+        shutil.copyfile(original, output)
+        county.remove_duplicates(output)
+        return len(rows)
+    return run
+
+STAGES = {
+    'load_data':             stage_load_data,
+    'load_data_streaming':   stage_load_data_streaming,
+    'extract_precinct_data': stage_extract_precinct_data,
+    'streamline_precincts':  stage_streamline_precincts,
+    'add_missing_totals':    stage_add_missing_totals,
+    'build_state_dataframe': stage_build_state_dataframe,
+    'extract_county_data':   stage_extract_county_data,
+    'remove_duplicates':     stage_remove_duplicates,
+}
+
+
+def measure(run, repeat):
+    #the scrapers print their progress (and pandas its deprecation warnings); both are discarded
+    #while timing
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = run()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'rows': int(rows), 'seconds': min(times), 'mean_seconds': float(np.mean(times)),
+            'peak_mb': peak / 1e6, 'rows_per_second': rows / min(times) if min(times) > 0 else None}
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'pandas': pd.__version__,
+            'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def compare(results, baseline, threshold, min_seconds=0.05, min_mb=1):
+    """Flags every stage that got more than `threshold` slower (or used more than `threshold` more
+    memory) than in `baseline`.  Differences under `min_seconds` or `min_mb` are timing noise and
+    never flagged."""
+    previous = {(r['stage'], r['scale']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get((result['stage'], result['scale']))
+        if base is None:
+            continue
+        result['baseline_seconds'] = base['seconds']
+        result['time_ratio'] = result['seconds'] / base['seconds'] if base['seconds'] > 0 else None
+        result['memory_ratio'] = result['peak_mb'] / base['peak_mb'] if base['peak_mb'] > 0 else None
+        noticeable = {'time_ratio': result['seconds'] - base['seconds'] >= min_seconds,
+                      'memory_ratio': result['peak_mb'] - base['peak_mb'] >= min_mb}
+        for ratio in ('time_ratio', 'memory_ratio'):
+            if result[ratio] is not None and result[ratio] > 1 + threshold and noticeable[ratio]:
+                regressions.append((result['stage'], result['scale'], ratio, result[ratio]))
+    return regressions
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', nargs='+', default=['small', 'pa', 'national'], choices=list(SCALES))
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--recorded', help='directory of a ResponseCache to benchmark recorded responses')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    fixture_sets = [Fixtures(scale, SCALES[scale]) for scale in args.scales]
+    if args.recorded:
+        fixture_sets.append(Fixtures('recorded', {}, recorded=recorded_fixtures(args.recorded)))
+
+    results = []
+    for fixtures in fixture_sets:
+        for stage in args.stages:
+            run = STAGES[stage](fixtures)
+            if run is None:
+                continue
+            result = dict(stage=stage, scale=fixtures.scale, **measure(run, args.repeat))
+            results.append(result)
+            print('{:<22} {:<9} {:>9} rows {:8.3f} s {:8.1f} MB peak'.format(
+                stage, fixtures.scale, result['rows'], result['seconds'], result['peak_mb']))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for stage, scale, ratio, value in regressions:
+            print('!!! regression: {} ({}) {} {:.2f}x the baseline'.format(stage, scale, ratio, value))
+        if not regressions:
+            print('no regressions against {} (threshold {:.0%})'.format(args.baseline, args.threshold))
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'threshold': args.threshold, 'results': results,
+                   'regressions': [dict(zip(('stage', 'scale', 'ratio', 'value'), r)) for r in regressions]},
+                  f, indent=2)
+    print('results written to {}'.format(args.output))
+    sys.exit(1 if regressions else 0)
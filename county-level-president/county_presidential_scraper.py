@@ -1,10 +1,26 @@
 import requests
-import time
+import functools
+import sys
 import tempfile
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.fetch import FetchEngine
+from election2020.live import LivePoller
+from election2020.cache import ResponseCache
+from election2020.cdx import CdxIndex, filter_hits, archived_urls
+from election2020.external import drop_duplicates_csv, iter_csv_by_ranges
+from election2020.manifest import ScrapeManifest
+from election2020.records import RecordBuffer, COUNTY_SCHEMA
+from election2020.metrics import METRICS, Timer
+from election2020.sinks import CsvSink, ParquetSink, as_sink, uncategorize
+from election2020.updates import UpdateIndex
+from election2020.store import ResultsStore
+from election2020.rollup import RollupCache
+
 
 def get_archived_county_results(race):
     if race['race_id'][2:6] != '-G-P':
@@ -36,47 +52,102 @@ def get_archived_county_results(race):
     
     return state_records
 
-def load_county_presidential(nyt_url, csv_path):
-    print('Searching for archived copies of the U.S. presidential election results')
+def get_archived_county_columns(race):
+    #column-wise equivalent of `get_archived_county_results` (see `RecordBuffer.extend`)
+    if race['race_id'][2:6] != '-G-P':
+        return {}, 0
+    print(race['race_id'])
 
-    archive_api_url = 'http://web.archive.org/cdx/search/cdx?url='
-    archive_output_qualifier = '&output=json&from=20201104&to=20201107'   #limit search to election day +4
-    search_hits = requests.get(archive_api_url + nyt_url + archive_output_qualifier).json()[1:]
+    counties = race['counties']
+    absentee = [county['results_absentee'] for county in counties]
+    results = [county['results'] for county in counties]
+    return {
+        'state':              race['state_id'],
+        'county':             [county['name'].lower().replace(' ', '-') for county in counties],
+        'fips':               [county['fips'] for county in counties],
+        'timestamp':          race['last_updated'],
+        'last_updated':       [county['last_updated'] for county in counties],
+        'absentee_dem':       [r.get('bidenj', np.nan) for r in absentee],
+        'absentee_rep':       [r.get('trumpd', np.nan) for r in absentee],
+        'absentee_jorgensen': [r.get('jorgensenj', np.nan) for r in absentee],
+        'votes_dem':          [r.get('bidenj', np.nan) for r in results],
+        'votes_rep':          [r.get('trumpd', np.nan) for r in results],
+        'votes_jorgensen':    [r.get('jorgensenj', np.nan) for r in results],
+        'absentee2020':       [county.get('absentee_votes', np.nan) for county in counties],
+        'votes2020':          [county.get('votes', np.nan) for county in counties],
+        'margin2020':         [county.get('margin2020', np.nan) for county in counties],
+        'votes2016':          [county.get('votes2016', np.nan) for county in counties],
+        'margin2016':         [county.get('margin2016', np.nan) for county in counties],
+        'votes2012':          [county.get('votes2012', np.nan) for county in counties],
+        'margin2012':         [county.get('margin2012', np.nan) for county in counties],
+    }, len(counties)
+
+def extract_county_data(archived_url, fetch=requests.get):
+    print('Downloading national data from {}'.format(archived_url))
+    with Timer() as download_timer:
+        race_data = fetch(archived_url)
+    print('Download successful, took {:.1f} seconds'.format(download_timer.elapsed))
     
-    urls_searched = []
-    for i, url_group in enumerate(search_hits):
-        try:
-            archived_url = 'http://web.archive.org/web/' + url_group[1] + 'if_/' + url_group[2]
-            good_url_status = int(url_group[4]) < 400
-            correct_data_type = url_group[3] == 'application/json'
-            url_is_new = not archived_url in urls_searched
-        except:
+    #rows are accumulated column by column, with interned (categorical) labels and nullable
+    #integer vote counts, rather than as a dict per county
+    with Timer() as parse_timer:
+        vote_records = RecordBuffer(COUNTY_SCHEMA)
+        for race in race_data.json()['data']['races']:
+            vote_records.extend(*get_archived_county_columns(race))
+        results_df = vote_records.to_frame() if len(vote_records) else pd.DataFrame()
+    METRICS.record_rows('counties', len(results_df), parse_timer.elapsed)
+    
+    print('Data extraction successful, took {:.1f} seconds'.format(parse_timer.elapsed))
+    return results_df
+
+SEARCH_DATES = {'from_date': '20201104', 'to_date': '20201107'}   #limit search to election day +4
+
+
+def load_county_presidential(nyt_url, output, engine=None, manifest=None, cdx=None):
+    #`output` is the path of the csv file to append to, or any output sink (see election2020/sinks.py)
+    print('Searching for archived copies of the U.S. presidential election results')
+    output = as_sink(output)
+
+    close_engine = engine is None
+    if engine is None:
+        engine = FetchEngine()
+
+    if cdx is None:
+        cdx = CdxIndex(engine)
+
+    #every good json capture, except for captures identical to an earlier one (the pages were
+    #often archived again before the NYT updated them)
+    search_hits = filter_hits(cdx.search(nyt_url, **SEARCH_DATES), unique=None)
+    urls_searched = archived_urls(search_hits)
+
+    #skip archived copies that a previous (possibly interrupted) run already wrote to the output
+    scope = output.path.name
+    if manifest is not None:
+        manifest.recover(scope)
+        manifest.add(scope, urls_searched)
+        urls_searched = manifest.remaining(scope, urls_searched)
+
+    #downloads and extraction run concurrently on the engine's thread pool, while the output
+    #is only ever appended to from this thread
+    extract = functools.partial(extract_county_data, fetch=engine.get)
+    for archived_url, results_df, error in engine.map(extract, urls_searched):
+        if error is not None:
+            print('Failed to extract data from {} with error: {}'.format(archived_url, str(error)))
+            if manifest is not None:
+                manifest.mark(scope, archived_url, 'failed', error=str(error))
             continue
-        
-        if good_url_status and correct_data_type and url_is_new:
-            urls_searched.append(archived_url)
-            try:
-                print('Downloading national data from {}'.format(archived_url))
-                download_start = time.time()
-                race_data = requests.get(archived_url)
-                download_finish = time.time()
-                print('Download successful, took {:.1f} seconds'.format(download_finish - download_start))
-                
-                vote_records = []
-                for race in race_data.json()['data']['races']:
-                    vote_records += get_archived_county_results(race)
-                results_df = pd.DataFrame.from_records(vote_records)
-                results_df.to_csv(csv_path, mode='a', header=~csv_path.is_file())
-                
-                print('Data extraction successful, took {:.1f} seconds'.format(time.time() - download_finish))
-                print('Waiting 5x length of previous download as courtesy before continuing...')
-                time.sleep(5 * (download_finish - download_start))
-                
-            except Exception as e:
-                print('Failed to extract data from {} with error: {}'.format(archived_url, str(e)))
-
-def scrape_state_pages(csv_path):
-    states_list = ['Alaska', 'Alabama', 'Arkansas', 'Arizona', 'California', 
+        if manifest is not None:
+            manifest.mark(scope, archived_url, 'parsed', rows=len(results_df))
+            manifest.begin_write(scope, archived_url, output.path)
+        with METRICS.timer('write_seconds', dataset='counties', format=output.format):
+            output.write(results_df, key=archived_url)
+        if manifest is not None:
+            manifest.end_write(scope, archived_url)
+
+    if close_engine:
+        engine.close()
+
+states_list = ['Alaska', 'Alabama', 'Arkansas', 'Arizona', 'California', 
      'Colorado', 'Connecticut', 'Delaware', 'Florida', 'Georgia',
      'Hawaii', 'Iowa', 'Idaho', 'Illinois', 'Indiana', 'Kansas', 'Kentucky',
      'Louisiana', 'Massachusetts', 'Maryland', 'Maine', 'Michigan',
@@ -87,34 +158,163 @@ def scrape_state_pages(csv_path):
      'Utah', 'Virginia', 'Vermont', 'Washington', 'Wisconsin',
      'West Virginia', 'Wyoming']
 
-    for state in states_list:
+def scrape_state_pages(output, engine=None, manifest=None, cdx=None, states=states_list):
+    nyt_urls = []
+    for state in states:
         state_str = state.lower().replace(' ','-')
         nyt_urlC = 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/state-page/{}.json'.format(state_str)
-        load_county_presidential(nyt_urlC, csv_path)
         nyt_urlD = 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/race-page/{}/president.json'.format(state_str)
-        load_county_presidential(nyt_urlD, csv_path)
+        nyt_urls += [nyt_urlC, nyt_urlD]
+
+    #all 100 CDX searches run up front (concurrently), so each page's downloads start right away
+    if cdx is None:
+        cdx = CdxIndex(engine)
+    cdx.search_all(nyt_urls, **SEARCH_DATES)
+    for nyt_url in nyt_urls:
+        load_county_presidential(nyt_url, output, engine=engine, manifest=manifest, cdx=cdx)
     
-def scrape_national_pages(csv_path, all_pages=False):
+def scrape_national_pages(output, all_pages=False, engine=None, manifest=None, cdx=None):
     nyt_urlA = 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/national-map-page/national/president.json'
     nyt_urlB = 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/votes-remaining-page/national/president.json'
-    load_county_presidential(nyt_urlA, csv_path)
+    load_county_presidential(nyt_urlA, output, engine=engine, manifest=manifest, cdx=cdx)
     if all_pages:
-        load_county_presidential(nyt_urlB, csv_path)
+        load_county_presidential(nyt_urlB, output, engine=engine, manifest=manifest, cdx=cdx)
 
-def remove_duplicates(csv_path):
+def poll_county_results(nyt_url, output, poller, rollups=None):
+    """Appends the counties of every presidential race that was updated since the last poll of
+    the live page at `nyt_url` (see `election2020.live.LivePoller`), and adds them to the `rollups`
+    (a `RollupCache`) if given; returns the rows appended."""
+    output = as_sink(output)
+    response = poller.poll(nyt_url)
+    if response is None:
+        return 0
+
+    #only the races with a new `last_updated` are extracted
+    with Timer() as parse_timer:
+        vote_records = RecordBuffer(COUNTY_SCHEMA)
+        versions = {}
+        for race in response.json()['data']['races']:
+            if race['race_id'][2:6] != '-G-P' or not poller.is_new(nyt_url, race['race_id'], race['last_updated']):
+                continue
+            vote_records.extend(*get_archived_county_columns(race))
+            versions[race['race_id']] = race['last_updated']
+    METRICS.record_rows('counties', len(vote_records), parse_timer.elapsed)
+
+    if len(vote_records):
+        df = vote_records.to_frame()
+        with METRICS.timer('write_seconds', dataset='counties', format=output.format):
+            output.write(df, key=nyt_url)
+        if rollups is not None:
+            rollups.refresh('counties', df)
+    poller.mark(nyt_url, response, versions)
+    return len(vote_records)
+
+def remove_duplicates(output, memory_budget=None):
+    #with a `memory_budget` (in bytes), a csv output is deduplicated out of core, partitioned by
+    #state and county, holding about that many bytes of rows at a time
+    output = as_sink(output)
     cols_to_keep = ['state', 'county', 'fips', 'timestamp', 'last_updated', 
                     'absentee_dem', 'absentee_rep', 'absentee_jorgensen', 'votes_dem', 
                     'votes_rep', 'votes_jorgensen', 'absentee2020', 'votes2020', 
                     'margin2020', 'votes2016', 'margin2016', 'votes2012', 'margin2012']
 
-    temp = tempfile.NamedTemporaryFile(prefix=csv_path.name, dir=csv_path.parent, delete=False)
-    df = pd.read_csv(csv_path)[cols_to_keep].drop_duplicates(['state', 'timestamp', 'county'], keep='last')
-    df.to_csv(temp.name)
-    Path(temp.name).replace(csv_path)
+    with METRICS.timer('aggregate_seconds', dataset='counties', state='all'):
+        if memory_budget is not None and output.format == 'csv':
+            drop_duplicates_csv(output.path, ['state', 'timestamp', 'county'], keep='last', columns=cols_to_keep,
+                                index_col=0 if output.index else None, partition_by=['state', 'county'],
+                                memory_budget=memory_budget)
+            return
+        df = uncategorize(output.read())[cols_to_keep].drop_duplicates(['state', 'timestamp', 'county'], keep='last')
+        if output.format == 'csv':
+            temp = tempfile.NamedTemporaryFile(prefix=output.path.name, dir=output.path.parent, delete=False)
+            df.to_csv(temp.name)
+            Path(temp.name).replace(output.path)
+        else:
+            output.reset()
+            output.write(df, key='deduplicated')
+
+def run(src_dir='.', states=None, output_format='csv', memory_budget=512 * 1024**2, live_url=None, concurrency=4,
+        metrics_file=None):
+    """Backfills the county results from the archived national and state pages (only the pages
+    of `states`, a list of state names, if given), deduplicates them and indexes them, or with a
+    `live_url` polls the national page every minute; see the settings in `__main__`, or
+    `python -m election2020 county --help`."""
+    src_dir = Path(src_dir)
+    if metrics_file is None:
+        metrics_file = src_dir / 'county_metrics.jsonl'
+    if output_format == 'parquet':
+        output = ParquetSink(src_dir / 'county_presidential')
+    else:
+        output = CsvSink(src_dir / 'county_presidential.csv')
+
+    #raw archived responses are cached so that reruns replay from disk instead of the network
+    cache = ResponseCache(src_dir / 'archive_cache')
+    engine = FetchEngine(max_workers=concurrency, rate=0.5, burst=4, per_host=concurrency, cache=cache)
+    #tracks which archived copies made it into the output, so an interrupted run resumes
+    manifest = ScrapeManifest(src_dir / 'county_manifest.sqlite')
+    #CDX search results are reused for a day
+    cdx = CdxIndex(engine, src_dir / 'cdx_cache.sqlite')
+    METRICS.export_every(metrics_file)
+
+    if live_url is not None:
+        #every minute, one conditional request; only the states with new results are appended
+        poller = LivePoller(engine, src_dir / 'county_live.sqlite')
+        #the charts' rollups are refreshed with each new snapshot
+        rollups = RollupCache(src_dir / 'election2020_rollups.sqlite')
+        try:
+            poller.run([functools.partial(poll_county_results, live_url, output, poller, rollups)], interval=60)
+        except KeyboardInterrupt:
+            pass
+        poller.close()
+        rollups.close()
+    else:
+        #the national pages hold every state's counties, so they're skipped when only some states are scraped
+        if states is None:
+            scrape_national_pages(output, all_pages=False, engine=engine, manifest=manifest, cdx=cdx)
+            states = states_list
+        scrape_state_pages(output, engine=engine, manifest=manifest, cdx=cdx, states=states)   #<-- !!!Warning this will take ~24 hours and only net ~12k original rows!!!
+        remove_duplicates(output, memory_budget=memory_budget)
+
+        #per-county vote updates (differences between timestamps), for fast anomaly queries, and
+        #the county and state curves in minute to daily buckets, for charts
+        update_index = UpdateIndex(src_dir / 'vote_updates.sqlite')
+        rollups = RollupCache(src_dir / 'election2020_rollups.sqlite')
+        if memory_budget is not None and output.format == 'csv':
+            update_index.clear('counties')
+            rollups.clear('counties')
+            for df in iter_csv_by_ranges(output.path, 'county', memory_budget, index_col=0):
+                update_index.add('counties', df, replace=False)
+                rollups.add('counties', df, replace=False)
+            rollups.roll_up_states('counties')
+        else:
+            df = uncategorize(output.read())
+            update_index.add('counties', df)
+            rollups.add('counties', df)
+        update_index.close()
+        rollups.close()
+
+        #every row, indexed by state, county and time, for queries like one county's updates
+        store = ResultsStore(src_dir / 'election2020_results.sqlite')
+        store.load('counties', output, memory_budget=memory_budget)
+        store.close()
+    cdx.close()
+    engine.close()
+    manifest.close()
+    METRICS.stop_export()
+
 
 if __name__=='__main__':
     src_dir = '.'   #you'll need to put the path to your data directory here
-    csv_path = Path(src_dir + '/' + 'county_presidential.csv')
-    scrape_national_pages(csv_path, all_pages=False)
-    scrape_state_pages(csv_path)   #<-- !!!Warning this will take ~24 hours and only net ~12k original rows!!!
-    remove_duplicates(csv_path)
+    output_format = 'csv'   #or 'parquet' for a typed dataset partitioned by state (needs pyarrow)
+    #bytes of rows that deduplicating (and indexing) the csv output may hold in memory at a time
+    #(None reads the whole file)
+    memory_budget = 512 * 1024**2
+    #to follow an election live, the url of the national page to poll (e.g. the national-map-page
+    #url in `scrape_national_pages`) instead of backfilling archived copies
+    live_url = None
+    #counters and timings of the run (bytes fetched, rows parsed per second, backoff time, CDX hits
+    #filtered, ...), rewritten every minute; use a '.prom' file for the Prometheus text format
+    metrics_file = src_dir + '/' + 'county_metrics.jsonl'
+
+    run(src_dir, output_format=output_format, memory_budget=memory_budget, live_url=live_url,
+        metrics_file=metrics_file)
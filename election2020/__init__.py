@@ -0,0 +1,2 @@
+#Shared helpers for the scrapers in the *-president/ folders.  The scripts add the repository
+#root to `sys.path` so that they can keep being run directly from their own folders.
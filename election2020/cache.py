@@ -0,0 +1,229 @@
+import gzip
+import hashlib
+import json
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+NYT_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}')
+
+
+def nyt_source_url(url):
+    """The original NYT url of an archived copy (i.e., the `url[43:]` part of a Wayback url).
+
+    Urls that don't point at an archived copy (e.g., CDX queries) are returned unchanged.
+    """
+    url_pieces = url.split('/')
+    if len(url_pieces) > 5 and url_pieces[3] == 'web' and url_pieces[5].startswith('http'):
+        return '/'.join(url_pieces[5:])
+    return url
+
+
+def archive_key(url):
+    """Identifies the file behind an archived url, no matter which archived copy it points at.
+
+    The precinct files are timestamped by the NYT (e.g., `GAGeneral-2020-11-04T05:18:09.130Z.json`),
+    so every archived copy of the same source url holds the same data and the source url alone
+    is the key.  Untimestamped pages (e.g., `state-page/georgia.json`) changed between captures,
+    so their key keeps the 14-digit Wayback capture time as well.
+    """
+    source_url = nyt_source_url(url)
+    if source_url == url or NYT_TIMESTAMP.search(source_url.split('/')[-1]):
+        return source_url
+    return url.split('/')[4][:14] + '/' + source_url
+
+
+class CachedResponse:
+    """Stands in for a `requests.Response` when the body is replayed from the cache."""
+
+    def __init__(self, url, content, meta):
+        self.url = url
+        self.content = content
+        self.meta = meta
+        self.status_code = meta.get('statuscode', 200)
+        self.headers = {'Content-Type': meta.get('mimetype', 'application/json')}
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        #the (already read) body a chunk at a time, like a streamed `requests.Response`
+        view = memoryview(self.content)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+
+class ResponseCache:
+    """Content-addressed, size-capped on-disk cache of raw archived responses.
+
+    Bodies are stored gzipped under `objects/` and named by their sha256 digest, so identical
+    archived copies are only stored once.  A small SQLite index maps the `archive_key` of each
+    downloaded url to its body, along with the CDX-style metadata of the archived copy (wayback
+    timestamp, original url, mimetype, status code, length, digest).  Once the stored bodies exceed
+    `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=4 * 1024**3):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.cache_dir / 'index.sqlite'), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key          TEXT PRIMARY KEY,
+                digest       TEXT NOT NULL,
+                stored_bytes INTEGER NOT NULL,
+                meta         TEXT NOT NULL,
+                last_access  REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+        ''')
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _object_path(self, digest):
+        return self.objects_dir / digest[:2] / (digest + '.gz')
+
+    def __contains__(self, url):
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM entries WHERE key = ?',
+                                  (archive_key(url),)).fetchone()
+        return row is not None
+
+    def get(self, url):
+        """Returns a `CachedResponse` for `url` (or any other archived copy of the same file)."""
+        key = archive_key(url)
+        with self.lock:
+            row = self.db.execute('SELECT digest, meta FROM entries WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE entries SET last_access = ? WHERE key = ?',
+                            (time.time(), key))
+            self.db.commit()
+
+        digest, meta = row
+        try:
+            content = gzip.decompress(self._object_path(digest).read_bytes())
+        except FileNotFoundError:
+            self.discard(url)
+            return None
+        return CachedResponse(url, content, json.loads(meta))
+
+    def put(self, url, content, mimetype='application/json', statuscode=200):
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+        if not object_path.is_file():
+            object_path.parent.mkdir(exist_ok=True)
+            temp_path = object_path.with_suffix('.tmp{}'.format(threading.get_ident()))
+            temp_path.write_bytes(gzip.compress(content, compresslevel=6))
+            temp_path.replace(object_path)
+        self._add_entry(url, digest, len(content), mimetype, statuscode)
+
+    def put_chunks(self, url, chunks, mimetype='application/json', statuscode=200):
+        """Like `put` for a body read a chunk at a time (e.g. a streamed response): yields the
+        `chunks` as they're stored, and adds the entry once the last one was.  A body that isn't
+        read to the end isn't stored."""
+        digest = hashlib.sha256()
+        length = 0
+        temp = tempfile.NamedTemporaryFile(dir=self.objects_dir, suffix='.tmp', delete=False)
+        temp_path = Path(temp.name)
+        try:
+            with temp, gzip.GzipFile(fileobj=temp, mode='wb', compresslevel=6) as temp_file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    length += len(chunk)
+                    temp_file.write(chunk)
+                    yield chunk
+            object_path = self._object_path(digest.hexdigest())
+            object_path.parent.mkdir(exist_ok=True)
+            temp_path.replace(object_path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+        self._add_entry(url, digest.hexdigest(), length, mimetype, statuscode)
+
+    def _add_entry(self, url, digest, length, mimetype, statuscode):
+        #indexes the stored body `digest` under the archive key of `url`
+        url_pieces = url.split('/')
+        meta = {'timestamp': url_pieces[4][:14] if nyt_source_url(url) != url else None,
+                'original': nyt_source_url(url),
+                'archived_url': url,
+                'mimetype': mimetype,
+                'statuscode': statuscode,
+                'length': length,
+                'digest': digest}
+        key = archive_key(url)
+        stored_bytes = self._object_path(digest).stat().st_size
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                            (key, digest, stored_bytes, json.dumps(meta), time.time()))
+            self.db.commit()
+        self.evict()
+
+    def discard(self, url):
+        with self.lock:
+            self._delete_entries([archive_key(url)])
+
+    def _delete_entries(self, keys):
+        #must be called with `self.lock` held
+        digests = set()
+        for key in keys:
+            row = self.db.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                digests.add(row[0])
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        for digest in digests:
+            still_used = self.db.execute('SELECT 1 FROM entries WHERE digest = ?', (digest,)).fetchone()
+            if still_used is None:
+                self._object_path(digest).unlink(missing_ok=True)
+        self.db.commit()
+
+    def size(self):
+        """Bytes on disk taken up by the stored bodies (each unique body is counted once)."""
+        with self.lock:
+            return self._size()
+
+    def _size(self):
+        row = self.db.execute('SELECT SUM(stored_bytes) FROM '
+                              '(SELECT DISTINCT digest, stored_bytes FROM entries)').fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        with self.lock:
+            excess = self._size() - self.max_bytes
+            if excess <= 0:
+                return
+            lru_entries = self.db.execute('SELECT key, stored_bytes FROM entries '
+                                          'ORDER BY last_access').fetchall()
+            to_delete = []
+            for key, stored_bytes in lru_entries:
+                if excess <= 0:
+                    break
+                to_delete.append(key)
+                excess -= stored_bytes
+            self._delete_entries(to_delete)
+
+    def entries(self):
+        """Metadata of every cached response, least recently used first."""
+        with self.lock:
+            rows = self.db.execute('SELECT meta FROM entries ORDER BY last_access').fetchall()
+        return [json.loads(meta) for meta, in rows]
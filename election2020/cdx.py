@@ -0,0 +1,133 @@
+import gzip
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import pandas as pd
+
+from election2020.metrics import METRICS
+
+
+CDX_API_URL = 'http://web.archive.org/cdx/search/cdx'
+CDX_FIELDS = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length']
+WAYBACK_URL = 'https://web.archive.org/web/'
+
+
+def cdx_query_url(url, from_date=None, to_date=None, collapse=None, api_url=CDX_API_URL):
+    """The CDX API query for every capture of `url` (which may end in a `*` wildcard).
+
+    `collapse='digest'` asks the archive to drop captures identical to the previous one.
+    """
+    params = [('url', url), ('output', 'json')]
+    if from_date is not None:
+        params.append(('from', from_date))
+    if to_date is not None:
+        params.append(('to', to_date))
+    if collapse is not None:
+        params.append(('collapse', collapse))
+    return api_url + '?' + urlencode(params, safe=':/*')
+
+def parse_cdx(content):
+    #the json output is a list of rows, the first of which holds the field names
+    rows = json.loads(content) if content.strip() else []
+    if not rows:
+        return pd.DataFrame(columns=CDX_FIELDS)
+    return pd.DataFrame(rows[1:], columns=rows[0])
+
+def filter_hits(hits, mimetype='application/json', max_status=400, unique='original', dedup_digest=True):
+    """Filters CDX hits in one vectorized pass, keeping the order of the captures.
+
+    Drops captures with a status code of `max_status` or above (or none, e.g. '-' for revisits)
+    and, when given, of another `mimetype`.  With `unique`, only the first capture of every value of
+    that column (e.g., each original url) is kept, and with `dedup_digest` only the first capture of
+    every distinct body, so identical snapshots are never downloaded twice.
+    """
+    METRICS.inc('cdx_hits_total', len(hits))
+    keep = pd.to_numeric(hits['statuscode'], errors='coerce') < max_status
+    METRICS.inc('cdx_hits_filtered_total', int((~keep).sum()), reason='status')
+    if mimetype is not None:
+        wrong_type = keep & (hits['mimetype'] != mimetype)
+        METRICS.inc('cdx_hits_filtered_total', int(wrong_type.sum()), reason='mimetype')
+        keep &= ~wrong_type
+    hits = hits[keep]
+    if unique is not None:
+        num_hits = len(hits)
+        hits = hits.drop_duplicates(unique)
+        METRICS.inc('cdx_hits_filtered_total', num_hits - len(hits), reason='duplicate')
+    if dedup_digest:
+        num_hits = len(hits)
+        hits = hits.drop_duplicates('digest')
+        METRICS.inc('cdx_hits_filtered_total', num_hits - len(hits), reason='digest')
+    METRICS.inc('cdx_hits_kept_total', len(hits))
+    return hits
+
+def archived_urls(hits, raw=True):
+    """Wayback urls of the captures (`raw` urls, with `if_`, return the archived file untouched)."""
+    return (WAYBACK_URL + hits['timestamp'] + ('if_/' if raw else '/') + hits['original']).tolist()
+
+
+class CdxIndex:
+    """Wayback CDX searches, issued concurrently on a fetch engine and cached on disk for `ttl`
+    seconds (the archive keeps adding captures, so results can't be cached forever).
+
+    With no `path`, results are only cached in memory for the life of the index.  `api_url` can
+    point at a stand-in server (see `election2020.standin`).
+    """
+
+    def __init__(self, engine, path=None, ttl=24 * 3600, api_url=CDX_API_URL):
+        self.engine = engine
+        self.ttl = ttl
+        self.api_url = api_url
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(':memory:' if path is None else str(Path(path)), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS queries (
+                query   TEXT PRIMARY KEY,
+                fetched REAL NOT NULL,
+                body    BLOB NOT NULL
+            );
+        ''')
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _cached(self, query):
+        with self.lock:
+            row = self.db.execute('SELECT fetched, body FROM queries WHERE query = ?', (query,)).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        return gzip.decompress(row[1])
+
+    def _store(self, query, content):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO queries (query, fetched, body) VALUES (?, ?, ?)',
+                            (query, time.time(), gzip.compress(content)))
+            self.db.commit()
+
+    def search(self, url, from_date=None, to_date=None, collapse=None):
+        """Every capture of `url` as a DataFrame with the CDX fields as (string) columns."""
+        query = cdx_query_url(url, from_date, to_date, collapse, api_url=self.api_url)
+        content = self._cached(query)
+        METRICS.inc('cdx_queries_total', cached=str(content is not None).lower())
+        if content is None:
+            content = self.engine.get(query, cache=False).content
+            self._store(query, content)
+        return parse_cdx(content)
+
+    def search_all(self, urls, **kwargs):
+        """Runs the searches for all `urls` concurrently, returning `{url: hits}` in the order of
+        `urls` (searches that fail are left out and can be retried with `search`)."""
+        urls = list(urls)
+        search = lambda url: self.search(url, **kwargs)
+        results = {}
+        for url, hits, error in self.engine.map(search, urls):
+            if error is not None:
+                print('!!! CDX search failed for {}: {}'.format(url, error))
+                continue
+            results[url] = hits
+        return {url: results[url] for url in urls if url in results}
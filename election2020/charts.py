@@ -0,0 +1,165 @@
+"""Cumulative vote, per-update delta and margin charts of every state, county and race curve in
+the `RollupCache`, rendered a state at a time on a process pool.
+
+    python -m election2020 charts --output-dir data --states GA PA --workers 4
+
+Charts are written to `<charts_dir>/<dataset>/<state>/<level>[_<county or race>]_<kind>.png`.
+Each worker draws on figures of the non-interactive Agg canvas (no pyplot) that are made once
+and only have their lines' data replaced for every chart, and dense curves are downsampled to
+the points that keep each pixel column's extremes before they're drawn.
+"""
+import re
+from pathlib import Path
+
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from election2020.metrics import METRICS
+from election2020.parallel import StatePool
+from election2020.rollup import RollupCache
+from election2020.updates import CANDIDATES
+
+
+KINDS = ['cumulative', 'delta', 'margin']
+#the line of each candidate (and of the margin), in the colors and markers of the README's figures
+STYLES = {'dem': {'color': 'b', 'marker': 'o', 'label': 'Democrat'},
+          'rep': {'color': 'r', 'marker': 'D', 'label': 'Republican'},
+          'other': {'color': 'gray', 'marker': 's', 'label': 'Other'},
+          'margin': {'color': 'k', 'marker': None, 'label': 'Republican - Democrat'}}
+Y_LABELS = {'cumulative': 'Vote counts', 'delta': 'Votes added', 'margin': 'Margin (% of votes)'}
+TITLES = {'cumulative': 'votes', 'delta': 'vote updates', 'margin': 'margin'}
+
+#the figures of a worker process, reused for every chart of the same kind and size
+_FIGURES = {}
+
+
+def downsample(values, max_points):
+    """Indices (sorted) of at most about `max_points` rows of `values` (one column per line) to
+    draw: the first and last row, and the rows with the minimum and maximum of every line in each
+    of `max_points // 2` runs of rows, so spikes and dips survive."""
+    values = np.asarray(values, dtype=float).reshape(len(values), -1)
+    num_rows = len(values)
+    if num_rows <= max_points:
+        return np.arange(num_rows)
+    num_bins = max(max_points // 2, 1)
+    bin_size = -(-num_rows // num_bins)
+    #pads the last run with its last row, and leaves missing values out of the extremes
+    padded = np.concatenate([values, np.repeat(values[-1:], num_bins * bin_size - num_rows, axis=0)])
+    blocks = padded.reshape(num_bins, bin_size, -1)
+    starts = np.arange(num_bins)[:, None] * bin_size
+    lows = np.where(np.isnan(blocks), np.inf, blocks).argmin(axis=1) + starts
+    highs = np.where(np.isnan(blocks), -np.inf, blocks).argmax(axis=1) + starts
+    indices = np.concatenate([lows.ravel(), highs.ravel(), [0, num_rows - 1]])
+    return np.unique(np.minimum(indices, num_rows - 1))
+
+def chart_values(kind, df):
+    #the lines of a chart of one curve's buckets: cumulative votes, votes added or the margin
+    #(republican - democrat, as in the scrapers' margin columns)
+    if kind == 'cumulative':
+        return {candidate: df[candidate].to_numpy(dtype=float) for candidate in CANDIDATES}
+    if kind == 'delta':
+        return {candidate: df['d_' + candidate].to_numpy(dtype=float) for candidate in CANDIDATES}
+    votes = df['votes'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = np.where(votes > 0, (df['rep'] - df['dem']).to_numpy(dtype=float) / votes * 100, np.nan)
+    return {'margin': margin}
+
+def chart_path(charts_dir, dataset, state, level, county='', race_id='', kind='cumulative'):
+    name = level + ''.join('_' + re.sub(r'[^0-9A-Za-z]+', '-', label).strip('-').lower()
+                           for label in (county, race_id) if label)
+    return Path(charts_dir) / dataset / state / '{}_{}.png'.format(name, kind)
+
+
+class ChartFigure:
+    """A figure of one kind of chart on the Agg canvas: its axes, lines, legend and date axis are
+    set up once, and `draw` only replaces the lines' data and the title before saving."""
+
+    def __init__(self, kind, size=(8, 4.5), dpi=100):
+        self.figure = Figure(figsize=size, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        names = ['margin'] if kind == 'margin' else CANDIDATES
+        if kind != 'cumulative':
+            #a dashed line at zero to aid the eye
+            self.ax.axhline(0, color='k', linestyle='--', linewidth=0.8)
+        self.lines = {}
+        for name in names:
+            style = dict(STYLES[name])
+            if kind != 'delta':
+                style['marker'] = None
+            self.lines[name], = self.ax.plot([], [], ms=3, linewidth=1,
+                                             drawstyle='steps-post' if kind == 'cumulative' else 'default', **style)
+        locator = mdates.AutoDateLocator()
+        self.ax.xaxis.set_major_locator(locator)
+        self.ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        self.ax.set_xlabel('NY Times timestamps (UTC)')
+        self.ax.set_ylabel(Y_LABELS[kind])
+        self.ax.legend(loc='upper left')
+        #fixed margins instead of working out a tight layout for every chart
+        self.figure.subplots_adjust(left=0.12, right=0.97, top=0.92, bottom=0.14)
+
+    def draw(self, times, values, title, path, max_points=1000):
+        keep = downsample(np.column_stack(list(values.values())), max_points)
+        x = mdates.date2num(times[keep])
+        for name, line in self.lines.items():
+            line.set_data(x, values[name][keep])
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.ax.set_title(title)
+        #a fast zlib level: the charts are mostly flat colour, so they're barely bigger
+        self.figure.savefig(path, pil_kwargs={'compress_level': 1})
+
+
+def render_state(rollup_path, charts_dir, dataset, state, kinds=KINDS, resolution='1min', max_points=1000,
+                 size=(8, 4.5), dpi=100):
+    """Runs in a worker process: renders the charts of every curve of a state in the `dataset`,
+    from its buckets at `resolution`; returns the number of charts written."""
+    rollups = RollupCache(rollup_path)
+    df = rollups.state_rollups(dataset, state, resolution)
+    rollups.close()
+    num_charts = 0
+    with METRICS.timer('render_seconds', dataset=dataset, state=state):
+        for (level, county, race_id), curve in df.groupby(['level', 'county', 'race_id'], sort=False):
+            times = curve['time'].dt.tz_localize(None).to_numpy()
+            label = ' '.join(part for part in (state, county, race_id) if part)
+            for kind in kinds:
+                if (kind, size, dpi) not in _FIGURES:
+                    _FIGURES[kind, size, dpi] = ChartFigure(kind, size, dpi)
+                path = chart_path(charts_dir, dataset, state, level, county, race_id, kind)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                _FIGURES[kind, size, dpi].draw(times, chart_values(kind, curve),
+                                               '{} {} level {} ({})'.format(label, level, TITLES[kind], dataset),
+                                               path, max_points=max_points)
+                num_charts += 1
+    METRICS.inc('charts_total', num_charts, dataset=dataset)
+    return num_charts
+
+def render_charts(rollup_path, charts_dir, datasets=None, states=None, kinds=KINDS, workers=None,
+                  resolution='1min', max_points=1000, size=(8, 4.5), dpi=100):
+    """Renders the `kinds` of chart of every curve in the rollups at `rollup_path` (of the
+    `datasets` and `states` given), a dataset and state per worker process; returns the number
+    of charts written."""
+    rollups = RollupCache(rollup_path)
+    curves = rollups.curves(datasets, states)
+    rollups.close()
+    num_charts = 0
+
+    def finish(key, result, error):
+        nonlocal num_charts
+        if error is not None:
+            print('!!! Rendering the charts failed for {}: {}'.format(key, error))
+            return
+        num_charts += result
+
+    pool = StatePool(workers)
+    for dataset, state in curves[['dataset', 'state']].drop_duplicates().itertuples(index=False):
+        pool.submit('{} {}'.format(dataset, state), render_state, rollup_path, charts_dir, dataset, state,
+                    kinds=kinds, resolution=resolution, max_points=max_points, size=size, dpi=dpi)
+        for result in pool.completed():
+            finish(*result)
+    for result in pool.results():
+        finish(*result)
+    pool.close()
+    return num_charts
@@ -0,0 +1,231 @@
+"""Runs the scrapers and post-processing steps, or checks on their progress, with the settings
+that are otherwise edited in each script's `__main__` block.
+
+    python -m election2020 precinct --states GA NC --output-dir data --workers 2
+    python -m election2020 county --format parquet --memory-budget 1024
+    python -m election2020 races --live
+    python -m election2020 crawl --output-dir precinct-level-president
+    python -m election2020 postprocess --states PA
+    python -m election2020 status --output-dir data
+    python -m election2020 cache --states GA
+    python -m election2020 charts --output-dir data --workers 4 --datasets counties races
+
+States are given by their abbreviations.  pandas and the scrapers are only imported by the
+subcommands that run them, so `status` and `cache` start right away.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+
+STATE_NAMES = {
+    'AK': 'Alaska', 'AL': 'Alabama', 'AR': 'Arkansas', 'AZ': 'Arizona', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
+    'HI': 'Hawaii', 'IA': 'Iowa', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'KS': 'Kansas',
+    'KY': 'Kentucky', 'LA': 'Louisiana', 'MA': 'Massachusetts', 'MD': 'Maryland', 'ME': 'Maine',
+    'MI': 'Michigan', 'MN': 'Minnesota', 'MO': 'Missouri', 'MS': 'Mississippi', 'MT': 'Montana',
+    'NC': 'North Carolina', 'ND': 'North Dakota', 'NE': 'Nebraska', 'NH': 'New Hampshire',
+    'NJ': 'New Jersey', 'NM': 'New Mexico', 'NV': 'Nevada', 'NY': 'New York', 'OH': 'Ohio',
+    'OK': 'Oklahoma', 'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
+    'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VA': 'Virginia',
+    'VT': 'Vermont', 'WA': 'Washington', 'WI': 'Wisconsin', 'WV': 'West Virginia', 'WY': 'Wyoming',
+}
+
+
+def state_abbreviation(value):
+    state = value.upper()
+    if state not in STATE_NAMES:
+        raise argparse.ArgumentTypeError('unknown state abbreviation: {}'.format(value))
+    return state
+
+def memory_budget(value):
+    #megabytes on the command line, bytes (or None for whole files) for the scrapers
+    megabytes = int(value)
+    return megabytes * 1024**2 if megabytes > 0 else None
+
+def live_url(value):
+    state, _, url = value.partition('=')
+    if not url:
+        raise argparse.ArgumentTypeError('expected STATE=URL, got {}'.format(value))
+    return state_abbreviation(state), url
+
+def _scraper_options(args, **kwargs):
+    #the settings shared by the scripts' `run` functions (the ones left out keep the scripts' defaults)
+    options = {'src_dir': args.output_dir}
+    for name in ('output_format', 'concurrency', 'workers', 'memory_budget', 'delta_only'):
+        if name in vars(args):
+            options[name] = getattr(args, name)
+    options.update(kwargs)
+    return options
+
+
+def precinct(args):
+    from election2020.scripts import load_script
+    states = {'states': args.states} if args.states else {}
+    if args.original:
+        if args.live:
+            sys.exit('Only the improved scraper polls live files')
+        options = _scraper_options(args, **states)
+        options.pop('memory_budget', None)
+        load_script('precincts').run(**options)
+    else:
+        load_script('precincts_improved').run(**_scraper_options(args, live_urls=dict(args.live), **states))
+
+def county(args):
+    from election2020.scripts import load_script
+    states = [STATE_NAMES[state] for state in args.states] if args.states else None
+    load_script('county').run(**_scraper_options(args, states=states, live_url=args.live))
+
+def races(args):
+    from election2020.scripts import load_script
+    states = {'states': [STATE_NAMES[state] for state in args.states]} if args.states else {}
+    load_script('races').run(**_scraper_options(args, live=args.live, **states))
+
+def crawl(args):
+    from election2020.scripts import load_script
+    load_script('crawler').run(**_scraper_options(args))
+
+def postprocess(args):
+    from election2020.scripts import load_script
+    options = _scraper_options(args)
+    options.pop('concurrency', None)
+    if args.states:
+        options['states'] = args.states
+    load_script('precincts_improved').postprocess_states(**options)
+
+def status(args):
+    from election2020.manifest import STATUSES, ScrapeManifest
+    paths = sorted(Path(args.output_dir).glob('*manifest.sqlite'))
+    if not paths:
+        print('No manifests in {}'.format(args.output_dir))
+    for path in paths:
+        manifest = ScrapeManifest(path)
+        print(path.name)
+        for scope in manifest.scopes():
+            if args.states and scope not in args.states:
+                continue
+            summary = manifest.summary(scope)
+            counts = ', '.join('{} {}'.format(summary[s][0], s) for s in STATUSES if s in summary)
+            rows = sum(nrows for _, _, nrows in summary.values())
+            print('  {:<40} {} ({} rows)'.format(scope, counts, rows))
+        manifest.close()
+
+def _is_state_url(url, state):
+    #the precinct files are named like 'GAGeneral...' and the state pages like 'georgia.json'
+    name = STATE_NAMES[state].lower().replace(' ', '-')
+    return '/{}General'.format(state) in url or '/{}.json'.format(name) in url or '/{}/'.format(name) in url
+
+def cache(args):
+    from election2020.cache import ResponseCache
+    cache_dir = Path(args.output_dir) / 'archive_cache'
+    if not (cache_dir / 'index.sqlite').is_file():
+        print('No cached responses in {}'.format(cache_dir))
+        return
+    response_cache = ResponseCache(cache_dir)
+    entries = response_cache.entries()
+    if args.states:
+        entries = [meta for meta in entries if any(_is_state_url(meta['original'], s) for s in args.states)]
+    for meta in entries[-args.limit:] if args.limit else entries:
+        print('{} {:>10} {}'.format(meta['timestamp'] or '-' * 14, meta['length'], meta['original']))
+    print('{} cached responses, {:.1f} MB on disk in {}'.format(
+        len(entries), response_cache.size() / 1024**2, cache_dir))
+    response_cache.close()
+
+
+def charts(args):
+    from election2020.charts import render_charts
+    from election2020.metrics import Timer
+    rollup_path = Path(args.output_dir) / 'election2020_rollups.sqlite'
+    if not rollup_path.is_file():
+        print('No rollups in {}'.format(args.output_dir))
+        return
+    charts_dir = args.charts_dir or Path(args.output_dir) / 'charts'
+    workers = {'workers': args.workers} if 'workers' in vars(args) else {}
+    with Timer() as timer:
+        num_charts = render_charts(rollup_path, charts_dir, datasets=args.datasets, states=args.states,
+                                   kinds=args.kinds, resolution=args.resolution, max_points=args.max_points, **workers)
+    print('Rendered {} charts to {} in {:.1f} seconds'.format(num_charts, charts_dir, timer.elapsed))
+
+
+def parser():
+    output_dir = argparse.ArgumentParser(add_help=False)
+    output_dir.add_argument('-o', '--output-dir', default='.',
+                            help='the data directory the outputs, caches and manifests are in (default: .)')
+    states = argparse.ArgumentParser(add_help=False)
+    states.add_argument('--states', nargs='+', type=state_abbreviation, metavar='STATE',
+                        help='only these states (default: every state the scraper covers)')
+    fetching = argparse.ArgumentParser(add_help=False)
+    fetching.add_argument('-j', '--concurrency', type=int, default=4, help='concurrent downloads (default: 4)')
+    output_format = argparse.ArgumentParser(add_help=False)
+    output_format.add_argument('--format', dest='output_format', choices=['csv', 'parquet'], default='csv',
+                               help="'parquet' writes typed datasets partitioned by state (needs pyarrow)")
+    workers = argparse.ArgumentParser(add_help=False)
+    workers.add_argument('--workers', type=int, default=argparse.SUPPRESS,
+                         help='processes that post-process finished states (default: every cpu)')
+    budget = argparse.ArgumentParser(add_help=False)
+    budget.add_argument('--memory-budget', type=memory_budget, default=argparse.SUPPRESS, metavar='MB',
+                        help='megabytes of rows post-processing may hold in memory at a time '
+                             '(0 reads whole files, default: 512)')
+    delta_only = argparse.ArgumentParser(add_help=False)
+    delta_only.add_argument('--delta-only', action='store_true', default=argparse.SUPPRESS,
+                            help='store only the rows that changed since the previous snapshot')
+
+    main_parser = argparse.ArgumentParser(prog='python -m election2020', description=__doc__,
+                                          formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = main_parser.add_subparsers(dest='command', required=True)
+
+    sub = subparsers.add_parser('precinct', help='scrape the precinct timeseries (GA, NC, FL, MI, PA)',
+                                parents=[output_dir, states, fetching, output_format, workers, budget, delta_only])
+    sub.add_argument('--original', action='store_true',
+                     help='run the original scraper (precincts_presidential_scraper.py)')
+    sub.add_argument('--live', nargs='+', type=live_url, default=[], metavar='STATE=URL',
+                     help="poll each state's live precinct file every minute instead of backfilling")
+    sub.set_defaults(func=precinct)
+
+    sub = subparsers.add_parser('county', help='scrape the county-level presidential timeseries',
+                                parents=[output_dir, states, fetching, output_format, budget])
+    sub.add_argument('--live', metavar='URL', help='poll this national page every minute instead of backfilling')
+    sub.set_defaults(func=county)
+
+    sub = subparsers.add_parser('races', help='scrape the state-level house, senate and presidential timeseries',
+                                parents=[output_dir, states, fetching, output_format, workers])
+    sub.add_argument('--live', action='store_true', help="poll every state's page every minute instead of backfilling")
+    sub.set_defaults(func=races)
+
+    sub = subparsers.add_parser('crawl', help='harvest the timestamped urls of the archived results pages',
+                                parents=[output_dir, fetching])
+    sub.set_defaults(func=crawl)
+
+    sub = subparsers.add_parser('postprocess', help='fill in the missing totals of downloaded precinct outputs',
+                                parents=[output_dir, states, output_format, workers, budget, delta_only])
+    sub.set_defaults(func=postprocess)
+
+    sub = subparsers.add_parser('status', help="the progress recorded in the output directory's manifests",
+                                parents=[output_dir, states])
+    sub.set_defaults(func=status)
+
+    sub = subparsers.add_parser('cache', help='list the cached archived responses', parents=[output_dir, states])
+    sub.add_argument('--limit', type=int, default=20, help='only the most recently used (0 lists all, default: 20)')
+    sub.set_defaults(func=cache)
+
+    sub = subparsers.add_parser('charts', help='cumulative, delta and margin charts of every state, county and race',
+                                parents=[output_dir, states, workers])
+    sub.add_argument('--charts-dir', help='where the charts are written (default: <output-dir>/charts)')
+    sub.add_argument('--datasets', nargs='+', choices=['precincts', 'counties', 'races'],
+                     help='only the curves of these outputs (default: all)')
+    sub.add_argument('--kinds', nargs='+', choices=['cumulative', 'delta', 'margin'],
+                     default=['cumulative', 'delta', 'margin'], help='the charts of each curve (default: all)')
+    sub.add_argument('--resolution', choices=['1min', '5min', '1h', '1D'], default='1min',
+                     help="the rollups' bucket size to chart (default: 1min)")
+    sub.add_argument('--max-points', type=int, default=1000,
+                     help='denser curves are downsampled to about this many points (default: 1000)')
+    sub.set_defaults(func=charts)
+    return main_parser
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__=='__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,348 @@
+import bisect
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from election2020.sinks import uncategorize
+
+
+DELTA_KEY_COLUMNS = ['state', 'county', 'precinct', 'fips', 'vote_type']
+INDEX_COLUMNS = ['state', 'timestamp', 'source', 'rows', 'changed']
+
+
+def _label_hashes(df, key_columns):
+    #a 64-bit hash per row of its labels.  Integral columns (e.g., fips read back from a parquet
+    #file) are hashed like the strings of freshly parsed rows, and missing labels as '' (as is
+    #the NYT's 'null' vote type, which reading a csv file turns into a missing value)
+    labels = {}
+    for column in key_columns:
+        values = df[column]
+        if pd.api.types.is_float_dtype(values) and (values.dropna() == values.dropna().round()).all():
+            values = values.astype('Int64')
+        labels[column] = values.astype(str).where((values.notna() & (values != 'null')).to_numpy(), '')
+    return pd.util.hash_pandas_object(pd.DataFrame(labels), index=False)
+
+def _series_keys(label_hashes, occurrence):
+    #identifies a series by its labels and, for labels repeated within a snapshot, its occurrence
+    return pd.util.hash_pandas_object(pd.DataFrame({'labels': label_hashes, 'occurrence': occurrence}),
+                                      index=False)
+
+def _same_values(a, b):
+    #row-wise equality of two numeric arrays, where NaN equals NaN
+    return ((a == b) | (np.isnan(a) & np.isnan(b))).all(axis=1)
+
+def _prepare(snapshot_df, key_columns):
+    #numbers repeated series within the snapshot and adds the columns of the delta rows
+    snapshot_df = snapshot_df.copy()
+    label_hashes = _label_hashes(snapshot_df, key_columns)
+    snapshot_df['occurrence'] = label_hashes.groupby(label_hashes.to_numpy(), sort=False).cumcount()
+    snapshot_df['removed'] = False
+    snapshot_df['_key'] = _series_keys(label_hashes, snapshot_df['occurrence'])
+    return snapshot_df
+
+def _numeric_values(df, value_columns):
+    return df[value_columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+
+class ChangedRows:
+    """Picks the rows of each new snapshot of a state that changed since its previous snapshot,
+    for outputs that append plain rows (e.g. a live feed's `CsvSink`).
+
+    Series are identified like `DeltaSink`'s, by their (state, county, precinct, fips, vote_type)
+    labels.  The latest row of every series is kept in memory, and rebuilt from the rows already
+    in the `output` the first time a state is seen, so a restarted poller doesn't append the same
+    rows again.  (Unlike `DeltaSink`, series that disappear from a snapshot aren't recorded.)
+    """
+
+    def __init__(self, output, key_columns=DELTA_KEY_COLUMNS):
+        self.output = output
+        self.key_columns = list(key_columns)
+        self.latest = {}   #state -> the latest row of every series, indexed by '_key'
+
+    def _load(self, state):
+        if state in self.latest:
+            return self.latest[state]
+        if self.output.exists():
+            rows = uncategorize(self.output.read(state=state, dtype={c: str for c in self.key_columns}))
+            rows = rows.reset_index(drop=True)
+        else:
+            rows = pd.DataFrame()
+        if rows.empty:
+            self.latest[state] = None
+            return None
+        #each appended snapshot numbers its own repeated series
+        rows['timestamp'] = rows['timestamp'].astype(str)
+        label_hashes = _label_hashes(rows, self.key_columns)
+        occurrence = label_hashes.groupby([rows['timestamp'].to_numpy(), label_hashes.to_numpy()], sort=False).cumcount()
+        rows['_key'] = _series_keys(label_hashes, occurrence)
+        latest = rows.sort_values('timestamp', kind='stable').drop_duplicates('_key', keep='last')
+        self.latest[state] = latest.set_index('_key')
+        return self.latest[state]
+
+    def changed(self, state, snapshot_df):
+        """The rows of `snapshot_df` (all of `state`'s rows at one timestamp) whose series are new
+        or have other values than in the previous snapshot."""
+        snapshot_df = uncategorize(snapshot_df).reset_index(drop=True)
+        prepared = _prepare(snapshot_df, self.key_columns)
+        latest = self._load(state)
+        if latest is None:
+            changed = np.ones(len(snapshot_df), dtype=bool)
+        else:
+            value_columns = [c for c in snapshot_df.columns if c not in self.key_columns + ['timestamp']]
+            matched = latest.reindex(columns=value_columns).reindex(prepared['_key'])
+            changed = (~_same_values(_numeric_values(prepared, value_columns), _numeric_values(matched, value_columns))
+                       | ~prepared['_key'].isin(latest.index).to_numpy())
+        #the new snapshot holds the latest row of its series (and the earlier ones keep theirs)
+        new_latest = prepared.drop(columns=['occurrence', 'removed']).set_index('_key')
+        if latest is not None and not latest.index.isin(new_latest.index).all():
+            new_latest = pd.concat([latest[~latest.index.isin(new_latest.index)], new_latest])
+        self.latest[state] = new_latest
+        return snapshot_df[changed].reset_index(drop=True)
+
+
+class DeltaSink:
+    """Stores successive snapshots of the same precincts as deltas, wrapping another output sink.
+
+    Consecutive NYT snapshots are mostly identical, so `write` diffs each snapshot against the last
+    known state of every (state, county, precinct, fips, vote_type) series and only passes the rows
+    that changed (plus a `removed` row for any series that disappeared) to the wrapped sink.  Every
+    snapshot is recorded in a small index file next to the output (`<output>_snapshots.csv`), and
+    `read` materializes the dense timeseries (every series at every snapshot) on demand.
+
+    Snapshots can be written in any order (e.g., as concurrent downloads complete): a snapshot that
+    lands between two known snapshots also stores the rows the later snapshot needs to still
+    materialize correctly.  Writing a snapshot again stores nothing new, so reruns are idempotent.
+    """
+
+    format = 'delta'
+
+    def __init__(self, output, key_columns=DELTA_KEY_COLUMNS):
+        self.output = output
+        self.path = output.path
+        self.key_columns = list(key_columns)
+        self.index_path = self.path.with_name(self.path.stem + '_snapshots.csv')
+        self.index = self._read_index()
+        #state -> {timestamp: [delta rows (with a '_key' column)]}, loaded on first use, so a new
+        #snapshot only adds its own rows rather than being concatenated onto every earlier one
+        self.deltas = {}
+        self.timestamps = {}   #state -> sorted timestamps of its snapshots
+        self.combined = {}     #state -> every delta row, concatenated when it's needed whole
+        self.tips = {}         #state -> (timestamp, contents) of the newest snapshot
+
+    def __getstate__(self):
+        #the loaded deltas are reread from disk rather than copied to other processes
+        state = self.__dict__.copy()
+        state.update(deltas={}, timestamps={}, combined={}, tips={})
+        return state
+
+    def _read_index(self):
+        if not self.index_path.is_file():
+            return pd.DataFrame(columns=INDEX_COLUMNS)
+        return pd.read_csv(self.index_path, dtype={'state': str, 'timestamp': str, 'source': str})
+
+    def _write_index(self):
+        #rewritten atomically (it's a row per snapshot) so an interrupted run never leaves half a file
+        temp = tempfile.NamedTemporaryFile(prefix=self.index_path.name, dir=self.index_path.parent, delete=False)
+        temp.close()
+        self.index.to_csv(temp.name, index=False)
+        os.replace(temp.name, self.index_path)
+
+    def _load(self, state):
+        #the state's delta rows by timestamp
+        if state in self.deltas:
+            return self.deltas[state]
+        if self.output.exists():
+            #labels are read as strings (rather than letting the csv reader turn e.g. precinct
+            #'0001' into 1) so that they match freshly parsed rows
+            deltas = uncategorize(self.output.read(state=state, dtype={c: str for c in self.key_columns}))
+            deltas = deltas.reset_index(drop=True)
+        else:
+            deltas = pd.DataFrame()
+        if not deltas.empty:
+            deltas['timestamp'] = deltas['timestamp'].astype(str)
+            deltas['removed'] = deltas['removed'].astype(bool)
+            deltas['_key'] = _series_keys(_label_hashes(deltas, self.key_columns), deltas['occurrence'])
+            #snapshots whose rows were written by an interrupted run that didn't get to the index
+            known = set(self.index.loc[self.index['state'] == state, 'timestamp'])
+            missing = sorted(set(deltas['timestamp']) - known)
+            if missing:
+                self.index = pd.concat([self.index, pd.DataFrame({'state': state, 'timestamp': missing})],
+                                       ignore_index=True)
+        self.deltas[state] = {} if deltas.empty else {timestamp: [rows] for timestamp, rows
+                                                      in deltas.groupby('timestamp', sort=True)}
+        self.timestamps[state] = sorted(self.index.loc[self.index['state'] == state, 'timestamp'].astype(str).unique())
+        self.combined[state] = deltas
+        return self.deltas[state]
+
+    def _add(self, state, rows):
+        #stores new delta rows under their timestamps; the combined rows are rebuilt when next needed
+        for timestamp, timestamp_rows in rows.groupby('timestamp', sort=False):
+            self.deltas[state].setdefault(timestamp, []).append(timestamp_rows)
+        self.combined.pop(state, None)
+
+    def _rows(self, state, timestamp=None):
+        #the delta rows of one snapshot, or (concatenated once per change) of every snapshot
+        deltas = self._load(state)
+        if timestamp is not None:
+            frames = deltas.get(timestamp, [])
+            return pd.concat(frames, ignore_index=True) if len(frames) > 1 else (frames or [pd.DataFrame()])[0]
+        if state not in self.combined:
+            frames = [rows for timestamp in sorted(deltas) for rows in deltas[timestamp]]
+            self.combined[state] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        return self.combined[state]
+
+    def snapshots(self, state):
+        """The timestamps of every snapshot written for `state`, in order."""
+        self._load(state)
+        return np.array(self.timestamps[state], dtype=str)
+
+    def state_at(self, state, timestamp, inclusive=True):
+        """The latest row of every series present at `timestamp` (a snapshot's full contents)."""
+        if not self._load(state):
+            return pd.DataFrame()
+        #snapshots usually arrive in order, so the newest snapshot's contents are kept around
+        #rather than re-sorting every delta row for each new snapshot
+        tip_timestamp, tip = self.tips.get(state, (None, None))
+        if tip_timestamp is not None and (tip_timestamp < timestamp or (inclusive and tip_timestamp == timestamp)):
+            return tip
+        deltas = self._rows(state)
+        earlier = deltas['timestamp'] <= timestamp if inclusive else deltas['timestamp'] < timestamp
+        latest = deltas[earlier].sort_values('timestamp', kind='stable').drop_duplicates('_key', keep='last')
+        return latest[~latest['removed']]
+
+    def prepare(self, snapshot_df):
+        return _prepare(snapshot_df, self.key_columns)
+
+    def diff(self, state, timestamp, snapshot_df):
+        """The delta rows that `snapshot_df` (one state's rows at one timestamp, see `prepare`)
+        adds to the store."""
+        value_columns = [c for c in snapshot_df.columns
+                         if c not in self.key_columns + ['timestamp', 'occurrence', 'removed', '_key']]
+        columns = snapshot_df.columns
+
+        def values(df):
+            return _numeric_values(df, value_columns)
+
+        def changes(new_df, old_df):
+            #rows of `new_df` that differ from (or are missing in) `old_df`, plus `removed` rows
+            #for the series of `old_df` that aren't in `new_df`
+            old_df = old_df.reindex(columns=columns).set_index('_key')
+            matched = old_df.reindex(new_df['_key'])
+            changed = new_df[~_same_values(values(new_df), values(matched))
+                             | matched['removed'].isna().to_numpy()]
+            removed = old_df[~old_df.index.isin(new_df['_key'])].reset_index()
+            removed['removed'] = True
+            rows = pd.concat([changed, removed[columns]], ignore_index=True)
+            rows.loc[rows['removed'].to_numpy(dtype=bool), value_columns] = np.nan
+            return rows
+
+        if not self._load(state):
+            return snapshot_df
+        stored = self._rows(state, timestamp).reindex(columns=columns).set_index('_key')
+
+        #rows that change relative to the previous snapshot, unless they're already stored
+        new_rows = changes(snapshot_df, self.state_at(state, timestamp, inclusive=False))
+        new_rows['timestamp'] = timestamp
+        stored_match = stored.reindex(columns=columns.drop('_key')).reindex(new_rows['_key'])
+        already_stored = (_same_values(values(new_rows), values(stored_match))
+                          & (stored_match['removed'].to_numpy() == new_rows['removed'].to_numpy()))
+        new_rows = new_rows[~already_stored]
+
+        #the following snapshot inherits every series it didn't store a row for; where that would
+        #now be inherited from this snapshot instead, the following snapshot's own row is restored
+        timestamps = self.timestamps[state]
+        later = bisect.bisect_right(timestamps, timestamp)
+        if later < len(timestamps):
+            next_timestamp = timestamps[later]
+            next_stored = self._rows(state, next_timestamp).reindex(columns=columns)['_key']
+            next_state = self.state_at(state, next_timestamp)
+            current = snapshot_df.copy()
+            restored = changes(next_state.reindex(columns=columns), current)
+            restored = restored[~restored['_key'].isin(next_stored)]
+            restored['timestamp'] = next_timestamp
+            new_rows = pd.concat([new_rows, restored], ignore_index=True)
+        return new_rows
+
+    def exists(self):
+        return self.output.exists()
+
+    def reset(self):
+        self.output.reset()
+        self.index_path.unlink(missing_ok=True)
+        self.index = pd.DataFrame(columns=INDEX_COLUMNS)
+        self.deltas = {}
+        self.timestamps = {}
+        self.combined = {}
+        self.tips = {}
+
+    def write(self, df, key=None):
+        """Stores the changed rows of every (state, timestamp) snapshot in `df`."""
+        if df.empty:
+            return
+        df = uncategorize(df).reset_index(drop=True)
+        df['timestamp'] = df['timestamp'].astype(str)
+        entries = {}
+        for (state, timestamp), snapshot_df in df.groupby(['state', 'timestamp'], sort=True):
+            snapshot_df = self.prepare(snapshot_df)
+            new_rows = self.diff(state, timestamp, snapshot_df)
+            if not new_rows.empty:
+                self.output.write(new_rows.drop(columns='_key'),
+                                  key=None if key is None else '{}@{}'.format(key, timestamp))
+                self._add(state, new_rows)
+
+            entries[state, timestamp] = (key, len(snapshot_df), len(new_rows))
+            timestamps = self.timestamps[state]
+            position = bisect.bisect_left(timestamps, timestamp)
+            if position == len(timestamps) or timestamps[position] != timestamp:
+                timestamps.insert(position, timestamp)
+            if timestamp == timestamps[-1]:
+                self.tips[state] = (timestamp, snapshot_df)
+
+        #the index gets a row per snapshot written (replacing any earlier one), all at once
+        entries = pd.DataFrame([(state, timestamp, source, rows, changed) for (state, timestamp), (source, rows, changed)
+                                in entries.items()], columns=INDEX_COLUMNS)
+        written = pd.MultiIndex.from_frame(entries[['state', 'timestamp']])
+        self.index = self.index[~pd.MultiIndex.from_frame(self.index[['state', 'timestamp']]).isin(written)]
+        self.index = pd.concat([self.index, entries], ignore_index=True)
+        self._write_index()
+
+    def replace(self, df, key=None):
+        #like `CsvSink.replace`, the whole store only holds the snapshots of `df` afterwards
+        self.reset()
+        self.write(df, key)
+
+    def read(self, state=None, columns=None):
+        """Materializes the dense timeseries: every series present at every snapshot, ordered by
+        snapshot and then by the order the series first appeared."""
+        states = [state] if state is not None else sorted(self.index['state'].dropna().unique())
+        frames = [self.materialize(s) for s in states]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        return df if columns is None else df[columns]
+
+    def materialize(self, state):
+        deltas = self._rows(state)
+        snapshots = self.snapshots(state)
+        if deltas.empty or snapshots.size == 0:
+            return deltas.drop(columns=['_key', 'occurrence', 'removed'], errors='ignore')
+
+        #series codes in order of first appearance, and the snapshot position of every delta row
+        deltas = deltas.sort_values('timestamp', kind='stable')
+        series = pd.factorize(deltas['_key'])[0]
+        position = np.searchsorted(snapshots, deltas['timestamp'].to_numpy(dtype=str))
+        order = np.lexsort((position, series))
+        num_snapshots = snapshots.size
+
+        #latest[k, s] is the (sorted) row holding series k's value at snapshot s: each delta row is
+        #placed at its own cell and carried forward along the snapshot axis by a running maximum
+        latest = np.full(series.max() * num_snapshots + num_snapshots, -1, dtype=np.int64)
+        latest[series[order] * num_snapshots + position[order]] = np.arange(order.size)
+        latest = np.maximum.accumulate(latest.reshape(-1, num_snapshots), axis=1)
+
+        cells = latest.T.ravel()
+        present = cells >= 0
+        rows = deltas.iloc[order].iloc[cells[present]]
+        dense = rows.assign(timestamp=np.repeat(snapshots, latest.shape[0])[present])
+        dense = dense[~dense['removed'].to_numpy()]
+        return dense.drop(columns=['_key', 'occurrence', 'removed']).reset_index(drop=True)
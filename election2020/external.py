@@ -0,0 +1,186 @@
+import math
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024**2
+#a partition's rows are held a few times over while it's processed (the rows read, groupby
+#results, concatenated and sorted copies), so partitions are sized to a fraction of the budget
+WORKING_COPIES = 4
+ROW = '_row'
+
+
+def _widen(dtype, new_dtype):
+    #the dtype `pd.read_csv` infers for a whole column, given the dtypes inferred for its chunks
+    if dtype is None or dtype == new_dtype:
+        return new_dtype
+    kinds = {dtype.kind, new_dtype.kind}
+    if kinds <= {'i', 'u', 'f'}:
+        return np.dtype('float64')
+    return np.dtype(object)
+
+def _read_dtypes(dtypes):
+    #dtypes to read chunks with so that each chunk gets the whole file's dtypes (object columns
+    #are read as str, so e.g. precinct '0001' stays a string in chunks with only numbers)
+    return {column: str if dtype == object else dtype for column, dtype in dtypes.items()}
+
+def _filter(df, where):
+    for column, value in (where or {}).items():
+        if value is not None:
+            df = df[df[column] == value]
+    return df
+
+def rows_per_chunk(path, memory_budget, index_col=None, sample_rows=2000):
+    """Rows of the csv file at `path` that take up about `memory_budget / WORKING_COPIES` bytes."""
+    sample = pd.read_csv(path, index_col=index_col, nrows=sample_rows)
+    bytes_per_row = max(sample.memory_usage(deep=True).sum() / max(len(sample), 1), 1)
+    return max(int(memory_budget / WORKING_COPIES / bytes_per_row), 1000)
+
+def scan_csv(path, chunksize, index_col=None, count_by=None, where=None):
+    """One pass over a csv file, `chunksize` rows at a time.
+
+    Returns the dtypes `pd.read_csv` would infer for the whole file, the number of rows (that match
+    `where`, a `{column: value}` filter) and, with `count_by`, those rows per value of that column.
+    """
+    dtypes, num_rows, counts = {}, 0, None
+    for chunk in pd.read_csv(path, index_col=index_col, chunksize=chunksize):
+        for column, dtype in chunk.dtypes.items():
+            dtypes[column] = _widen(dtypes.get(column), dtype)
+        chunk = _filter(chunk, where)
+        num_rows += len(chunk)
+        if count_by is not None:
+            chunk_counts = chunk[count_by].value_counts(dropna=False)
+            counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+    return dtypes, num_rows, counts
+
+def read_csv_chunks(path, chunksize, dtypes, index_col=None, where=None):
+    """Reads a csv file `chunksize` rows at a time with the whole file's `dtypes` (see `scan_csv`)."""
+    for chunk in pd.read_csv(path, index_col=index_col, chunksize=chunksize, dtype=_read_dtypes(dtypes)):
+        yield _filter(chunk, where)
+
+def _read_partition(path, dtypes, **kwargs):
+    #partition files hold values that were already parsed once, so floats are read back exactly
+    #(pandas' default float parser can be off by an ulp, which would change the rewritten text)
+    return pd.read_csv(path, dtype=_read_dtypes(dtypes), float_precision='round_trip', **kwargs)
+
+def _write_partitions(chunks, partition_ids, temp_dir):
+    #appends the rows of each chunk to one csv file per partition, returning the files written
+    files = {}
+    try:
+        for chunk in chunks:
+            for p, rows in chunk.groupby(partition_ids(chunk), sort=False):
+                header = p not in files
+                if header:
+                    files[p] = open(Path(temp_dir) / 'partition-{}.csv'.format(p), 'w', newline='')
+                rows.to_csv(files[p], header=header, index=False)
+    finally:
+        for f in files.values():
+            f.close()
+    return {p: Path(f.name) for p, f in files.items()}
+
+def drop_duplicates_csv(path, subset, keep='last', columns=None, index_col=None, partition_by=None,
+                        memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Out-of-core equivalent of
+
+        df = pd.read_csv(path, index_col=index_col)[columns].drop_duplicates(subset, keep=keep)
+        df.to_csv(path)
+
+    that holds about `memory_budget` bytes of rows at a time.  The `subset` columns of every row
+    (and its row number) are hash-partitioned by the `partition_by` columns (by default `subset`,
+    which they must be a part of) into temporary files next to `path`, each partition is
+    deduplicated on its own, and a last pass over the file rewrites it with only the rows kept, so
+    it ends up identical to the in-memory result.
+    """
+    path = Path(path)
+    subset, partition_by = list(subset), list(partition_by or subset)
+    chunksize = rows_per_chunk(path, memory_budget, index_col)
+    dtypes, num_rows, _ = scan_csv(path, chunksize, index_col)
+    key_dtypes = dict({column: dtypes[column] for column in subset}, **{ROW: np.dtype('int64')})
+    #the key columns take up a fraction of a row, so partitions of them can hold more rows
+    key_fraction = len(subset) / len(dtypes)
+    num_partitions = max(1, math.ceil(num_rows * key_fraction / chunksize))
+
+    def numbered_keys():
+        offset = 0
+        for chunk in read_csv_chunks(path, chunksize, dtypes, index_col):
+            keys = chunk[subset].reset_index(drop=True)
+            keys[ROW] = np.arange(offset, offset + len(keys))
+            offset += len(keys)
+            yield keys
+
+    def partition_ids(keys):
+        hashes = pd.util.hash_pandas_object(keys[partition_by].astype(str), index=False).to_numpy()
+        return hashes % np.uint64(num_partitions)
+
+    temp_dir = tempfile.mkdtemp(prefix=path.name + '.', dir=path.parent)
+    try:
+        partitions = _write_partitions(numbered_keys(), partition_ids, temp_dir)
+        kept = np.zeros(num_rows, dtype=bool)
+        for partition_path in partitions.values():
+            keys = _read_partition(partition_path, key_dtypes)
+            kept[keys.drop_duplicates(subset, keep=keep)[ROW].to_numpy()] = True
+            partition_path.unlink()
+
+        temp_output = Path(temp_dir) / path.name
+        with open(temp_output, 'w', newline='') as out:
+            offset = 0
+            for chunk in read_csv_chunks(path, chunksize, dtypes, index_col):
+                rows = chunk[kept[offset:offset + len(chunk)]]
+                offset += len(chunk)
+                rows = rows if columns is None else rows[columns]
+                rows.to_csv(out, header=out.tell() == 0, index=index_col is not None)
+        os.replace(temp_output, path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def iter_csv_by_ranges(path, by, memory_budget=DEFAULT_MEMORY_BUDGET, index_col=None, where=None):
+    """Reads a csv file (the rows matching `where`) in partitions of about `memory_budget` bytes,
+    each holding every row of a contiguous range of the sorted values of `by` (e.g., counties).
+
+    Partitions come out in sorted order of `by` (missing values last, like `sort_values`) and
+    rows keep their order within a partition, so the results of a per-group computation that
+    sorts by `by` first (e.g., `add_missing_totals`) concatenate into the in-memory result.  Every
+    partition is read with the whole file's dtypes.  The index column, if any, is dropped.
+    """
+    path = Path(path)
+    chunksize = rows_per_chunk(path, memory_budget, index_col)
+    dtypes, _, counts = scan_csv(path, chunksize, index_col, count_by=by, where=where)
+    if counts is None or counts.empty:
+        return
+
+    #greedily packs consecutive values into partitions of up to `chunksize` rows (a single value
+    #with more rows than that gets a partition of its own)
+    counts = counts.sort_index(na_position='last')
+    partition_of, missing_partition = {}, None
+    partition, partition_rows = 0, 0
+    for value, count in counts.items():
+        if partition_rows and partition_rows + count > chunksize:
+            partition, partition_rows = partition + 1, 0
+        if pd.isna(value):
+            missing_partition = partition
+        else:
+            partition_of[value] = partition
+        partition_rows += count
+
+    def partition_ids(chunk):
+        ids = chunk[by].map(partition_of)
+        if missing_partition is not None:
+            ids = ids.where(chunk[by].notna(), missing_partition)
+        return ids.astype(int).to_numpy()
+
+    temp_dir = tempfile.mkdtemp(prefix=path.name + '.', dir=path.parent)
+    try:
+        chunks = (chunk.reset_index(drop=True)
+                  for chunk in read_csv_chunks(path, chunksize, dtypes, index_col, where))
+        partitions = _write_partitions(chunks, partition_ids, temp_dir)
+        for p, partition_path in sorted(partitions.items()):
+            df = _read_partition(partition_path, dtypes)
+            partition_path.unlink()
+            yield df
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,222 @@
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+
+from election2020.metrics import METRICS
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Global politeness budget: `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate=0.5, capacity=2):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        #blocks until a token is available and returns the time spent waiting
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class StreamedResponse:
+    """A successful response of `FetchEngine.get(url, stream=True)`, whose body is read from the
+    connection as `iter_content` is iterated (and stored in the engine's cache once it was read
+    to the end) instead of being held in memory whole."""
+
+    def __init__(self, url, response, cache=None):
+        self.url = url
+        self.response = response
+        self.cache = cache
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def iter_content(self, chunk_size=1):
+        host = urlsplit(self.url).netloc
+        chunks = self.response.iter_content(chunk_size)
+        if self.cache is not None:
+            chunks = self.cache.put_chunks(self.url, chunks, statuscode=self.status_code,
+                                           mimetype=self.headers.get('Content-Type', '').split(';')[0])
+        try:
+            for chunk in chunks:
+                METRICS.inc('fetch_bytes_total', len(chunk), host=host)
+                yield chunk
+        finally:
+            chunks.close()
+            self.response.close()
+
+    @property
+    def content(self):
+        return b''.join(self.iter_content(1 << 20))
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+
+class FetchEngine:
+    """Downloads urls on a pool of threads sharing one keep-alive `requests.Session`.
+
+    Every request draws from a global token bucket, at most `per_host` requests are in flight
+    against any one host, and 429/5xx responses (or connection errors) are retried with
+    exponential backoff, honoring the `Retry-After` header when the server sends one.  With a
+    `cache` (see `election2020.cache.ResponseCache`), responses are replayed from disk whenever
+    any archived copy of the same NYT source url has already been downloaded.
+    """
+
+    def __init__(self, max_workers=4, rate=0.5, burst=2, per_host=2, max_retries=5,
+                 backoff=2.0, max_backoff=120.0, timeout=120, session=None, cache=None):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.bucket = TokenBucket(rate, burst)
+
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                                    pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self.host_slots = {}
+        self.host_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self.host_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def _retry_delay(self, attempt, response=None):
+        delay = self.backoff * 2**attempt
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get('Retry-After', 0)))
+            except ValueError:
+                pass
+        return min(delay, self.max_backoff)
+
+    def get(self, url, cache=True, headers=None, stream=False):
+        """Rate-limited, retried GET.  Raises IOError once the retries are exhausted.
+
+        With `cache=False` the response cache is neither read nor written (e.g., for CDX searches,
+        whose results change as the archive adds captures, or live feeds).  `headers` are sent
+        with the request (e.g. the validators of a conditional GET, which may be answered with
+        `304 Not Modified`).  With `stream=True`, a downloaded body is only read as the returned
+        `StreamedResponse` is iterated (cached responses are replayed from memory as before).
+        """
+        host = urlsplit(url).netloc
+        cache = self.cache if cache else None
+        if cache is not None:
+            cached_response = cache.get(url)
+            if cached_response is not None:
+                METRICS.inc('fetch_cache_hits_total', host=host)
+                METRICS.inc('fetch_cache_bytes_total', len(cached_response.content), host=host)
+                return cached_response
+
+        host_slot = self._host_slot(url)
+        for attempt in range(self.max_retries + 1):
+            METRICS.inc('fetch_throttle_seconds_total', self.bucket.acquire(), host=host)
+            response = None
+            with host_slot:
+                request_start = time.perf_counter()
+                try:
+                    response = self.session.get(url, timeout=self.timeout, headers=headers, stream=stream)
+                except requests.RequestException as e:
+                    error = e
+                    METRICS.inc('fetch_requests_total', host=host, status='error')
+                else:
+                    METRICS.inc('fetch_requests_total', host=host, status=response.status_code)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        response.raise_for_status()
+                        METRICS.observe('fetch_seconds', time.perf_counter() - request_start, host=host)
+                        if stream:
+                            return StreamedResponse(url, response, cache)
+                        METRICS.inc('fetch_bytes_total', len(response.content), host=host)
+                        if cache is not None:
+                            cache.put(url, response.content, statuscode=response.status_code,
+                                           mimetype=response.headers.get('Content-Type', '').split(';')[0])
+                        return response
+                    error = requests.HTTPError('{} for {}'.format(response.status_code, url),
+                                               response=response)
+                    response.close()
+
+            if attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                METRICS.inc('fetch_retries_total', host=host)
+                METRICS.inc('fetch_backoff_seconds_total', delay, host=host)
+                time.sleep(delay)
+        METRICS.inc('fetch_failures_total', host=host)
+        raise IOError('Download failed for {}: {}'.format(url, error))
+
+    def map(self, func, items, max_pending=None):
+        """Runs `func(item)` for every item on the thread pool.
+
+        Yields `(item, result, error)` tuples as the work completes, where exactly one of
+        `result` and `error` is not None.  `func` should use `self.get` for its downloads.
+        At most `max_pending` items (default: twice the workers) are queued at a time, so
+        closing the generator early only waits for the ones already running.
+        """
+        max_pending = max_pending or 2 * self.max_workers
+        items = iter(items)
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {}
+        try:
+            while True:
+                for item in items:
+                    futures[pool.submit(func, item)] = item
+                    if len(futures) >= max_pending:
+                        break
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = futures.pop(future)
+                    try:
+                        yield item, future.result(), None
+                    except Exception as e:
+                        yield item, None, e
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def get_all(self, urls):
+        """Downloads every url, yielding `(url, response, error)` tuples as they complete."""
+        return self.map(self.get, urls)
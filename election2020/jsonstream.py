@@ -0,0 +1,128 @@
+import codecs
+import json
+
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_text_chunks(content, chunk_size=1 << 20):
+    """Decodes raw (utf-8) response bytes a chunk at a time.  `content` is either the whole body
+    or an iterable of its chunks (e.g. `response.iter_content(chunk_size)` of a streamed response,
+    which is then never held in memory whole)."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        view = memoryview(content)
+        content = (view[start:start + chunk_size] for start in range(0, len(view), chunk_size))
+    for chunk in content:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+class _Reader:
+    #a sliding window over the text chunks; `pos` only ever moves forward
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            return False
+        if self.pos > len(self.buffer) // 2:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        #returns the next non-whitespace character without consuming it ('' at the end)
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {!r} at offset {} of the JSON stream'.format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        #decodes the next JSON value, pulling in more chunks until it is complete.  A value must
+        #be followed by another character (or the end of the stream) so that, e.g., a number
+        #split across two chunks isn't decoded from its first half.
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self.fill() and not self.eof:
+                raise ValueError('Unexpected end of the JSON stream')
+
+
+def iter_json_arrays(chunks, skip_keys=('meta',), value_keys=()):
+    """Incrementally parses a JSON object whose values are arrays of records.
+
+    Yields `(key, record)` for every element of every top-level array (e.g., the `precincts` and
+    `precinct_by_vote_type` arrays of the NYT precinct files) without ever holding the whole
+    parsed document in memory.  The values under `value_keys` (e.g. the `meta` object) are yielded
+    whole as `(key, value)`.  Values under `skip_keys`, and any other values that aren't arrays,
+    are parsed and discarded.
+    """
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key in value_keys:
+            yield key, reader.value()
+        elif key not in skip_keys and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.peek() == ',':
+                        reader.pos += 1
+                        continue
+                    reader.expect(']')
+                    break
+        else:
+            reader.value()
+
+        if reader.peek() == ',':
+            reader.pos += 1
+            continue
+        reader.expect('}')
+        #reads the stream to its end (so e.g. a streamed response is fully consumed and cached)
+        if reader.peek() != '':
+            raise ValueError('Unexpected data after the JSON object at offset {}'.format(reader.pos))
+        return
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
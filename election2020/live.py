@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+from election2020.metrics import METRICS
+
+
+class LivePoller:
+    """Polls live NYT endpoints (e.g. on election night) instead of archived copies.
+
+    Every `poll` is a conditional GET (`If-None-Match`/`If-Modified-Since` with the validators of
+    the previous response), so a feed that hasn't changed costs one small request answered with
+    `304 Not Modified` and no parsing.  Servers that ignore the validators are caught by comparing
+    the body's digest with the previous one.
+
+    Within a changed feed, `is_new`/`mark` track the version of every item (e.g., a race's
+    `last_updated` or the latest timestamp written), so that only new updates are appended to the
+    output.  Validators and versions are stored in SQLite, so a restarted poller picks up where it
+    left off without appending anything twice.
+    """
+
+    def __init__(self, engine, path, timeout=60):
+        self.engine = engine
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), timeout=timeout, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS feeds (
+                url           TEXT PRIMARY KEY,
+                etag          TEXT,
+                last_modified TEXT,
+                digest        TEXT,
+                updated       REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS versions (
+                url     TEXT NOT NULL,
+                item    TEXT NOT NULL,
+                version TEXT NOT NULL,
+                PRIMARY KEY (url, item)
+            );
+        ''')
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def poll(self, url):
+        """The response for `url` if the feed changed since it was last `mark`ed, otherwise None."""
+        with self.lock:
+            row = self.db.execute('SELECT etag, last_modified, digest FROM feeds WHERE url = ?', (url,)).fetchone()
+        etag, last_modified, digest = row if row is not None else (None, None, None)
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+
+        response = self.engine.get(url, cache=False, headers=headers)
+        if response.status_code == 304:
+            METRICS.inc('live_polls_total', result='not_modified')
+            return None
+        if hashlib.sha1(response.content).hexdigest() == digest:
+            METRICS.inc('live_polls_total', result='unchanged')
+            return None
+        METRICS.inc('live_polls_total', result='changed')
+        return response
+
+    def version(self, url, item):
+        with self.lock:
+            row = self.db.execute('SELECT version FROM versions WHERE url = ? AND item = ?', (url, item)).fetchone()
+        return None if row is None else row[0]
+
+    def is_new(self, url, item, version):
+        #whether `item` of the feed at `url` changed since it was last `mark`ed
+        return self.version(url, item) != str(version)
+
+    def mark(self, url, response, versions=None):
+        """Records that `response` (from `poll`) was handled, along with the `{item: version}` that
+        were written.  Until then the feed is returned by `poll` again, so an update that fails to
+        be parsed or written isn't lost."""
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO feeds (url, etag, last_modified, digest, updated) '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                             hashlib.sha1(response.content).hexdigest(), time.time()))
+            self.db.executemany('INSERT OR REPLACE INTO versions (url, item, version) VALUES (?, ?, ?)',
+                                [(url, item, str(version)) for item, version in (versions or {}).items()])
+            self.db.commit()
+
+    def run(self, feeds, interval=60, max_polls=None, stop=None):
+        """Polls every feed every `interval` seconds, until `max_polls` rounds or `stop` is set.
+
+        `feeds` are callables (e.g. `functools.partial(poll_county_results, url, output, poller)`)
+        that poll one feed and return the number of rows they appended.  Errors are reported and
+        the feed is polled again in the next round.
+        """
+        stop = stop or threading.Event()
+        num_polls = 0
+        while not stop.is_set() and (max_polls is None or num_polls < max_polls):
+            round_start = time.monotonic()
+            for feed in feeds:
+                try:
+                    num_rows = feed()
+                except Exception as e:
+                    METRICS.inc('live_errors_total')
+                    print('!!! Polling failed: {}'.format(e))
+                    continue
+                if num_rows:
+                    METRICS.inc('live_rows_appended_total', num_rows)
+                    print('Appended {} new rows'.format(num_rows))
+            num_polls += 1
+            if max_polls is None or num_polls < max_polls:
+                stop.wait(max(0, interval - (time.monotonic() - round_start)))
+        return num_polls
+
+
+def response_timestamp(response):
+    #the time a live file was last updated, formatted like the timestamps of archived NYT files
+    #(e.g. '2020-11-04T05:18:09.130Z'): its Last-Modified header, or None without one.  (The time
+    #it was received would stamp the same data differently on every poll)
+    last_modified = response.headers.get('Last-Modified')
+    if last_modified is None:
+        return None
+    seconds = parsedate_to_datetime(last_modified).timestamp()
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + '.{:03d}Z'.format(int(seconds % 1 * 1000))
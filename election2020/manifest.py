@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from election2020.cache import archive_key
+
+
+STATUSES = ('pending', 'fetched', 'parsed', 'written', 'failed')
+
+
+class ScrapeManifest:
+    """Persistent record of the progress of every scraped item, so interrupted runs can resume.
+
+    Items are archived urls (tracked by `archive_key`, so any archived copy of a timestamped NYT
+    file that has been written counts as done) or any other unit of work, grouped by a `scope` such
+    as a state or an output file.  Each item moves through pending -> fetched -> parsed ->
+    written (or failed), and the byte count, row count and time spent are recorded as it goes.
+
+    Before a parsed item is appended to an output file, `begin_write` records the size of the
+    file.  If the run dies mid-append, `recover` truncates the file back to that size, so that
+    resuming never duplicates rows.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS items (
+                scope        TEXT NOT NULL,
+                item         TEXT NOT NULL,
+                url          TEXT,
+                status       TEXT NOT NULL,
+                bytes        INTEGER,
+                rows         INTEGER,
+                fetch_time   REAL,
+                parse_time   REAL,
+                output_path  TEXT,
+                output_size  INTEGER,
+                error        TEXT,
+                updated      REAL NOT NULL,
+                PRIMARY KEY (scope, item)
+            );
+        ''')
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _key(self, url):
+        return archive_key(url)
+
+    def add(self, scope, urls):
+        """Registers urls as pending (urls that are already known keep their status)."""
+        with self.lock:
+            self.db.executemany('INSERT OR IGNORE INTO items (scope, item, url, status, updated) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                [(scope, self._key(url), url, 'pending', time.time()) for url in urls])
+            self.db.commit()
+
+    def mark(self, scope, url, status, **fields):
+        """Sets the status of `url` along with any of the bytes, rows, fetch_time, parse_time,
+        output_path, output_size and error columns."""
+        if status not in STATUSES:
+            raise ValueError('Unknown manifest status: {}'.format(status))
+        fields.update(status=status, url=url, updated=time.time())
+        columns = ', '.join('{} = ?'.format(k) for k in fields)
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO items (scope, item, url, status, updated) '
+                            'VALUES (?, ?, ?, ?, ?)', (scope, self._key(url), url, status, time.time()))
+            self.db.execute('UPDATE items SET {} WHERE scope = ? AND item = ?'.format(columns),
+                            (*fields.values(), scope, self._key(url)))
+            self.db.commit()
+
+    def status(self, scope, url):
+        with self.lock:
+            row = self.db.execute('SELECT status FROM items WHERE scope = ? AND item = ?',
+                                  (scope, self._key(url))).fetchone()
+        return None if row is None else row[0]
+
+    def is_written(self, scope, url):
+        return self.status(scope, url) == 'written'
+
+    def remaining(self, scope, urls):
+        """The urls (in order) whose NYT source file hasn't been written yet."""
+        with self.lock:
+            written = {item for item, in self.db.execute(
+                'SELECT item FROM items WHERE scope = ? AND status = ?', (scope, 'written'))}
+        return [url for url in urls if self._key(url) not in written]
+
+    def begin_write(self, scope, url, output_path):
+        output_path = Path(output_path)
+        output_size = output_path.stat().st_size if output_path.is_file() else 0
+        self.mark(scope, url, 'parsed', output_path=str(output_path), output_size=output_size)
+
+    def end_write(self, scope, url):
+        self.mark(scope, url, 'written')
+
+    def recover(self, scope):
+        """Truncates output files that were left with a partially appended item."""
+        with self.lock:
+            rows = self.db.execute('SELECT output_path, MIN(output_size) FROM items '
+                                   'WHERE scope = ? AND status = ? AND output_size IS NOT NULL '
+                                   'GROUP BY output_path', (scope, 'parsed')).fetchall()
+            for output_path, output_size in rows:
+                output_path = Path(output_path)
+                if output_path.is_file() and output_path.stat().st_size > output_size:
+                    print('Removing a partially written update from {}'.format(output_path))
+                    if output_size == 0:
+                        #lets the next append write the csv header again
+                        output_path.unlink()
+                        continue
+                    with open(output_path, 'r+b') as file_handle:
+                        file_handle.truncate(output_size)
+            self.db.execute('UPDATE items SET output_size = NULL WHERE scope = ? AND status = ?',
+                            (scope, 'parsed'))
+            self.db.commit()
+
+    def scopes(self):
+        with self.lock:
+            return [scope for scope, in self.db.execute('SELECT DISTINCT scope FROM items ORDER BY scope')]
+
+    def summary(self, scope=None):
+        """Counts, bytes and rows per status, e.g. `{'written': (12, 80123456, 1200000), ...}`."""
+        query = 'SELECT status, COUNT(*), SUM(bytes), SUM(rows) FROM items'
+        params = ()
+        if scope is not None:
+            query += ' WHERE scope = ?'
+            params = (scope,)
+        with self.lock:
+            rows = self.db.execute(query + ' GROUP BY status', params).fetchall()
+        return {status: (count, nbytes or 0, nrows or 0) for status, count, nbytes, nrows in rows}
@@ -0,0 +1,194 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf)
+RATE_BUCKETS = (100, 1000, 5000, 10000, 25000, 50000, 100000, 250000, 1000000, math.inf)
+
+
+class Timer:
+    """Times a `with` block; `elapsed` holds the seconds it took once it exits."""
+
+    def __init__(self, metrics=None, name=None, labels=None):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels or {}
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        if self.metrics is not None:
+            self.metrics.observe(self.name, self.elapsed, **self.labels)
+
+
+class Metrics:
+    """Thread-safe counters and histograms describing a scraper run: bytes fetched, backoff time,
+    CDX hits filtered, rows parsed per second, aggregation time per state, ...
+
+    Series are identified by a name and labels (e.g. `inc('fetch_bytes_total', 1024, host=...)`).
+    `export` writes every series either as JSON lines (one object per series) or, for paths ending
+    in `.prom`, in the Prometheus text format, and `export_every` keeps doing so in the background
+    during long runs.  Worker processes send their series back with `drain`/`merge` (see
+    `election2020.parallel.StatePool`).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}     #(name, labels) -> value
+        self.histograms = {}   #(name, labels) -> {'buckets', 'counts', 'sum', 'count'}
+        self.exporter = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets),
+                                                    'sum': 0.0, 'count': 0}
+            for i, upper in enumerate(histogram['buckets']):
+                if value <= upper:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def timer(self, name, **labels):
+        """`with metrics.timer('parse_seconds', state='GA') as t:` observes the block's duration."""
+        return Timer(self, name, labels)
+
+    def record_rows(self, stage, rows, seconds, **labels):
+        #rows parsed by a stage, how long it took and the resulting throughput
+        self.inc('rows_parsed_total', rows, stage=stage, **labels)
+        self.observe('parse_seconds', seconds, stage=stage)
+        if seconds > 0:
+            self.observe('parse_rows_per_second', rows / seconds, buckets=RATE_BUCKETS, stage=stage)
+
+    def snapshot(self):
+        """Every series as plain (json-serializable) dicts."""
+        with self.lock:
+            series = [{'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}
+                      for (name, labels), value in self.counters.items()]
+            for (name, labels), histogram in self.histograms.items():
+                series.append({'type': 'histogram', 'name': name, 'labels': dict(labels),
+                               'buckets': list(histogram['buckets']), 'counts': list(histogram['counts']),
+                               'sum': histogram['sum'], 'count': histogram['count']})
+        return series
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def drain(self):
+        #the series recorded so far, which are cleared (e.g., at the end of a worker's task)
+        with self.lock:
+            counters, histograms = self.counters, self.histograms
+            self.counters, self.histograms = {}, {}
+        drained = Metrics()
+        drained.counters, drained.histograms = counters, histograms
+        return drained.snapshot()
+
+    def merge(self, series):
+        """Adds the series of another `Metrics` (e.g. a worker process's `drain`) to these."""
+        with self.lock:
+            for s in series:
+                key = self._key(s['name'], s['labels'])
+                if s['type'] == 'counter':
+                    self.counters[key] = self.counters.get(key, 0) + s['value']
+                    continue
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = {'buckets': list(s['buckets']),
+                                                        'counts': [0] * len(s['buckets']), 'sum': 0.0, 'count': 0}
+                histogram['counts'] = [a + b for a, b in zip(histogram['counts'], s['counts'])]
+                histogram['sum'] += s['sum']
+                histogram['count'] += s['count']
+
+    def to_jsonl(self):
+        lines = []
+        for s in self.snapshot():
+            if s['type'] == 'histogram':
+                s['mean'] = s['sum'] / s['count'] if s['count'] else None
+                s['buckets'] = ['+Inf' if math.isinf(b) else b for b in s['buckets']]
+            lines.append(json.dumps(s))
+        return ''.join(line + '\n' for line in lines)
+
+    def to_prometheus(self):
+        def labels_text(labels, **extra):
+            labels = dict(labels, **extra)
+            if not labels:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in sorted(labels.items())) + '}'
+
+        lines = []
+        typed = set()
+        for s in sorted(self.snapshot(), key=lambda s: (s['name'], sorted(s['labels'].items()))):
+            name = s['name']
+            if name not in typed:
+                lines.append('# TYPE {} {}'.format(name, s['type']))
+                typed.add(name)
+            if s['type'] == 'counter':
+                lines.append('{}{} {}'.format(name, labels_text(s['labels']), s['value']))
+                continue
+            cumulative = 0
+            for upper, count in zip(s['buckets'], s['counts']):
+                cumulative += count
+                le = '+Inf' if math.isinf(upper) else repr(float(upper))
+                lines.append('{}_bucket{} {}'.format(name, labels_text(s['labels'], le=le), cumulative))
+            lines.append('{}_sum{} {}'.format(name, labels_text(s['labels']), s['sum']))
+            lines.append('{}_count{} {}'.format(name, labels_text(s['labels']), s['count']))
+        return ''.join(line + '\n' for line in lines)
+
+    def export(self, path):
+        """Writes every series to `path`: Prometheus text for a `.prom` file, JSON lines otherwise.
+        The file is replaced atomically, so it can be read (or scraped) at any time."""
+        path = Path(path)
+        text = self.to_prometheus() if path.suffix == '.prom' else self.to_jsonl()
+        temp = tempfile.NamedTemporaryFile('w', prefix=path.name, dir=path.parent, delete=False)
+        with temp:
+            temp.write(text)
+        os.replace(temp.name, path)
+
+    def export_every(self, path, interval=60):
+        """Exports to `path` every `interval` seconds from a background thread, until `stop_export`."""
+        self.stop_export()
+        stop = threading.Event()
+        def run():
+            while not stop.wait(interval):
+                self.export(path)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.exporter = (stop, thread, path)
+
+    def stop_export(self):
+        #stops the background export, writing the final values
+        if self.exporter is None:
+            return
+        stop, thread, path = self.exporter
+        stop.set()
+        thread.join()
+        self.exporter = None
+        self.export(path)
+
+
+#the metrics of the current process, recorded by the fetch engine, the CDX searches and the scrapers
+METRICS = Metrics()
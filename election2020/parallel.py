@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+
+from election2020.metrics import METRICS
+from election2020.scripts import install_finder
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def _run_with_metrics(func, args, kwargs):
+    #runs in a worker process, sending the metrics it records back along with its result
+    METRICS.reset()
+    result = func(*args, **kwargs)
+    return result, METRICS.drain()
+
+
+class StatePool:
+    """Fans CPU-bound per-state post-processing (streamlining, filling in totals, building race
+    tables) out over a process pool.
+
+    A state's work is submitted as soon as its inputs are ready, so it overlaps with downloading
+    the next state, and at most `max_pending` states are queued at once so their inputs don't all
+    pile up in memory.  Results come back as `(state, result, error)` in the order the states were
+    submitted, whichever worker finishes first, so outputs are always merged in the same order.
+    With `workers=1` the work runs inline in the calling process.
+
+    Workers are spawned rather than forked, since the calling process is usually in the middle
+    of downloading on the fetch engine's threads.  The metrics a worker records (see
+    `election2020.metrics`) are merged into the calling process's as its results come back.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or self.workers + 1
+        self.executor = None
+        if self.workers > 1:
+            #the scripts' functions are pickled by the name `load_script` imported them as
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=install_finder)
+        self.pending = deque()
+
+    def submit(self, state, func, *args, **kwargs):
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            #waits for the oldest state before queueing more than `max_pending`
+            while len([f for _, f in self.pending if not f.done()]) >= self.max_pending:
+                wait([f for _, f in self.pending if not f.done()], return_when='FIRST_COMPLETED')
+            future = self.executor.submit(_run_with_metrics, func, args, kwargs)
+        self.pending.append((state, future))
+
+    def _pop(self):
+        state, future = self.pending.popleft()
+        error = future.exception()
+        if error is not None:
+            return state, None, error
+        result = future.result()
+        if self.executor is not None:
+            result, worker_metrics = result
+            METRICS.merge(worker_metrics)
+        return state, result, None
+
+    def completed(self):
+        """Yields the results of the states that are done, without waiting on the ones still running
+        (or on any done after an unfinished state, which keeps the order deterministic)."""
+        while self.pending and self.pending[0][1].done():
+            yield self._pop()
+
+    def results(self):
+        """Yields the results of every remaining state, waiting for each in turn."""
+        while self.pending:
+            yield self._pop()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+from election2020.rounding import vote_bounds
+from election2020.updates import utc_timestamps, vote_updates
+
+
+DELTA_COLUMNS = ['d_votes', 'd_dem', 'd_rep', 'd_other']
+
+
+def _county_key(county):
+    #county names as both the county and precinct scrapers spell them ('bibb', 'st.-johns', ...)
+    return county.astype(str).str.lower().str.replace(' ', '-').str.replace('-county', '', regex=False)
+
+def _times(updates):
+    return pd.to_datetime(updates['timestamp'], utc=True, format='ISO8601')
+
+def attribute(updates, targets, by):
+    """Matches every update to the first of `targets` (updates of a coarser series, e.g. the
+    state-level race) in the same `by` group at or after it, i.e., to the target whose window
+    (`prev_timestamp`, `timestamp`] it falls in.
+
+    Returns `updates` with the `target_timestamp` matched (NaN when no target follows) in the
+    original order.
+    """
+    updates = updates.reset_index(drop=True)
+    left = pd.DataFrame({column: updates[column] for column in by})
+    left['time'] = _times(updates)
+    left['row'] = np.arange(len(updates))
+    right = pd.DataFrame({column: targets[column] for column in by})
+    right['time'] = _times(targets)
+    right['target_timestamp'] = targets['timestamp'].to_numpy()
+    matched = pd.merge_asof(left.sort_values('time', kind='stable'), right.sort_values('time', kind='stable'),
+                            on='time', by=by, direction='forward')
+    updates['target_timestamp'] = matched.sort_values('row')['target_timestamp'].to_numpy()
+    return updates
+
+def _late_updates(states, county_updates, lag):
+    #a county update reported late leaves its votes unexplained in an earlier state update and
+    #too many in the one it's attributed to.  Every unexplained state update up to `lag` before
+    #a county update whose votes it lacks exactly is matched to it (the latest such state update
+    #to the earliest county update)
+    unexplained = states.loc[states['residual_votes'] != 0, ['state', 'timestamp', 'residual_votes']]
+    candidates = county_updates.reset_index().merge(unexplained, left_on=['state', 'd_votes'],
+                                                    right_on=['state', 'residual_votes'], suffixes=('', '_state'))
+    county_times, state_times = _times(candidates), pd.to_datetime(candidates['timestamp_state'], utc=True,
+                                                                   format='ISO8601')
+    candidates = candidates[(state_times < county_times) & (state_times >= county_times - lag)]
+    candidates = candidates.sort_values(['timestamp_state', 'timestamp'], ascending=[False, True], kind='stable')
+    candidates = candidates.drop_duplicates('index').drop_duplicates(['state', 'timestamp_state'])
+    return candidates.set_index('index')['timestamp_state']
+
+def explain(targets, attributed, by, part):
+    """Sums the attributed updates (see `attribute`) of every target: `explained_*` votes, the
+    `residual_*` votes that they leave unexplained, how many `part`s (e.g. 'county') contributed
+    and the `top_<part>`, the one that contributed the most votes."""
+    keys = by + ['target_timestamp']
+    attributed = attributed.dropna(subset=['target_timestamp'])
+    sums = attributed.groupby(keys, sort=False)[DELTA_COLUMNS].sum()
+    sums.columns = ['explained_' + column[2:] for column in DELTA_COLUMNS]
+    sums[part + 's'] = attributed.groupby(keys, sort=False).size()
+    #the largest contributor of every target, without a per-group function call
+    order = attributed['d_votes'].abs().sort_values(ascending=False, kind='stable').index
+    top = attributed.loc[order].drop_duplicates(keys).set_index(keys)[part]
+    sums['top_' + part] = top
+    sums = sums.reset_index().rename(columns={'target_timestamp': 'timestamp'})
+
+    report = targets.merge(sums, how='left', on=by + ['timestamp'])
+    report[part + 's'] = report[part + 's'].fillna(0).astype(int)
+    for column in DELTA_COLUMNS:
+        explained = 'explained_' + column[2:]
+        report[explained] = report[explained].fillna(0)
+        report['residual_' + column[2:]] = report[column] - report[explained]
+    return report.reset_index(drop=True)
+
+def reconcile(races, counties, precincts=None, lag=None, race_id='G-P'):
+    """Attributes every state-level update of the presidential race (`race_id`) to the county
+    updates that explain it, and every county update to its precincts' updates.
+
+    `races`, `counties` and `precincts` are the outputs of the three scrapers (for any number of
+    states).  County updates are placed at their counties' `last_updated` and matched to the
+    state update whose window they fall in (see `attribute`); precinct totals are matched to their
+    county's updates in the same way.  With a `lag` (a `pd.Timedelta`), a county update whose votes
+    are exactly those missing from a state update up to `lag` earlier is attributed to that update
+    instead, and flagged as `late` (like Bibb County's on election night).
+
+    Returns the state updates with the votes the counties explain and the residuals they leave.
+    `residual_votes` is exact.  The state's candidate votes are only estimates, so `explained`
+    checks the counties' votes against the bounds of the state's rounded vote fractions.  Also
+    returns the county updates with the state update each was attributed to (`target_timestamp`)
+    and, with `precincts`, the precincts' explained votes and residuals.
+    """
+    races = races[races['race_id'] == race_id]
+    states = vote_updates(races, 'races')
+    #the counties' own update times (the output's `timestamp` is the state's at the snapshot), so
+    #a county that didn't change between snapshots gives no update
+    counties = counties.assign(timestamp=counties['last_updated'])
+    county_updates = vote_updates(counties, 'counties')
+    county_updates['county'] = _county_key(county_updates['county'])
+    county_updates = attribute(county_updates, states, ['state'])
+    report = explain(states, county_updates, ['state'], 'county')
+    county_updates['late'] = False
+    if lag is not None:
+        late = _late_updates(report, county_updates, lag)
+        county_updates.loc[late.index, 'target_timestamp'] = late
+        county_updates.loc[late.index, 'late'] = True
+        report = explain(states, county_updates, ['state'], 'county')
+    #the candidates' state-level updates are only known to within the bounds their rounded vote
+    #fractions allow (see `vote_bounds`), so the counties explain an update if they fall inside
+    bounds = vote_bounds(races)
+    bounds['timestamp'] = utc_timestamps(bounds['timestamp'])
+    bounds = bounds.drop_duplicates(['state', 'race_id', 'timestamp'], keep='last')
+    states = report.merge(bounds[['state', 'race_id', 'timestamp', 'd_dem_min', 'd_dem_max', 'd_rep_min', 'd_rep_max']],
+                          how='left', on=['state', 'race_id', 'timestamp'])
+    states['explained'] = ((states['residual_votes'] == 0)
+                           & states['explained_dem'].between(states['d_dem_min'], states['d_dem_max'])
+                           & states['explained_rep'].between(states['d_rep_min'], states['d_rep_max']))
+
+    if precincts is not None:
+        #precinct totals (without the county-wide rows some files have), at their files' timestamps
+        totals = precincts[(precincts['vote_type'] == 'total') & (precincts['precinct'] != 'COUNTY')]
+        precinct_updates = vote_updates(totals, 'precincts')
+        precinct_updates['county'] = _county_key(precinct_updates['county'])
+        precinct_updates = attribute(precinct_updates, county_updates, ['state', 'county'])
+        county_updates = explain(county_updates, precinct_updates, ['state', 'county'], 'precinct')
+        county_updates['explained'] = (county_updates[['residual_' + c[2:] for c in DELTA_COLUMNS]] == 0).all(axis=1)
+    return states, county_updates
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+
+
+#column types of the rows extracted by the scrapers: 'label' columns are interned into
+#categorical codes, 'int' columns are vote counts (with missing values) and 'float' columns are
+#margins or shares
+PRECINCT_SCHEMA = {'state': 'label', 'county': 'label', 'precinct': 'label', 'fips': 'label',
+                   'timestamp': 'label', 'vote_type': 'label', 'votes': 'int', 'votes_biden': 'int',
+                   'votes_trump': 'int', 'votes_jorgensen': 'int', 'votes_other': 'int'}
+COUNTY_SCHEMA = {'state': 'label', 'county': 'label', 'fips': 'label', 'timestamp': 'label',
+                 'last_updated': 'label', 'absentee_dem': 'int', 'absentee_rep': 'int',
+                 'absentee_jorgensen': 'int', 'votes_dem': 'int', 'votes_rep': 'int',
+                 'votes_jorgensen': 'int', 'absentee2020': 'int', 'votes2020': 'int',
+                 'margin2020': 'float', 'votes2016': 'int', 'margin2016': 'float', 'votes2012': 'int',
+                 'margin2012': 'float'}
+
+
+class GrowableArray:
+    """A preallocated numpy array that doubles its capacity as it fills up."""
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        end = self.size + values.size
+        if end > self.data.size:
+            grown = np.empty(max(end, 2 * self.data.size), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:end] = values
+        self.size = end
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class LabelColumn:
+    """Interned labels: every distinct label is stored once (as a string) and rows only hold its
+    integer code.  Missing labels (None/NaN) get code -1."""
+
+    def __init__(self):
+        self.codes = GrowableArray(np.int32)
+        self.lookup = {}
+        self.labels = []
+
+    def code(self, label):
+        if label is None or label != label:
+            return -1
+        label = str(label)
+        code = self.lookup.get(label)
+        if code is None:
+            code = self.lookup[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def extend(self, labels, size=None):
+        if size is not None:
+            #the same label for every row (e.g., the state or the timestamp of a file)
+            self.codes.extend(np.full(size, self.code(labels), dtype=np.int32))
+        else:
+            self.codes.extend(np.fromiter((self.code(label) for label in labels), dtype=np.int32))
+
+    def to_pandas(self):
+        #categories are sorted so that sorting (and grouping) the column orders rows exactly like
+        #sorting the plain strings
+        labels = np.array(self.labels, dtype=object)
+        order = np.argsort(labels, kind='stable')
+        rank = np.empty(order.size + 1, dtype=np.int32)
+        rank[order] = np.arange(order.size)
+        rank[-1] = -1
+        return pd.Categorical.from_codes(rank[self.codes.view()], categories=pd.Index(labels[order], dtype=object))
+
+
+class IntColumn:
+    """Integer counts with a null mask, handed to pandas as a nullable `Int64` column."""
+
+    def __init__(self):
+        self.values = GrowableArray(np.int64)
+        self.mask = GrowableArray(bool)
+
+    def extend(self, values, size=None):
+        values = np.full(size, values, dtype=float) if size is not None else np.asarray(values, dtype=float)
+        missing = np.isnan(values)
+        self.values.extend(np.where(missing, 0, values))
+        self.mask.extend(missing)
+
+    def to_pandas(self):
+        return pd.arrays.IntegerArray(self.values.view().copy(), self.mask.view().copy())
+
+
+class FloatColumn:
+    def __init__(self):
+        self.values = GrowableArray(np.float64)
+
+    def extend(self, values, size=None):
+        self.values.extend(np.full(size, values, dtype=float) if size is not None else values)
+
+    def to_pandas(self):
+        return self.values.view().copy()
+
+
+COLUMN_TYPES = {'label': LabelColumn, 'int': IntColumn, 'float': FloatColumn}
+
+
+class RecordBuffer:
+    """Accumulates extracted rows column by column, without a dict (or boxed values) per row.
+
+    Labels (state, county, precinct, vote type, ...) are interned into categorical codes and vote
+    counts go into growable integer arrays with a null mask, so `to_frame` hands pandas ready-made
+    `category`/`Int64` columns instead of having it infer object/float64 columns from records.
+    """
+
+    def __init__(self, schema):
+        self.schema = dict(schema)
+        self.columns = {name: COLUMN_TYPES[kind]() for name, kind in self.schema.items()}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, columns, size):
+        """Appends `size` rows given as `{column: values}`, where values are sequences of length
+        `size` or a single scalar shared by every row."""
+        for name, column in self.columns.items():
+            values = columns.get(name)
+            if np.ndim(values) == 0:
+                column.extend(values, size=size)
+            else:
+                column.extend(values)
+        self.size += size
+
+    def to_frame(self):
+        return pd.DataFrame({name: column.to_pandas() for name, column in self.columns.items()},
+                            index=pd.RangeIndex(self.size))
+
+
+def concat_records(frames):
+    """`pd.concat` of `RecordBuffer.to_frame` outputs that keeps the label columns categorical.
+
+    (pandas falls back to object columns when the frames' categories differ, so the categories
+    are first unified, which only remaps each frame's codes.)
+    """
+    frames = list(frames)
+    if len(frames) < 2:
+        return frames[0].reset_index(drop=True) if frames else pd.DataFrame()
+    frames = [df.copy() for df in frames]
+    for column in frames[0].columns:
+        if all(isinstance(df[column].dtype, pd.CategoricalDtype) for df in frames):
+            categories = sorted(set().union(*(df[column].cat.categories for df in frames)))
+            categories = pd.Index(categories, dtype=object)
+            for df in frames:
+                df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
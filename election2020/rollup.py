@@ -0,0 +1,346 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from election2020.updates import COUNT_COLUMNS, DATASETS
+from election2020.sinks import uncategorize
+
+
+#the bucket sizes rolled up, finest first (pandas frequencies)
+RESOLUTIONS = ['1min', '5min', '1h', '1D']
+#the levels each dataset is rolled up to, and the columns that identify a curve at each level
+LEVELS = {'precincts': ['county', 'state'], 'counties': ['county', 'state'], 'races': ['race']}
+LEVEL_COLUMNS = {'county': ['state', 'county'], 'state': ['state'], 'race': ['state', 'race_id']}
+#the column holding the time of each dataset's rows (the race tables' `timestamp` is the page's)
+TIME_COLUMNS = {'precincts': 'timestamp', 'counties': 'timestamp', 'races': 'date'}
+DELTA_COLUMNS = ['d_' + column for column in COUNT_COLUMNS]
+KEY_COLUMNS = ['dataset', 'level', 'resolution', 'state', 'county', 'race_id', 'bucket']
+
+
+def _utc(value):
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+def _format(times):
+    #UTC times as text (like `utc_timestamps`), formatting each distinct time once
+    codes, uniq_times = pd.factorize(times)
+    return np.asarray(pd.DatetimeIndex(uniq_times).strftime('%Y-%m-%dT%H:%M:%SZ'), dtype=object)[codes]
+
+def _series_counts(dataset, df):
+    """The cumulative counts (`votes`, `dem`, `rep`, `other`) of every series in an output, one row
+    per series and time (the last one if there are several), sorted by series and time.
+
+    Precinct outputs are reduced to the 'total' vote type of the actual precincts (without the
+    'COUNTY'/'STATE' rows of `streamline_data`), which the counties and states are the sum of.
+    """
+    spec = DATASETS[dataset]
+    df = uncategorize(df.reset_index(drop=True))
+    if dataset == 'precincts':
+        df = df[(df['vote_type'] == 'total') & ~df['precinct'].isin(['COUNTY', 'STATE'])
+                & (df['county'] != 'STATE')].reset_index(drop=True)
+    labels = [column for column in spec['series'] if column != 'vote_type']
+    counts = pd.DataFrame({column: df[column].astype(str) for column in labels})
+    counts['time'] = pd.to_datetime(df[TIME_COLUMNS[dataset]].astype(str), utc=True, format='ISO8601')
+    for column, values in zip(COUNT_COLUMNS, spec['counts'](df)):
+        counts[column] = pd.to_numeric(values, errors='coerce')
+    counts = counts.dropna(subset=['time']).dropna(subset=COUNT_COLUMNS, how='all')
+    counts = counts.sort_values(labels + ['time'], kind='stable')
+    counts = counts.drop_duplicates(labels + ['time'], keep='last').reset_index(drop=True)
+    counts['series'] = counts[labels[0]]
+    for column in labels[1:]:
+        counts['series'] = counts['series'] + '|' + counts[column]
+    for column in ('county', 'race_id'):
+        if column not in counts:
+            counts[column] = ''
+    return counts
+
+def _deltas(counts, previous=None):
+    """The votes each row of `_series_counts` adds to its series: the difference from the row
+    before it, or from the series' `previous` counts (a frame indexed by series) for its first row.
+    A count missing from a row is carried over from the row before."""
+    series_ids = pd.factorize(counts['series'])[0]
+    first = np.append(True, series_ids[1:] != series_ids[:-1])
+    values = counts[COUNT_COLUMNS].groupby(series_ids).ffill().to_numpy(dtype=float)
+    before = np.vstack([np.full((1, len(COUNT_COLUMNS)), np.nan), values[:-1]])
+    if previous is not None and len(previous):
+        before[first] = previous.reindex(counts['series'][first])[COUNT_COLUMNS].to_numpy(dtype=float)
+    else:
+        before[first] = np.nan
+    #missing counts are carried over (a series' first counts are relative to 0)
+    values = np.where(np.isnan(values), before, values)
+    deltas = np.nan_to_num(values) - np.nan_to_num(before)
+    out = counts.drop(columns=COUNT_COLUMNS).copy()
+    for i, column in enumerate(DELTA_COLUMNS):
+        out[column] = deltas[:, i]
+    out['updates'] = (deltas != 0).any(axis=1).astype(int)
+    return out, values
+
+def _buckets(deltas, level, resolutions):
+    #the votes added to each curve of a level in each bucket of every resolution (in one groupby,
+    #with the rows repeated once per resolution), sorted by curve, resolution and bucket
+    columns = LEVEL_COLUMNS[level]
+    times = pd.DatetimeIndex(deltas['time']).as_unit('ns').asi8
+    steps = np.array([pd.Timedelta(resolution).value for resolution in resolutions])
+    df = pd.concat([deltas[columns + DELTA_COLUMNS + ['updates']]] * len(resolutions), ignore_index=True)
+    df['resolution'] = np.repeat(np.asarray(resolutions, dtype=object), len(deltas))
+    df['bucket'] = (times[None, :] // steps[:, None] * steps[:, None]).ravel()
+    df['last_timestamp'] = np.tile(times, len(resolutions))
+    grouped = df.groupby(columns + ['resolution', 'bucket'], sort=True)
+    buckets = grouped[DELTA_COLUMNS + ['updates']].sum()
+    buckets['last_timestamp'] = grouped['last_timestamp'].max()
+    buckets = buckets.reset_index()
+    for column in ('county', 'race_id'):
+        if column not in columns:
+            buckets[column] = ''
+    for column in ('bucket', 'last_timestamp'):
+        buckets[column] = _format(pd.to_datetime(buckets[column], utc=True))
+    return buckets
+
+class RollupCache:
+    """The state, county and race curves of the precinct, county and race outputs, rolled up into
+    1 minute, 5 minute, hourly and daily buckets in SQLite, so that a chart of election night (or
+    of one 5 minute window) reads a few hundred rows instead of aggregating millions.
+
+    Each bucket holds the cumulative counts (`votes`, `dem`, `rep`, `other`) as of its end, the
+    votes added in it (`d_*`) and the number of series `updates` in it; buckets without rows are
+    left out.  `add` replaces the rollups of the states in an output, and `refresh` adds newly
+    written rows (e.g. the snapshot appended by a live poll) to the rollups in place.
+    """
+
+    def __init__(self, path, resolutions=RESOLUTIONS, timeout=60):
+        self.path = Path(path)
+        self.resolutions = list(resolutions)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), timeout=timeout, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS rollups (
+                dataset        TEXT NOT NULL,
+                level          TEXT NOT NULL,
+                resolution     TEXT NOT NULL,
+                state          TEXT NOT NULL,
+                county         TEXT NOT NULL,
+                race_id        TEXT NOT NULL,
+                bucket         TEXT NOT NULL,
+                votes          REAL,
+                dem            REAL,
+                rep            REAL,
+                other          REAL,
+                d_votes        REAL,
+                d_dem          REAL,
+                d_rep          REAL,
+                d_other        REAL,
+                updates        INTEGER NOT NULL,
+                last_timestamp TEXT,
+                PRIMARY KEY (dataset, level, resolution, state, county, race_id, bucket)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rollup_series (
+                dataset        TEXT NOT NULL,
+                state          TEXT NOT NULL,
+                series         TEXT NOT NULL,
+                timestamp      TEXT NOT NULL,
+                votes          REAL,
+                dem            REAL,
+                rep            REAL,
+                other          REAL,
+                PRIMARY KEY (dataset, state, series)
+            );
+        ''')
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def clear(self, dataset, states=None):
+        #removes the rollups of `states` (every state by default) of the `dataset`
+        with self.lock:
+            for table in ('rollups', 'rollup_series'):
+                if states is None:
+                    self.db.execute('DELETE FROM {} WHERE dataset = ?'.format(table), (dataset,))
+                else:
+                    self.db.executemany('DELETE FROM {} WHERE dataset = ? AND state = ?'.format(table),
+                                        [(dataset, state) for state in states])
+            self.db.commit()
+
+    def _save_series(self, dataset, counts, values):
+        #the latest counts of every series, which `refresh` adds the next rows to
+        last = np.append(counts['series'].to_numpy()[1:] != counts['series'].to_numpy()[:-1], True)
+        latest = counts.loc[last, ['state', 'series']].assign(
+            timestamp=_format(counts.loc[last, 'time']))
+        for i, column in enumerate(COUNT_COLUMNS):
+            latest[column] = values[last, i]
+        self.db.executemany('INSERT OR REPLACE INTO rollup_series VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            [(dataset,) + row for row in latest.itertuples(index=False, name=None)])
+
+    def add(self, dataset, df, replace=True):
+        """Rolls up `df` (an output of the `dataset` scraper, e.g. a state's table).
+
+        The previous rollups of the states in `df` are replaced, unless `replace` is False (e.g.
+        when an output is added a range of counties at a time, after `clear`); then the state
+        curves are left to `roll_up_states`, once every county was added.
+        """
+        counts = _series_counts(dataset, df)
+        if counts.empty:
+            return 0
+        states = counts['state'].unique().tolist()
+        if replace:
+            self.clear(dataset, states)
+        deltas, values = _deltas(counts)
+        #the curves of each level (the states only once all their counties are in), and their
+        #cumulative counts as the running sum of their buckets
+        rollups = []
+        for level in LEVELS[dataset][:None if replace else 1]:
+            buckets = _buckets(deltas, level, self.resolutions)
+            cumulative = buckets.groupby(LEVEL_COLUMNS[level] + ['resolution'], sort=False)[DELTA_COLUMNS].cumsum()
+            for column in COUNT_COLUMNS:
+                buckets[column] = cumulative['d_' + column]
+            rollups.append(buckets.assign(dataset=dataset, level=level))
+        rollups = pd.concat(rollups, ignore_index=True)
+        with self.lock:
+            rollups.to_sql('rollups', self.db, if_exists='append', index=False, chunksize=50000)
+            self._save_series(dataset, counts, values)
+            self.db.commit()
+        return len(counts)
+
+    def roll_up_states(self, dataset, states=None):
+        #the state curves (of every state by default) as the sum of their counties' buckets
+        base, level = LEVELS[dataset]
+        clauses, params = ['dataset = ?', 'level = ?'], [dataset, base]
+        if states is not None:
+            clauses.append('state IN ({})'.format(', '.join('?' * len(states))))
+            params += list(states)
+        with self.lock:
+            self.db.execute('DELETE FROM rollups WHERE dataset = ? AND level = ? AND {}'.format(
+                            ' AND '.join(clauses[2:]) or '1'), [dataset, level] + params[2:])
+            self.db.execute('''
+                INSERT INTO rollups
+                SELECT dataset, ?, resolution, state, '', '', bucket, {cumulative}, {sums}, SUM(updates),
+                       MAX(last_timestamp)
+                FROM rollups WHERE {where}
+                GROUP BY dataset, resolution, state, bucket'''.format(
+                    cumulative=', '.join('SUM(SUM({0})) OVER (PARTITION BY resolution, state ORDER BY bucket)'.format(c)
+                                         for c in DELTA_COLUMNS),
+                    sums=', '.join('SUM({})'.format(c) for c in DELTA_COLUMNS), where=' AND '.join(clauses)),
+                [level] + params)
+            self.db.commit()
+
+    def refresh(self, dataset, df):
+        """Adds the rows of `df` (e.g. a live snapshot just appended to an output) to the rollups of
+        their states: each row counts the votes since its series' latest row, and the buckets from
+        its time on are updated in place.
+
+        Rows no later than their series' latest row (e.g. a backfilled archived snapshot) are left
+        out; `add` the whole output again to include them.  Returns the number of rows added.
+        """
+        counts = _series_counts(dataset, df)
+        if not len(counts):
+            return 0
+        states = counts['state'].unique().tolist()
+        with self.lock:
+            previous = pd.read_sql_query(
+                'SELECT * FROM rollup_series WHERE dataset = ? AND state IN ({})'.format(', '.join('?' * len(states))),
+                self.db, params=[dataset] + states).set_index('series')
+        latest = pd.to_datetime(previous['timestamp'].reindex(counts['series']), utc=True, format='ISO8601')
+        #(compared as aligned series: an array of only NaT, for states without rollups yet, isn't
+        #comparable to the times)
+        counts = counts[~(counts['time'] <= latest.set_axis(counts.index))].reset_index(drop=True)
+        if not len(counts):
+            return 0
+        deltas, values = _deltas(counts, previous)
+
+        changes = [_buckets(deltas, level, self.resolutions).assign(level=level) for level in LEVELS[dataset]]
+        changes = pd.concat(changes, ignore_index=True).assign(dataset=dataset)
+        keys = changes[KEY_COLUMNS[:-1]].itertuples(index=False, name=None)
+        rows = [key + (bucket,) + tuple(d) + (updates, last) for key, bucket, d, updates, last in zip(
+            keys, changes['bucket'], changes[DELTA_COLUMNS].itertuples(index=False, name=None),
+            changes['updates'], changes['last_timestamp'])]
+        key_clause = ' AND '.join('{} = ?'.format(column) for column in KEY_COLUMNS[:-1])
+        with self.lock:
+            #the later buckets' cumulative counts grow by the votes added, ...
+            self.db.executemany('UPDATE rollups SET {} WHERE {} AND bucket > ?'.format(
+                ', '.join('{0} = {0} + ?'.format(c) for c in COUNT_COLUMNS), key_clause),
+                [d + key + (bucket,) for key, bucket, d in ((r[:6], r[6], r[7:11]) for r in rows)])
+            #... a bucket that exists also adds them to its own votes, ...
+            self.db.executemany('UPDATE rollups SET {}, {}, updates = updates + ?, last_timestamp = MAX(last_timestamp, ?) '
+                                'WHERE {} AND bucket = ?'.format(
+                ', '.join('{0} = {0} + ?'.format(c) for c in COUNT_COLUMNS),
+                ', '.join('{0} = {0} + ?'.format(c) for c in DELTA_COLUMNS), key_clause),
+                [d + d + (updates, last) + key + (bucket,) for key, bucket, d, updates, last in
+                 ((r[:6], r[6], r[7:11], r[11], r[12]) for r in rows)])
+            #... and a new one starts from the cumulative counts of the bucket before it
+            self.db.executemany('''
+                INSERT OR IGNORE INTO rollups
+                SELECT ?, ?, ?, ?, ?, ?, ?, {cumulative}, ?, ?, ?, ?, ?, ?
+                FROM (SELECT 1) LEFT JOIN (
+                    SELECT votes, dem, rep, other FROM rollups WHERE {key_clause} AND bucket < ?
+                    ORDER BY bucket DESC LIMIT 1) AS before'''.format(
+                    cumulative=', '.join('COALESCE(before.{}, 0) + ?'.format(c) for c in COUNT_COLUMNS),
+                    key_clause=key_clause),
+                [r[:7] + r[7:11] + r[7:] + r[:6] + (r[6],) for r in rows])
+            self._save_series(dataset, counts, values)
+            self.db.commit()
+        return len(counts)
+
+    def rollups(self, dataset, level, state, county=None, race_id=None, start=None, end=None, resolution=None,
+                max_points=1000):
+        """The buckets of one curve (e.g. `rollups('counties', 'county', 'GA', county='bibb')` or
+        `rollups('races', 'race', 'GA', race_id='G-P')`) between two times (anything
+        `pd.to_datetime` parses, in UTC unless given a time zone), with their start as `time`.
+
+        Unless a `resolution` is given, the finest one with at most `max_points` buckets in the
+        window is read, so zooming in on a few minutes reads minute buckets and a whole week
+        reads hourly ones.
+        """
+        key = [dataset, level, state, county or '', race_id or '']
+        start, end = (None if value is None else _utc(value) for value in (start, end))
+        if resolution is None:
+            span = None if start is None or end is None else end - start
+            if span is None:
+                with self.lock:
+                    first, last = self.db.execute(
+                        'SELECT MIN(bucket), MAX(bucket) FROM rollups WHERE dataset = ? AND level = ? AND state = ? '
+                        'AND county = ? AND race_id = ? AND resolution = ?', key + [self.resolutions[-1]]).fetchone()
+                if first is not None:
+                    span = ((end or _utc(last) + pd.Timedelta(self.resolutions[-1]))
+                            - (start or _utc(first)))
+            resolution = next((r for r in self.resolutions if span is None or span / pd.Timedelta(r) <= max_points),
+                              self.resolutions[-1])
+        clauses = ['dataset = ?', 'level = ?', 'state = ?', 'county = ?', 'race_id = ?', 'resolution = ?']
+        params = key + [resolution]
+        #a bucket is in the window if any of it is
+        if start is not None:
+            clauses.append('bucket >= ?')
+            params.append(start.floor(resolution).strftime('%Y-%m-%dT%H:%M:%SZ'))
+        if end is not None:
+            clauses.append('bucket <= ?')
+            params.append(end.strftime('%Y-%m-%dT%H:%M:%SZ'))
+        with self.lock:
+            df = pd.read_sql_query('SELECT * FROM rollups WHERE {} ORDER BY bucket'.format(' AND '.join(clauses)),
+                                   self.db, params=params)
+        df.insert(0, 'time', pd.to_datetime(df['bucket'], utc=True, format='ISO8601'))
+        return df
+
+    def curves(self, datasets=None, states=None):
+        """The dataset, level, state, county and race_id of every curve rolled up (of the
+        `datasets` and `states` given), sorted."""
+        clauses, params = ['resolution = ?'], [self.resolutions[-1]]
+        for column, values in (('dataset', datasets), ('state', states)):
+            if values is not None:
+                clauses.append('{} IN ({})'.format(column, ', '.join('?' * len(values))))
+                params += list(values)
+        with self.lock:
+            return pd.read_sql_query('SELECT DISTINCT dataset, level, state, county, race_id FROM rollups WHERE {} '
+                                     'ORDER BY dataset, state, level, county, race_id'.format(' AND '.join(clauses)),
+                                     self.db, params=params)
+
+    def state_rollups(self, dataset, state, resolution):
+        #the buckets of every curve of a state at one resolution, in one read (e.g. to chart them all)
+        with self.lock:
+            df = pd.read_sql_query('SELECT * FROM rollups WHERE dataset = ? AND state = ? AND resolution = ? '
+                                   'ORDER BY level, county, race_id, bucket', self.db,
+                                   params=[dataset, state, resolution])
+        df.insert(0, 'time', pd.to_datetime(df['bucket'], utc=True, format='ISO8601'))
+        return df
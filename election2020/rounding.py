@@ -0,0 +1,63 @@
+import numpy as np
+
+from election2020.updates import utc_timestamps
+
+
+PARTIES = ['dem', 'rep', 'extra']
+
+
+def share_bounds(votes, shares, precision=3):
+    """The smallest and largest whole number of votes out of `votes` whose share rounds to
+    `shares` (arrays) at `precision` decimals, as float arrays (NaN where either is missing).
+
+    A share f = k / 10**precision stands for any count c with |c / votes - f| <= 1 / (2 * 10**precision),
+    i.e. (2k - 1) * votes <= 2 * 10**precision * c <= (2k + 1) * votes, which is solved in integers
+    so that no bound is off by one from floating point error.
+    """
+    votes, shares = np.asarray(votes, dtype=float), np.asarray(shares, dtype=float)
+    valid = np.isfinite(votes) & np.isfinite(shares)
+    scale = 10**precision
+    v = np.where(valid, votes, 0).astype(np.int64)
+    k = np.where(valid, np.round(shares * scale), 0).astype(np.int64)
+    low = -((-(2 * k - 1) * v) // (2 * scale))
+    high = ((2 * k + 1) * v) // (2 * scale)
+    low, high = np.clip(low, 0, v), np.clip(high, 0, v)
+    return np.where(valid, low, np.nan), np.where(valid, high, np.nan)
+
+def vote_bounds(df, precision=3):
+    """Bounds on the votes of every candidate in an output of the house/senate/president scraper
+    (for any number of states and races), whose shares were rounded to `precision` decimals.
+
+    Adds `votes_<party>_min`/`_max` for each of 'dem', 'rep' and 'extra' (tightened so that the
+    three never add up to more than `votes2020`) and, for each update, the bounds of the votes
+    each candidate gained since the race's previous timestamp: `d_<party>_min`/`_max` (and
+    `d_votes`, which is exact).  The rows come back sorted by state, race and timestamp.
+    """
+    df = df.reset_index(drop=True)
+    df = df.assign(utc_timestamp=utc_timestamps(df['timestamp']))
+    df = df.sort_values(['state', 'race_id', 'utc_timestamp'], kind='stable', ignore_index=True)
+
+    votes = df['votes2020'].to_numpy(dtype=float)
+    bounds = {party: share_bounds(votes, df['vf_' + party].to_numpy(dtype=float), precision)
+              for party in PARTIES}
+    #no candidate can have more than the votes left once the others have their fewest
+    for party in PARTIES:
+        others = sum(np.nan_to_num(bounds[other][0]) for other in PARTIES if other != party)
+        low, high = bounds[party]
+        bounds[party] = (low, np.minimum(high, votes - others))
+
+    group_ids = df.groupby(['state', 'race_id'], sort=False).ngroup().to_numpy()
+    first = np.append(True, group_ids[1:] != group_ids[:-1])
+    def previous(values):
+        shifted = np.append(np.nan, values[:-1])
+        shifted[first] = np.nan
+        return shifted
+
+    df['d_votes'] = votes - previous(votes)
+    for party in PARTIES:
+        low, high = bounds[party]
+        df['votes_{}_min'.format(party)] = low
+        df['votes_{}_max'.format(party)] = high
+        df['d_{}_min'.format(party)] = low - previous(high)
+        df['d_{}_max'.format(party)] = high - previous(low)
+    return df.drop(columns='utc_timestamp')
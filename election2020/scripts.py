@@ -0,0 +1,40 @@
+import importlib
+import importlib.abc
+import importlib.util
+import sys
+from pathlib import Path
+
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+SCRIPTS = {
+    'precincts':          'precinct-level-president/precincts_presidential_scraper.py',
+    'precincts_improved': 'precinct-level-president/precincts_presidential_scraper_improved.py',
+    'county':             'county-level-president/county_presidential_scraper.py',
+    'races':              'house-senate-president/house-senate-president_scraper.py',
+    'crawler':            'precinct-level-president/archived_nyt_election_url_crawler.py',
+}
+MODULE_PREFIX = 'election2020_script_'
+
+
+class ScriptFinder(importlib.abc.MetaPathFinder):
+    """Lets `import election2020_script_<name>` find the scripts, so that their functions can be
+    unpickled by spawned worker processes (see `election2020.parallel.StatePool`)."""
+
+    def find_spec(self, fullname, path, target=None):
+        name = fullname[len(MODULE_PREFIX):]
+        if not fullname.startswith(MODULE_PREFIX) or name not in SCRIPTS:
+            return None
+        return importlib.util.spec_from_file_location(fullname, REPO_DIR / SCRIPTS[name])
+
+
+def install_finder():
+    if not any(isinstance(finder, ScriptFinder) for finder in sys.meta_path):
+        sys.meta_path.append(ScriptFinder())
+
+def load_script(name):
+    """Imports one of the scraper scripts (which live in folders that aren't valid package names)."""
+    if name not in SCRIPTS:
+        raise KeyError('Unknown script: {}'.format(name))
+    install_finder()
+    return importlib.import_module(MODULE_PREFIX + name)
@@ -0,0 +1,138 @@
+import hashlib
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+CATEGORICAL_COLUMNS = ['state', 'county', 'precinct', 'vote_type', 'race_id']
+INTEGER_COLUMNS = ['fips', 'votes', 'votes_biden', 'votes_trump', 'votes_jorgensen', 'votes_other',
+                   'votes_dem', 'votes_rep', 'absentee_dem', 'absentee_rep', 'absentee_jorgensen',
+                   'absentee2020', 'votes2020', 'votes2016', 'votes2012']
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Writing or reading parquet output requires pyarrow (pip install pyarrow)')
+    return pyarrow, pyarrow.parquet
+
+
+class CsvSink:
+    """The scrapers' original output: every `write` appends to a single csv file.
+
+    `write` appends and `replace` overwrites.  A csv file holds a single key's rows, so
+    replacing one key replaces the whole file.
+    """
+
+    format = 'csv'
+
+    def __init__(self, path, index=True):
+        self.path = Path(path)
+        self.index = index
+
+    def exists(self):
+        return self.path.is_file()
+
+    def reset(self):
+        self.path.unlink(missing_ok=True)
+
+    def write(self, df, key=None):
+        df.to_csv(self.path, mode='a', header=not self.path.is_file(), index=self.index)
+
+    def replace(self, df, key=None):
+        #the csv file only ever holds one key's rows when it's written with `replace`
+        self.reset()
+        self.write(df, key)
+
+    def read(self, state=None, columns=None, dtype=None):
+        df = pd.read_csv(self.path, index_col=0 if self.index else None, dtype=dtype)
+        if state is not None:
+            df = df[df['state'] == state]
+        return df if columns is None else df[columns]
+
+
+class ParquetSink:
+    """Typed, dictionary-encoded parquet dataset partitioned by state (and optionally snapshot date).
+
+    County/precinct/vote_type labels are written as categoricals and vote counts as nullable
+    integers.  Every `write` adds one file per partition named after `key` (e.g., the archived
+    url the rows came from), so writing the same key again (with `write` or `replace`) replaces
+    its rows rather than duplicating them.  Reading one state only opens that state's folder, and `columns`/`filters`
+    are pushed down to the parquet reader.
+    """
+
+    format = 'parquet'
+
+    def __init__(self, path, partition_by=('state',), by_date=False, index=False):
+        _require_pyarrow()
+        self.path = Path(path)
+        self.partition_by = list(partition_by) + (['snapshot_date'] if by_date else [])
+        self.index = index
+
+    def exists(self):
+        return self.path.is_dir() and any(self.path.rglob('*.parquet'))
+
+    def reset(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def prepare(self, df):
+        df = df.copy()
+        if 'snapshot_date' in self.partition_by:
+            df['snapshot_date'] = df['timestamp'].astype(str).str[:10]
+        for column in df.columns.intersection(INTEGER_COLUMNS):
+            values = pd.to_numeric(df[column], errors='coerce')
+            finite = values[np.isfinite(values)]
+            if (finite == finite.round()).all():
+                df[column] = values.astype('Int64')
+        for column in df.columns.intersection(CATEGORICAL_COLUMNS):
+            df[column] = df[column].astype('category')
+        return df
+
+    def write(self, df, key=None):
+        pa, pq = _require_pyarrow()
+        if df.empty:
+            return
+        key = 'part' if key is None else hashlib.sha1(str(key).encode('utf-8')).hexdigest()[:16]
+        table = pa.Table.from_pandas(self.prepare(df), preserve_index=self.index)
+        pq.write_to_dataset(table, root_path=str(self.path), partition_cols=self.partition_by,
+                            basename_template=key + '-{i}.parquet',
+                            existing_data_behavior='overwrite_or_ignore')
+
+    def replace(self, df, key=None):
+        #files are named after their key, so writing a key again already replaces its rows
+        self.write(df, key)
+
+    def read(self, state=None, columns=None, filters=None, dtype=None):
+        pa, pq = _require_pyarrow()
+        filters = list(filters or [])
+        if state is not None:
+            filters.append(('state', '=', state))
+        table = pq.read_table(str(self.path), columns=columns, filters=filters or None,
+                              partitioning='hive')
+        df = table.to_pandas()
+        return df if dtype is None else df.astype(dtype)
+
+
+def as_sink(output, **kwargs):
+    """Passes sinks through and wraps a plain csv path (the scrapers' original argument) in a `CsvSink`."""
+    if hasattr(output, 'write'):
+        return output
+    return CsvSink(output, **kwargs)
+
+def uncategorize(df):
+    #turns categorical columns (from parquet) back into the plain object columns of a csv read
+    return df.astype({c: object for c in df.select_dtypes('category').columns})
+
+
+def make_sink(output_format, path, **kwargs):
+    """Returns the sink for `output_format` ('csv' or 'parquet'); `path` is given without extension."""
+    path = Path(path)
+    if output_format == 'csv':
+        return CsvSink(path.with_name(path.name + '.csv'), index=kwargs.get('index', True))
+    if output_format == 'parquet':
+        return ParquetSink(path, **kwargs)
+    raise ValueError('Unknown output format: {}'.format(output_format))
@@ -0,0 +1,247 @@
+"""Splits a scraper output csv (or .csv.gz) into one file per value of a column, in one pass.
+
+    python -m election2020.split GA_precincts_timeseries_2020_processed.csv county
+    python -m election2020.split county_presidential.csv.gz state --value GA --gzip
+"""
+import argparse
+import csv
+import gzip
+import hashlib
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from election2020.metrics import METRICS, Timer
+
+
+DEFAULT_BLOCK_SIZE = 16 * 1024**2
+DEFAULT_BUFFER_SIZE = 1024**2
+DEFAULT_MAX_OPEN_FILES = 64
+UNSAFE_CHARACTERS = re.compile(r'[^\w.\-]+')
+
+
+def _open(path, mode, compresslevel=6):
+    if Path(path).name.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=compresslevel)
+    return open(path, mode)
+
+def csv_stem(path):
+    #'GA_precincts.csv.gz' -> 'GA_precincts'
+    name = Path(path).name
+    for extension in ('.gz', '.csv'):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name
+
+def partition_path(output_dir, stem, value, compress=False, unique=False):
+    #`stem`_`value`.csv(.gz), like the files `get-csvSplit.ps1` wrote, with a name safe for any value
+    #(and with `unique`, a short hash of the value, for values whose safe names are the same)
+    name = UNSAFE_CHARACTERS.sub('-', value) or 'missing'
+    if unique:
+        name += '-' + hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]
+    return Path(output_dir) / '{}_{}.csv{}'.format(stem, name, '.gz' if compress else '')
+
+def iter_blocks(path, block_size=DEFAULT_BLOCK_SIZE):
+    """The header of a csv file (after any '#' comment lines, without its line ending) and then
+    its other lines, in blocks of about `block_size` bytes that each end with a whole line."""
+    with _open(path, 'rb') as f:
+        header = f.readline()
+        while header.startswith(b'#'):
+            header = f.readline()
+        yield header.rstrip(b'\r\n')
+        remainder = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            block = remainder + block
+            end = block.rfind(b'\n') + 1
+            remainder = block[end:]
+            if end:
+                yield block[:end]
+        if remainder.strip():
+            yield remainder + b'\n'
+
+def _block_runs(block, index):
+    """The runs of consecutive lines of a block that have the same value in column `index`, as
+    `[(value, lines (bytes), rows)]`, or None unless every line has the same number of (unquoted)
+    fields.  Lines are found and their values compared with numpy, so only the runs (one per
+    precinct/county of a scraper's output, which writes them together) are handled in Python."""
+    buf = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    commas = np.flatnonzero(buf == ord(','))
+    num_lines = len(newlines)
+    if len(commas) % num_lines or len(commas) // num_lines < index:
+        return None
+    commas = commas.reshape(num_lines, -1)
+    if commas.shape[1] and ((commas[:, -1] > newlines).any() or (commas[1:, 0] < newlines[:-1]).any()):
+        return None
+    starts = np.append(0, newlines[:-1] + 1)
+    value_starts = commas[:, index - 1] + 1 if index else starts
+    if index < commas.shape[1]:
+        value_ends = commas[:, index]
+    else:
+        value_ends = newlines - (buf[newlines - 1] == ord('\r'))
+    lengths = value_ends - value_starts
+    width = int(lengths.max())
+    changed = lengths[1:] != lengths[:-1]
+    if width:
+        values = buf[np.minimum(value_starts[:, None] + np.arange(width), len(buf) - 1)]
+        values[np.arange(width) >= lengths[:, None]] = 0
+        changed |= (values[1:] != values[:-1]).any(axis=1)
+    first = np.append(0, np.flatnonzero(changed) + 1)
+    last = np.append(first[1:], num_lines) - 1
+    value_starts, value_ends = value_starts[first].tolist(), value_ends[first].tolist()
+    starts, ends, rows = starts[first].tolist(), (newlines[last] + 1).tolist(), (last - first + 1).tolist()
+    return [(block[value_starts[i]:value_ends[i]], block[starts[i]:ends[i]], rows[i])
+            for i in range(len(starts))]
+
+def _line_runs(block, index):
+    #the same as `_block_runs` for any block, one line at a time (with the csv module for quoted lines)
+    runs = []
+    for line in block.split(b'\n'):
+        if not line.strip(b'\r'):
+            continue
+        if b'"' in line:
+            row = next(csv.reader([line.decode('utf-8')]))
+            value = row[index].encode('utf-8') if len(row) > index else b''
+        else:
+            fields = line.split(b',', index + 1)
+            value = fields[index].rstrip(b'\r') if len(fields) > index else b''
+        if runs and runs[-1][0] == value:
+            runs[-1][1].append(line)
+        else:
+            runs.append((value, [line]))
+    return [(value, b'\n'.join(lines) + b'\n', len(lines)) for value, lines in runs]
+
+class PartitionWriters:
+    """Buffered appenders to one csv file per partition.
+
+    Lines are buffered per partition and written out once a partition holds `buffer_size` bytes,
+    through at most `max_open_files` open files (the least recently written is closed to open
+    another; gzip files are then continued with another gzip member, which readers concatenate).
+    Every file starts with the `header` line and is overwritten the first time it's written.
+    """
+
+    def __init__(self, header, paths, buffer_size=DEFAULT_BUFFER_SIZE, max_open_files=DEFAULT_MAX_OPEN_FILES,
+                 compresslevel=6):
+        self.header = header
+        self.paths = paths
+        self.buffer_size = buffer_size
+        self.max_open_files = max_open_files
+        self.compresslevel = compresslevel
+        self.buffers = {}
+        self.buffered = {}
+        self.rows = {}
+        self.files = OrderedDict()
+        self.created = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, key, lines, rows=1):
+        #`lines` are whole lines (with their line endings)
+        self.buffers.setdefault(key, []).append(lines)
+        self.rows[key] = self.rows.get(key, 0) + rows
+        self.buffered[key] = self.buffered.get(key, 0) + len(lines)
+        if self.buffered[key] >= self.buffer_size:
+            self.flush(key)
+
+    def _file(self, key):
+        if key in self.files:
+            self.files.move_to_end(key)
+            return self.files[key]
+        if len(self.files) >= self.max_open_files:
+            _, oldest = self.files.popitem(last=False)
+            oldest.close()
+        created = key in self.created
+        f = self.files[key] = _open(self.paths(key), 'ab' if created else 'wb', self.compresslevel)
+        if not created:
+            f.write(self.header + b'\n')
+            self.created.add(key)
+        return f
+
+    def flush(self, key):
+        lines = self.buffers.pop(key, None)
+        self.buffered.pop(key, None)
+        if lines:
+            self._file(key).write(b''.join(lines))
+
+    def close(self):
+        for key in list(self.buffers):
+            self.flush(key)
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+def split_csv(path, column, output_dir=None, value=None, compress=False, block_size=DEFAULT_BLOCK_SIZE,
+              buffer_size=DEFAULT_BUFFER_SIZE, max_open_files=DEFAULT_MAX_OPEN_FILES):
+    """Splits the csv file at `path` (gzipped if it ends with '.gz') into `<stem>_<value>.csv` files
+    in `output_dir` (by default next to it), one per value of `column` (e.g. 'state', 'county' or
+    'fips'), or only writes the rows of one `value`.  With `compress`, the files are gzipped.
+
+    The file is read once, in blocks of `block_size` bytes, and the lines are copied as they are
+    (keeping their order within each value), so no value needs to be contiguous and the whole
+    file is never in memory.  Blocks with quotes are read with the csv module; a record can't
+    span lines.  Returns `{value: (path, rows)}`, with a file of its own for every value.
+    """
+    path = Path(path)
+    output_dir = Path(output_dir) if output_dir is not None else path.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = csv_stem(path)
+    blocks = iter_blocks(path, block_size)
+    header = next(blocks)
+    columns = next(csv.reader([header.decode('utf-8')]))
+    if column not in columns:
+        raise ValueError('{} has no column {}'.format(path, column))
+    index = columns.index(column)
+    if value is not None:
+        value = value.encode('utf-8')
+
+    #every value gets its own file: a value whose safe name was already taken by another (e.g.
+    #'a b' and 'a-b', or 'A' and 'a' on a case-insensitive file system) has a hash added to it
+    paths, taken = {}, set()
+    def path_of(key):
+        if key not in paths:
+            partition = partition_path(output_dir, stem, key.decode('utf-8'), compress)
+            if str(partition).lower() in taken:
+                partition = partition_path(output_dir, stem, key.decode('utf-8'), compress, unique=True)
+            taken.add(str(partition).lower())
+            paths[key] = partition
+        return paths[key]
+
+    with Timer() as split_timer, PartitionWriters(header, path_of, buffer_size, max_open_files) as writers:
+        num_rows = 0
+        for block in blocks:
+            runs = _block_runs(block, index) if b'"' not in block else None
+            if runs is None:
+                runs = _line_runs(block, index)
+            for key, lines, rows in runs:
+                num_rows += rows
+                if value is None or key == value:
+                    writers.add(key, lines, rows)
+        rows = dict(writers.rows)
+    METRICS.record_rows('split', num_rows, split_timer.elapsed)
+    return {key.decode('utf-8'): (paths[key], rows[key]) for key in rows}
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='a csv file, optionally gzipped (.csv.gz)')
+    parser.add_argument('column', help='the column to split by, e.g. state, county or fips')
+    parser.add_argument('--value', help='only write the rows with this value')
+    parser.add_argument('--output-dir', help='where to write the files (by default next to the input)')
+    parser.add_argument('--gzip', action='store_true', help='gzip the files')
+    parser.add_argument('--max-open-files', type=int, default=DEFAULT_MAX_OPEN_FILES)
+    args = parser.parse_args()
+
+    partitions = split_csv(args.path, args.column, output_dir=args.output_dir, value=args.value,
+                           compress=args.gzip, max_open_files=args.max_open_files)
+    for partition_value, (partition_file, num_rows) in sorted(partitions.items()):
+        print('Wrote {} rows of {} {} to {}'.format(num_rows, args.column, partition_value, partition_file))
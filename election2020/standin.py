@@ -0,0 +1,147 @@
+import hashlib
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class StandinServer:
+    """Local stand-in for web.archive.org that serves fixture `.json` files.
+
+    A request is answered with the fixture whose file name matches the last component of the
+    requested path, so Wayback-style urls such as
+    `http://127.0.0.1:PORT/web/20201104050000if_/https://static01.nyt.com/.../GAGeneral-....json`
+    resolve to `fixture_dir/GAGeneral-....json`.  The first `throttle_first` requests are
+    answered with `429 Too Many Requests` to exercise the retry logic, and every answer can be
+    delayed by `latency` seconds to mimic the archive's response times.
+
+        with StandinServer('fixtures/') as server:
+            engine.get(server.url('web/20201104050000if_/https://.../GAGeneral-....json'))
+    """
+
+    def __init__(self, fixture_dir, port=0, throttle_first=0, latency=0):
+        self.fixture_dir = Path(fixture_dir)
+        self.throttle_remaining = throttle_first
+        self.latency = latency
+        self.requests = []
+        self.lock = threading.Lock()
+
+        standin = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                standin.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, path=''):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/{}'.format(host, port, path.lstrip('/'))
+
+    def lookup(self, path, request_headers=None):
+        #returns (status, headers, body) for a request path
+        fixture = self.fixture_dir / path.split('?')[0].rstrip('/').split('/')[-1]
+        if not fixture.is_file():
+            return 404, {}, b''
+        return 200, {'Content-Type': 'application/json'}, fixture.read_bytes()
+
+    def handle(self, request):
+        with self.lock:
+            self.requests.append(request.path)
+            throttled = self.throttle_remaining > 0
+            if throttled:
+                self.throttle_remaining -= 1
+
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            status, headers, body = 429, {'Retry-After': '0'}, b''
+        else:
+            status, headers, body = self.lookup(request.path, request.headers)
+
+        request.send_response(status)
+        for key, value in headers.items():
+            request.send_header(key, value)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+class ReplayServer(StandinServer):
+    """Stand-in for a live endpoint that replays recorded snapshots of its files on a schedule.
+
+    `snapshots` maps a file name to its recorded bodies (bytes or fixture paths), in order.  The
+    i-th snapshot is served from `i * interval` seconds after the server starts or, without an
+    `interval`, once `advance` has been called i times.  Responses carry an `ETag` and a
+    `Last-Modified` header, and conditional requests whose validators are still current get a
+    `304 Not Modified` (unless `conditional=False`, to mimic servers that ignore them).
+
+        with ReplayServer({'president.json': [first, second]}, interval=30) as server:
+            poller.poll(server.url('elections-assets/.../president.json'))
+    """
+
+    def __init__(self, snapshots, interval=None, port=0, throttle_first=0, conditional=True):
+        super().__init__('.', port=port, throttle_first=throttle_first)
+        self.snapshots = {name: [body if isinstance(body, bytes) else Path(body).read_bytes() for body in bodies]
+                          for name, bodies in snapshots.items()}
+        self.interval = interval
+        self.conditional = conditional
+        self.steps = 0
+        self.epoch = int(time.time())
+
+    def start(self):
+        self.epoch = int(time.time())
+        super().start()
+
+    def advance(self):
+        #moves every file on to its next snapshot (without an `interval`)
+        with self.lock:
+            self.steps += 1
+
+    def snapshot_index(self, name):
+        if self.interval is None:
+            step = self.steps
+        else:
+            step = int((time.time() - self.epoch) / self.interval)
+        return min(step, len(self.snapshots[name]) - 1)
+
+    def lookup(self, path, request_headers=None):
+        name = path.split('?')[0].rstrip('/').split('/')[-1]
+        if name not in self.snapshots:
+            return 404, {}, b''
+        index = self.snapshot_index(name)
+        body = self.snapshots[name][index]
+        #every snapshot gets its own whole second, since http dates have no fractions
+        last_modified = self.epoch + index * max(1, int(self.interval or 1))
+        headers = {'Content-Type': 'application/json', 'Last-Modified': formatdate(last_modified, usegmt=True),
+                   'ETag': '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])}
+
+        request_headers = request_headers or {}
+        if self.conditional:
+            if request_headers.get('If-None-Match') is not None:
+                not_modified = request_headers['If-None-Match'] == headers['ETag']
+            elif request_headers.get('If-Modified-Since') is not None:
+                not_modified = parsedate_to_datetime(request_headers['If-Modified-Since']).timestamp() >= last_modified
+            else:
+                not_modified = False
+            if not_modified:
+                return 304, {key: headers[key] for key in ('ETag', 'Last-Modified')}, b''
+        return 200, headers, body
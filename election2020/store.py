@@ -0,0 +1,201 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from election2020.external import rows_per_chunk, scan_csv, read_csv_chunks
+from election2020.sinks import as_sink, uncategorize
+from election2020.updates import utc_timestamps
+
+
+#the columns stored of each scraper's output.  `date` is the row's timestamp normalized to UTC
+#(e.g. '2020-11-04T05:18:09Z', see `utc_timestamps`), so that time windows compare as text
+TABLES = {
+    #`fill_missing_totals` in the improved precinct scraper
+    'precincts': {'columns': {'state': 'TEXT', 'county': 'TEXT', 'precinct': 'TEXT', 'fips': 'TEXT',
+                              'vote_type': 'TEXT', 'timestamp': 'TEXT', 'date': 'TEXT', 'votes': 'REAL',
+                              'votes_biden': 'REAL', 'votes_trump': 'REAL', 'votes_jorgensen': 'REAL',
+                              'votes_other': 'REAL'},
+                  'index': ['state', 'county', 'date']},
+    #`remove_duplicates` in the county scraper
+    'counties': {'columns': {'state': 'TEXT', 'county': 'TEXT', 'fips': 'TEXT', 'timestamp': 'TEXT',
+                             'last_updated': 'TEXT', 'date': 'TEXT', 'absentee_dem': 'REAL',
+                             'absentee_rep': 'REAL', 'absentee_jorgensen': 'REAL', 'votes_dem': 'REAL',
+                             'votes_rep': 'REAL', 'votes_jorgensen': 'REAL', 'absentee2020': 'REAL',
+                             'votes2020': 'REAL', 'margin2020': 'REAL', 'votes2016': 'REAL',
+                             'margin2016': 'REAL', 'votes2012': 'REAL', 'margin2012': 'REAL'},
+                 'index': ['state', 'county', 'date']},
+    #`state_table` in the house/senate/president scraper
+    'races': {'columns': {'state': 'TEXT', 'race_id': 'TEXT', 'date': 'TEXT', 'timestamp': 'TEXT',
+                          'votes2020': 'REAL', 'vf_dem': 'REAL', 'vf_rep': 'REAL', 'vf_extra': 'REAL',
+                          'votes2016': 'REAL', 'margin2016': 'REAL', 'votes2012': 'REAL',
+                          'margin2012': 'REAL'},
+              'index': ['state', 'race_id', 'date']},
+}
+#the vote counts of each dataset that `county_updates` (and `rows(..., deltas=True)`) difference
+VOTE_COLUMNS = {
+    'precincts': ['votes', 'votes_biden', 'votes_trump', 'votes_jorgensen', 'votes_other'],
+    'counties': ['votes2020', 'votes_dem', 'votes_rep', 'votes_jorgensen', 'absentee2020'],
+    'races': ['votes2020'],
+}
+#the columns that identify a series in each dataset (rows are differenced within a series)
+SERIES = {'precincts': ['state', 'county', 'precinct', 'vote_type'], 'counties': ['state', 'county'],
+          'races': ['state', 'race_id']}
+
+
+def _text(values):
+    #labels as text, so that e.g. precinct ids or fips codes read as numbers compare as strings
+    if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+        values = values.astype('Int64')
+    return values.astype(str).where(values.notna(), None)
+
+
+class ResultsStore:
+    """The rows of the precinct, county and race outputs in one SQLite file, indexed by
+    (state, county, date) and (state, race_id, date), so that slices like one county's updates in
+    a time window or a state's county vs. state totals take milliseconds instead of parsing csvs.
+
+    `add` replaces the rows of the states in the given output, so it can be rerun whenever a state
+    is rebuilt, and `load` streams a whole csv output in with a memory budget.  Several processes
+    can add states at once (SQLite serializes the writes).
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), timeout=timeout, check_same_thread=False)
+        for dataset, table in TABLES.items():
+            self.db.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(dataset, ', '.join(
+                '{} {}'.format(column, sql_type) for column, sql_type in table['columns'].items())))
+            self.db.execute('CREATE INDEX IF NOT EXISTS {0}_series ON {0} ({1})'.format(
+                dataset, ', '.join(table['index'])))
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def clear(self, dataset, states=None):
+        #removes the rows of `states` (every state by default) from the `dataset`
+        with self.lock:
+            if states is None:
+                self.db.execute('DELETE FROM {}'.format(dataset))
+            else:
+                self.db.executemany('DELETE FROM {} WHERE state = ?'.format(dataset),
+                                    [(state,) for state in states])
+            self.db.commit()
+
+    def add(self, dataset, df, replace=True):
+        """Stores the rows of `df` (an output of the `dataset` scraper, e.g. a state's table).
+
+        The previous rows of the states in `df` are replaced, unless `replace` is False (e.g. when
+        an output is added a chunk at a time, after `clear`).  Columns the table doesn't have are
+        left out and missing ones are stored as NULL.
+        """
+        columns = TABLES[dataset]['columns']
+        df = uncategorize(df.reset_index(drop=True))
+        rows = pd.DataFrame({column: df[column] for column in columns if column in df})
+        for column, sql_type in columns.items():
+            if sql_type == 'TEXT' and column in rows:
+                rows[column] = _text(rows[column])
+        rows['date'] = utc_timestamps(df['date'] if dataset == 'races' else df['timestamp'])
+        if replace:
+            self.clear(dataset, rows['state'].dropna().unique().tolist())
+        with self.lock:
+            rows.to_sql(dataset, self.db, if_exists='append', index=False, chunksize=50000)
+            self.db.commit()
+        return len(rows)
+
+    def load(self, dataset, output, memory_budget=None):
+        """Replaces the rows of every state in `output` (a csv path or a sink).  With a
+        `memory_budget` (in bytes), a csv output is read in chunks of about that many bytes."""
+        output = as_sink(output)
+        if memory_budget is None or output.format != 'csv':
+            return self.add(dataset, output.read())
+        index_col = 0 if output.index else None
+        chunksize = rows_per_chunk(output.path, memory_budget, index_col)
+        dtypes, _, states = scan_csv(output.path, chunksize, index_col, count_by='state')
+        self.clear(dataset, [] if states is None else states.index.dropna().astype(str).tolist())
+        num_rows = 0
+        for chunk in read_csv_chunks(output.path, chunksize, dtypes, index_col):
+            num_rows += self.add(dataset, chunk, replace=False)
+        return num_rows
+
+    def query(self, sql, params=()):
+        """The result of any SQL `SELECT` on the `precincts`, `counties` and `races` tables."""
+        with self.lock:
+            return pd.read_sql_query(sql, self.db, params=params)
+
+    def _filters(self, start=None, end=None, **labels):
+        clauses, params = [], []
+        for column, value in labels.items():
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                params.append(value)
+        for op, value in (('>=', start), ('<=', end)):
+            if value is not None:
+                clauses.append('date {} ?'.format(op))
+                params.append(utc_timestamps([value])[0])
+        return clauses, params
+
+    def rows(self, dataset, state=None, start=None, end=None, deltas=False, **labels):
+        """A dataset's rows, optionally for one state (and e.g. `county`, `precinct`, `vote_type`
+        or `race_id`) and between two timestamps (anything `pd.to_datetime` parses, in UTC unless
+        given a time zone), sorted by series and timestamp.
+
+        With `deltas`, each row also gets the differences of its vote counts (`d_votes2020`, ...)
+        from the previous row of its series, including the last row before `start`.
+        """
+        #with `deltas`, the rows before the window are read too (the indexes make this cheap for a
+        #series) so that the first update in the window is relative to the last row before it
+        clauses, params = self._filters(None if deltas else start, end, state=state, **labels)
+        df = self.query('SELECT * FROM {} WHERE {}'.format(dataset, ' AND '.join(clauses) or '1'), params)
+        df = df.sort_values(SERIES[dataset] + ['date'], kind='stable', ignore_index=True)
+        if not deltas:
+            return df
+
+        first = ~df.duplicated(SERIES[dataset], keep='first')
+        for column in VOTE_COLUMNS[dataset]:
+            df['d_' + column] = df[column].diff().where(~first)
+        if start is not None:
+            df = df[df['date'] >= utc_timestamps([start])[0]]
+        return df.reset_index(drop=True)
+
+    def county_updates(self, state, county, start=None, end=None):
+        """One county's rows between two timestamps, with the votes added since the previous row
+        (e.g. `county_updates('GA', 'bibb', '2020-11-04T05Z', '2020-11-04T06Z')`)."""
+        return self.rows('counties', state=state, county=county, start=start, end=end, deltas=True)
+
+    def reconcile(self, state, start=None, end=None, race_id='G-P'):
+        """The sum of a state's county results at each county timestamp next to the state-level
+        results of `race_id` as of that time, and their differences (`diff_*`) and updates (`d_*`).
+
+        The state's candidate votes are estimated from rounded vote fractions, so they can be off
+        by about 0.05% of the votes; the total votes are exact.
+        """
+        clauses, params = self._filters(start, end, state=state)
+        counties = self.query('SELECT date, COUNT(*) AS counties, SUM(votes2020) AS county_votes, '
+                              'SUM(votes_dem) AS county_dem, SUM(votes_rep) AS county_rep FROM counties '
+                              'WHERE {} GROUP BY date ORDER BY date'.format(' AND '.join(clauses)), params)
+        #the state rows include the last one before the window, as of which the first counties compare
+        clauses, params = self._filters(None, end, state=state, race_id=race_id)
+        races = self.query('SELECT date AS state_date, votes2020 AS state_votes, vf_dem, vf_rep FROM races '
+                           'WHERE {} ORDER BY date'.format(' AND '.join(clauses)), params)
+        #a query without rows returns untyped (object) columns
+        for frame, columns in ((counties, ['counties', 'county_votes', 'county_dem', 'county_rep']),
+                               (races, ['state_votes', 'vf_dem', 'vf_rep'])):
+            if not len(frame):
+                frame[columns] = frame[columns].astype(float)
+        races['state_dem'] = (races['state_votes'] * races.pop('vf_dem')).round()
+        races['state_rep'] = (races['state_votes'] * races.pop('vf_rep')).round()
+
+        counties['time'] = pd.to_datetime(counties['date'], utc=True, format='ISO8601')
+        races['time'] = pd.to_datetime(races['state_date'], utc=True, format='ISO8601')
+        df = pd.merge_asof(counties, races, on='time', direction='backward').drop(columns='time')
+        for level in ('county', 'state'):
+            for column in ('votes', 'dem', 'rep'):
+                df['d_{}_{}'.format(level, column)] = df['{}_{}'.format(level, column)].diff()
+        for column in ('votes', 'dem', 'rep'):
+            df['diff_' + column] = df['county_' + column] - df['state_' + column]
+        return df
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+
+KEY_COLUMNS = ['state', 'county', 'precinct', 'fips', 'timestamp', 'vote_type']
+GEO_COLUMNS = ['state', 'county', 'precinct', 'fips']
+VOTE_COLUMNS = ['votes', 'votes_biden', 'votes_trump', 'votes_jorgensen', 'votes_other']
+SORT_COLUMNS = ['state', 'county', 'precinct', 'fips', 'vote_type', 'timestamp']
+
+
+def aggregate(df, fill_values, ordered_cols, mask=None):
+    #same as `add_categories` in precincts_presidential_scraper.py, but only the vote columns
+    #are summed (rather than also concatenating the strings of the columns that get replaced)
+    grouping_vars = [v for v in KEY_COLUMNS if v not in fill_values]
+    if mask is not None:
+        df = df[mask]
+    new_df = df.groupby(grouping_vars, as_index=False, observed=True)[VOTE_COLUMNS].sum()
+    for column, value in fill_values.items():
+        new_df[column] = value
+    return new_df[ordered_cols]
+
+def latest_margins(df):
+    """Broadcasts each region/vote type's margin at its most recent timestamp to all its rows."""
+    group_ids = df.groupby(GEO_COLUMNS + ['vote_type'], sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    dates = pd.to_datetime(df['timestamp'], format="%Y-%m-%dT%H:%M:%S").to_numpy()
+
+    #after a stable sort by (group, date), the last row of each group is its latest timestamp
+    order = np.lexsort((dates, group_ids))
+    sorted_ids = group_ids[order]
+    is_last = np.append(sorted_ids[1:] != sorted_ids[:-1], True)
+    last_rows = order[is_last]
+
+    margins = df['margin'].to_numpy()
+    latest = np.empty(group_ids.max() + 1 if group_ids.size else 0)
+    latest[sorted_ids[is_last]] = margins[last_rows]
+    return pd.Series(latest[group_ids], index=df.index, name='margin')
+
+def complete_timeseries(df):
+    """Vectorized `correct_for_missing_data`: ensures every precinct has a row for every vote type
+    and timestamp.
+
+    Instead of outer-merging a template frame into each precinct in a Python loop, the missing
+    (precinct, vote_type, timestamp) combinations of all incomplete precincts are found at once by
+    encoding the full product and the existing rows as integer positions and taking their set
+    difference (as a boolean mask over the product).  The missing rows are appended with NaN vote counts.
+    """
+    uniq_tstamps = np.sort(df['timestamp'].dropna().unique())
+    uniq_vtypes = np.sort(df['vote_type'].dropna().unique())
+    uniq_size = uniq_tstamps.size * uniq_vtypes.size
+
+    #rows with a missing region label are dropped by the groupby in the original, too
+    df = df.dropna(subset=GEO_COLUMNS)
+    grouped = df.groupby(GEO_COLUMNS, sort=False, observed=True)
+    group_ids = grouped.ngroup().to_numpy()
+    group_sizes = grouped.size()
+    group_keys = group_sizes.index.to_frame(index=False)
+
+    #only precincts with fewer rows than the full product are filled (just like the original)
+    incomplete = np.flatnonzero(group_sizes.to_numpy() < uniq_size)
+    if incomplete.size == 0 or uniq_size == 0:
+        return df.reset_index(drop=True)
+    position = np.full(len(group_sizes), -1)
+    position[incomplete] = np.arange(incomplete.size)
+
+    #integer position of every row within the product (incomplete precinct x vote_type x timestamp)
+    vtype_codes = pd.Categorical(df['vote_type'], categories=uniq_vtypes).codes
+    tstamp_codes = pd.Categorical(df['timestamp'], categories=uniq_tstamps).codes
+    row_positions = position[group_ids]
+    valid = (row_positions >= 0) & (vtype_codes >= 0) & (tstamp_codes >= 0)
+    existing = (row_positions[valid].astype(np.int64) * uniq_size
+                + vtype_codes[valid].astype(np.int64) * uniq_tstamps.size + tstamp_codes[valid])
+
+    present = np.zeros(incomplete.size * uniq_size, dtype=bool)
+    present[existing] = True
+    missing = np.flatnonzero(~present)
+    missing_groups, remainder = np.divmod(missing, uniq_size)
+    missing_vtypes, missing_tstamps = np.divmod(remainder, uniq_tstamps.size)
+
+    missing_df = group_keys.iloc[incomplete[missing_groups]].reset_index(drop=True)
+    missing_df['vote_type'] = uniq_vtypes[missing_vtypes]
+    missing_df['timestamp'] = uniq_tstamps[missing_tstamps]
+    missing_df = missing_df.reindex(columns=df.columns)
+
+    return pd.concat([df, missing_df], axis=0, ignore_index=True)
+
+def streamline_precincts(precinct_records, sum_counties=True, fill_margins=False):
+    """Vectorized equivalent of `streamline_data` in precincts_presidential_scraper.py.
+
+    Produces the same rows, in the same order, as the original.  The original computes each
+    region's most recent margin and then discards it, so the `margin` column holds every row's
+    own margin; pass `fill_margins=True` to instead fill each region's rows with the margin at
+    its latest timestamp (as described in the precinct README).
+    """
+    if isinstance(precinct_records, pd.DataFrame):
+        precincts_df = precinct_records
+    else:
+        precincts_df = pd.DataFrame.from_records(precinct_records)
+    ordered_cols = precincts_df.columns.tolist()
+
+    mask_p = precincts_df['vote_type'] != 'total'   #needed for MI
+    precinct_totals_df = aggregate(precincts_df, {'vote_type':'total'}, ordered_cols, mask_p)
+    county_df = aggregate(precincts_df, {'precinct':'COUNTY', 'fips':-9999}, ordered_cols)
+    mask_c = county_df['vote_type'] != 'total'
+    county_totals_df = aggregate(county_df, {'precinct':'COUNTY', 'fips':-9999, 'vote_type':'total'},
+                                 ordered_cols, mask_c)
+    df_list_to_concat = [precincts_df, precinct_totals_df, county_df, county_totals_df]
+
+    if sum_counties:
+        states_df = aggregate(county_df, {'county':'STATE', 'precinct':'STATE', 'fips':-9999}, ordered_cols)
+        state_totals_df = aggregate(states_df, {'county':'STATE', 'precinct':'STATE', 'fips':-9999,
+                                                'vote_type':'total'}, ordered_cols)
+        df_list_to_concat += [states_df, state_totals_df]
+
+    results_df = pd.concat(df_list_to_concat, axis=0, sort=False, ignore_index=True)
+    results_df['margin'] = (results_df['votes_trump'] - results_df['votes_biden']).divide(
+                                results_df['votes'], fill_value=1) * 100
+    if fill_margins:
+        results_df['margin'] = latest_margins(results_df)
+
+    results_df = complete_timeseries(results_df)
+    results_df.sort_values(by=SORT_COLUMNS, ascending=True, inplace=True, kind='stable')
+    return results_df
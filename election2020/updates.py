@@ -0,0 +1,202 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+LABEL_COLUMNS = ['state', 'county', 'precinct', 'vote_type', 'race_id']
+COUNT_COLUMNS = ['votes', 'dem', 'rep', 'other']
+CANDIDATES = ['dem', 'rep', 'other']
+
+#the columns of each scraper's output that identify a series, and its candidates' cumulative votes
+DATASETS = {
+    #`streamline_data`/`fill_missing_totals` in the precinct scrapers
+    'precincts': {'series': ['state', 'county', 'precinct', 'vote_type'],
+                  'counts': lambda df: (df['votes'], df['votes_biden'], df['votes_trump'],
+                                        df['votes_jorgensen'].fillna(0) + df['votes_other'].fillna(0))},
+    #`remove_duplicates` in the county scraper
+    'counties': {'series': ['state', 'county'],
+                 'counts': lambda df: (df['votes2020'], df['votes_dem'], df['votes_rep'],
+                                       df['votes2020'] - df['votes_dem'] - df['votes_rep'])},
+    #`build_state_dataframe` in the house/senate/president scraper.  Only the (rounded) vote
+    #shares are published, so the candidates' votes are estimates
+    'races': {'series': ['state', 'race_id'],
+              'counts': lambda df: (df['votes2020'], (df['votes2020'] * df['vf_dem']).round(),
+                                    (df['votes2020'] * df['vf_rep']).round(),
+                                    df['votes2020'] - (df['votes2020'] * df['vf_dem']).round()
+                                    - (df['votes2020'] * df['vf_rep']).round())},
+}
+
+
+def utc_timestamps(values):
+    #timestamps normalized to UTC strings (so they sort and compare in SQLite, e.g.
+    #'2020-11-04T05:18:09Z'), formatting each distinct timestamp once
+    codes, uniq_tstamps = pd.factorize(pd.Series(values).astype(str))
+    uniq_tstamps = pd.to_datetime(uniq_tstamps, utc=True, format='ISO8601').strftime('%Y-%m-%dT%H:%M:%SZ')
+    return np.asarray(uniq_tstamps, dtype=object)[codes]
+
+def vote_updates(df, dataset, changed_only=True):
+    """Every update of every series in one of the scrapers' outputs: the consecutive differences
+    (`d_votes`, `d_dem`, `d_rep`, `d_other`) between a series' timestamps, each candidate's share
+    of the batch, the largest share and whether any count went down.
+
+    Rows with missing counts (e.g., the gaps `streamline_data` fills with NaN) are skipped, so each
+    update is relative to the last timestamp that had counts.  With `changed_only`, updates in
+    which nothing changed are left out.
+    """
+    spec = DATASETS[dataset]
+    df = df.reset_index(drop=True)
+    updates = pd.DataFrame({c: df[c].astype(str) if c in df else None for c in LABEL_COLUMNS})
+    updates['timestamp'] = utc_timestamps(df['timestamp'])
+    for column, counts in zip(COUNT_COLUMNS, spec['counts'](df)):
+        updates[column] = pd.to_numeric(counts, errors='coerce')
+    updates = updates.dropna(subset=COUNT_COLUMNS, how='all')
+
+    #consecutive differences within each series, in timestamp order
+    updates = updates.sort_values(spec['series'] + ['timestamp'], kind='stable').reset_index(drop=True)
+    group_ids = updates.groupby(spec['series'], sort=False, dropna=False).ngroup().to_numpy()
+    first = np.append(True, group_ids[1:] != group_ids[:-1])
+    counts = updates[COUNT_COLUMNS].to_numpy(dtype=float)
+    deltas = np.vstack([np.full((1, len(COUNT_COLUMNS)), np.nan), np.diff(counts, axis=0)])
+    deltas[first] = np.nan
+    for i, column in enumerate(COUNT_COLUMNS):
+        updates['d_' + column] = deltas[:, i]
+    updates['prev_timestamp'] = updates['timestamp'].shift().where(~first)
+    updates = updates[~first]
+
+    batch = updates[['d_' + c for c in CANDIDATES]].to_numpy()
+    batch_total = batch.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(batch_total[:, None] > 0, batch / batch_total[:, None], np.nan)
+    for i, candidate in enumerate(CANDIDATES):
+        updates['share_' + candidate] = shares[:, i]
+    updates['top_share'] = np.nanmax(np.where(np.isnan(shares), -np.inf, shares), axis=1)
+    updates.loc[~np.isfinite(updates['top_share']), 'top_share'] = np.nan
+    updates['negative'] = (updates[['d_' + c for c in COUNT_COLUMNS]] < 0).any(axis=1).astype(int)
+
+    if changed_only:
+        updates = updates[(updates[['d_' + c for c in COUNT_COLUMNS]].fillna(0) != 0).any(axis=1)]
+    updates.insert(0, 'dataset', dataset)
+    return updates.reset_index(drop=True)
+
+
+class UpdateIndex:
+    """Persistent table of every vote update (see `vote_updates`) across the precinct, county and
+    race datasets, in SQLite, indexed so that anomaly queries over all states are instant.
+
+    `add` replaces the updates of the states in the given output, so it can be rerun whenever a
+    state is rebuilt.  Several processes can add states at once (SQLite serializes the writes).
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.path), timeout=timeout, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS updates (
+                dataset        TEXT NOT NULL,
+                state          TEXT,
+                county         TEXT,
+                precinct       TEXT,
+                vote_type      TEXT,
+                race_id        TEXT,
+                timestamp      TEXT NOT NULL,
+                prev_timestamp TEXT,
+                votes          REAL,
+                dem            REAL,
+                rep            REAL,
+                other          REAL,
+                d_votes        REAL,
+                d_dem          REAL,
+                d_rep          REAL,
+                d_other        REAL,
+                share_dem      REAL,
+                share_rep      REAL,
+                share_other    REAL,
+                top_share      REAL,
+                negative       INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS updates_series ON updates (dataset, state, county, timestamp);
+            CREATE INDEX IF NOT EXISTS updates_time ON updates (timestamp);
+            CREATE INDEX IF NOT EXISTS updates_negative ON updates (negative, dataset);
+            CREATE INDEX IF NOT EXISTS updates_top_share ON updates (top_share);
+        ''')
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def clear(self, dataset, states=None):
+        #removes the updates of `states` (every state by default) from the `dataset`
+        with self.lock:
+            if states is None:
+                self.db.execute('DELETE FROM updates WHERE dataset = ?', (dataset,))
+            else:
+                self.db.executemany('DELETE FROM updates WHERE dataset = ? AND state = ?',
+                                    [(dataset, state) for state in states])
+            self.db.commit()
+
+    def add(self, dataset, df, changed_only=True, replace=True):
+        """Computes and stores the updates of `df` (an output of the `dataset` scraper).
+
+        The previous updates of the states in `df` are replaced, unless `replace` is False (e.g.
+        when an output read out of core is added one range of counties at a time, after `clear`).
+        """
+        updates = vote_updates(df, dataset, changed_only=changed_only)
+        if replace:
+            self.clear(dataset, df['state'].astype(str).unique().tolist())
+        with self.lock:
+            updates.to_sql('updates', self.db, if_exists='append', index=False, chunksize=50000)
+            self.db.commit()
+        return len(updates)
+
+    def query(self, where='1', params=(), order_by='timestamp'):
+        """The updates matching an SQL `where` clause, e.g. `query('d_rep < ?', (-100,))`."""
+        #sorted after the fact: an ORDER BY would lead SQLite to walk the timestamp index instead
+        #of using the (much more selective) index for the `where` clause
+        with self.lock:
+            df = pd.read_sql_query('SELECT * FROM updates WHERE {}'.format(where), self.db, params=params)
+        return df.sort_values(order_by, kind='stable', ignore_index=True)
+
+    def _filters(self, dataset=None, state=None, county=None, start=None, end=None):
+        clauses, params = [], []
+        for column, value in (('dataset', dataset), ('state', state), ('county', county)):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                params.append(value)
+        if start is not None:
+            clauses.append('timestamp >= ?')
+            params.append(start)
+        if end is not None:
+            clauses.append('timestamp <= ?')
+            params.append(end)
+        return clauses, params
+
+    def updates(self, dataset=None, state=None, county=None, start=None, end=None):
+        """One dataset's (or every dataset's) updates, optionally for one state/county and between
+        two timestamps (formatted like '2020-11-04T05:18:09Z')."""
+        clauses, params = self._filters(dataset, state, county, start, end)
+        return self.query(' AND '.join(clauses) or '1', params)
+
+    def negative(self, candidate=None, **filters):
+        """Updates in which the total (or `candidate`'s, one of 'dem', 'rep', 'other') votes went down."""
+        clauses, params = self._filters(**filters)
+        clauses.append('negative = 1')
+        if candidate is not None:
+            clauses.append('d_{} < 0'.format(CANDIDATES[CANDIDATES.index(candidate)]))
+        return self.query(' AND '.join(clauses), params)
+
+    def lopsided(self, threshold=0.95, candidate=None, min_votes=1, **filters):
+        """Updates in which one candidate (or `candidate`) got more than `threshold` of a batch of at
+        least `min_votes` votes."""
+        clauses, params = self._filters(**filters)
+        if candidate is None:
+            clauses.append('top_share > ?')
+        else:
+            clauses.append('share_{} > ?'.format(CANDIDATES[CANDIDATES.index(candidate)]))
+        clauses.append('d_dem + d_rep + d_other >= ?')
+        params += [threshold, min_votes]
+        return self.query(' AND '.join(clauses), params)
@@ -0,0 +1,99 @@
+"""One row per precinct and timestamp, with a column per vote type and vote count (e.g.
+`absentee.votes_trump`) and its change since the precinct's previous timestamp
+(`absentee.votes_trump_change`): the table `ga_test` in PQ/script.pq.txt builds in Power Query.
+
+    python -m election2020.wide GA_precincts_timeseries_2020_processed.csv GA_precincts_wide.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from election2020.metrics import METRICS, Timer
+from election2020.sinks import as_sink, uncategorize
+from election2020.streamline import GEO_COLUMNS, VOTE_COLUMNS
+
+
+ROW_COLUMNS = GEO_COLUMNS + ['timestamp']
+
+
+def _integers(values):
+    #columns of nullable integers, like the vote counts they came from, unless some aren't whole numbers
+    missing = np.isnan(values)
+    filled = np.where(missing, 0, values)
+    if (filled != filled.round()).any():
+        return list(values.T)
+    filled = filled.astype(np.int64)
+    return [pd.arrays.IntegerArray(filled[:, i], missing[:, i]) for i in range(values.shape[1])]
+
+def wide_table(df, vote_columns=None):
+    """Pivots precinct rows (an output of `streamline_data`/`fill_missing_totals`, with a row per
+    precinct, timestamp and vote type) to a row per precinct and timestamp, sorted by precinct
+    and timestamp, with a `<vote_type>.<column>` and a `<vote_type>.<column>_change` column for
+    every vote type and vote count.
+
+    Rows with the same precinct and vote type at a timestamp are summed.  A change is the
+    difference from the previous row of the same precinct (0 on its first row, and missing
+    where either count is); unlike the Power Query step, the county-level rows (whose precinct
+    and fips are always 'COUNTY' and -9999) are never compared with another county's.  The
+    `fips_and_precinct` column is kept for the workbooks built on that step.
+    """
+    if vote_columns is None:
+        vote_columns = [column for column in VOTE_COLUMNS if column in df.columns]
+    df = uncategorize(df)
+    with Timer() as pivot_timer:
+        #every row's precinct (in sorted order) and then its timestamp's, as one sorted integer key
+        series_ids = df.groupby(GEO_COLUMNS, sort=True, dropna=False, observed=True).ngroup().to_numpy()
+        tstamp_codes, tstamps = pd.factorize(df['timestamp'], sort=True, use_na_sentinel=False)
+        first_rows, row_ids = np.unique(series_ids.astype(np.int64) * len(tstamps) + tstamp_codes,
+                                        return_index=True, return_inverse=True)[1:]
+        num_rows = len(first_rows)
+        keys = df[ROW_COLUMNS].iloc[first_rows].reset_index(drop=True)
+        vtype_codes, vote_types = pd.factorize(df['vote_type'].fillna('null'), sort=True)
+
+        #a single scatter of every row's counts into its (row, vote type) cell
+        cells = row_ids * len(vote_types) + vtype_codes
+        values = df[vote_columns].to_numpy(dtype=float)
+        num_cells = num_rows * len(vote_types)
+        if np.bincount(cells, minlength=num_cells).max(initial=0) > 1:
+            wide = np.column_stack([
+                np.where(np.bincount(cells, ~np.isnan(column), num_cells) > 0,
+                         np.bincount(cells, np.nan_to_num(column), num_cells), np.nan)
+                for column in values.T])
+        else:
+            wide = np.full((num_cells, len(vote_columns)), np.nan)
+            wide[cells] = values
+        wide = wide.reshape(num_rows, -1)
+
+        #rows are sorted by precinct and then timestamp, so each one's previous row is the one above
+        series_ids = series_ids[first_rows]
+        first = np.append(True, series_ids[1:] != series_ids[:-1])
+        changes = wide - np.vstack([np.full((1, wide.shape[1]), np.nan), wide[:-1]])
+        changes[first] = 0
+
+    fips = keys['fips'].astype('Int64') if keys['fips'].dtype.kind == 'f' else keys['fips']
+    names = ['{}.{}'.format(vote_type, column) for vote_type in vote_types for column in vote_columns]
+    columns = {column: keys[column] for column in ROW_COLUMNS}
+    columns['fips_and_precinct'] = fips.astype(str) + '-' + keys['precinct'].astype(str)
+    columns.update(zip(names, _integers(wide)))
+    columns.update(zip([name + '_change' for name in names], _integers(changes)))
+    METRICS.record_rows('wide', num_rows, pivot_timer.elapsed)
+    return pd.DataFrame(columns, copy=False)
+
+def write_wide_table(inputfile, outputfile, state=None):
+    #`inputfile`/`outputfile` are csv paths or output sinks, like `fill_missing_totals`'s
+    inputfile, outputfile = as_sink(inputfile), as_sink(outputfile, index=False)
+    df = wide_table(inputfile.read(state=state))
+    outputfile.replace(df, key=state)
+    return df
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='a precinct output csv (with an index column, like the processed files)')
+    parser.add_argument('output', help='the csv file to write')
+    parser.add_argument('--state', help='only the rows of this state')
+    args = parser.parse_args()
+
+    df = write_wide_table(args.input, args.output, state=args.state)
+    print('Wrote {} rows and {} columns to {}'.format(len(df), len(df.columns), args.output))
@@ -1,7 +1,24 @@
 import requests
+import functools
+import sys
 import time
+from pathlib import Path
+import numpy as np
 import pandas as pd
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.fetch import FetchEngine
+from election2020.live import LivePoller
+from election2020.cache import ResponseCache
+from election2020.cdx import CdxIndex, cdx_query_url, parse_cdx, filter_hits, archived_urls
+from election2020.manifest import ScrapeManifest
+from election2020.sinks import CsvSink, ParquetSink
+from election2020.parallel import StatePool
+from election2020.updates import UpdateIndex
+from election2020.store import ResultsStore
+from election2020.rollup import RollupCache
+from election2020.metrics import METRICS, Timer
+
 
 states_list = ['Alaska', 'Alabama', 'Arkansas', 'Arizona', 'California', 
  'Colorado', 'Connecticut', 'Delaware', 'Florida', 'Georgia',
@@ -13,6 +30,8 @@ states_list = ['Alaska', 'Alabama', 'Arkansas', 'Arizona', 'California',
  'Rhode Island', 'South Carolina', 'South Dakota', 'Tennessee', 'Texas',
  'Utah', 'Virginia', 'Vermont', 'Washington', 'Wisconsin',
  'West Virginia', 'Wyoming']
+#the presidential, senate (regular and special) and house races
+RACE_TYPES = ('G-P-', 'G-S-', 'S-S-', 'G-H-')
 
 def eval_candidates(clist, cnames):
     out = {}
@@ -35,109 +54,229 @@ def eval_candidates(clist, cnames):
     return out
 
 def build_state_dataframe(state_data):
-    vote_dfs = {}
+    build_start = time.perf_counter()
+    state = state_data[-1]['race_id'][:2]
 
-    #first loop gathers presidential race timestamps (and other data).  Timestamps
-    #are needed before running through loops for other races.
+    #one pass flattens every race's timeseries into columns (a race's candidates are the ones in
+    #its first point); no timestamps are parsed yet
+    race_keys, race_types, lengths = [], [], []
+    columns = {'timestamp': [], 'votes2020': [], 'vf_dem': [], 'vf_rep': [], 'vf_extra': []}
     for race in state_data:
-        race_records = []
-        state = race['race_id'][:2]
         race_type = race['race_id'][3:7]
-        race_id = race['race_id'][:-11]
-
-        
-        if race_type in ('G-P-', 'G-S-', 'S-S-', 'G-H-'):
-            print(race_id)
-            
-            past_elections_data = {}
-            if race_type == 'G-P-':
-                past_elections_data['votes2016']   = race['votes2016']
-                past_elections_data['margin2016']  = race['margin2016']
-                past_elections_data['votes2012']   = race['votes2012']
-                past_elections_data['margin2012']  = race['margin2012']
-
-            candidates = {}
-            N = len(race['timeseries'])
-            for i, vote_dict in enumerate(race['timeseries']):
-                if i == 0:   #the first timestamp always seems to be out of order and have zero votes
-                    candidate_names = [*vote_dict['vote_shares'].keys()]
-                    candidates = eval_candidates(race['candidates'], candidate_names)
-                
-                #get the timestamp and check that it is lower than the next value in the timeseries
-                curr_timestamp = vote_dict['timestamp']
-                if i < N - 1:
-                    next_timestamp = race['timeseries'][i + 1]['timestamp']
-                    if pd.Timestamp(curr_timestamp) > pd.Timestamp(next_timestamp):
-                        continue
-                
-                vote_record = {}
-                vote_record['timestamp']     = curr_timestamp
-                vote_record['votes2020']     = vote_dict['votes']
-                vote_record['vf_dem']        = vote_dict['vote_shares'].get(candidates.get('dem'), 0)
-                vote_record['vf_rep']        = vote_dict['vote_shares'].get(candidates.get('rep'), 0)
-                vote_record['vf_extra']      = vote_dict['vote_shares'].get(candidates.get('extra'), 0)
-                vote_record.update(past_elections_data)
-                race_records.append(vote_record)
-            
-            if len(race_records) == 0:
-                continue
-            race_df = pd.DataFrame.from_records(race_records)
-            race_df.set_index(pd.to_datetime(race_df['timestamp']), drop=False, inplace=True)
-            race_df.index.rename('date', inplace=True)
-            
-            if race_type == 'G-P-':
-                vote_dfs[race_id[3:]] = race_df
-                synced_dates = race_df.index.to_frame(index=False, name='date')
-            else:
-                race_df = pd.merge_asof(synced_dates, race_df, left_on='date', 
-                                        right_index=True, direction='backward')
-                vote_dfs[race_id[3:]] = race_df.set_index('date')#.drop_duplicates(subset=['timestamp']))
-    
-    full_df = pd.concat(vote_dfs.values(), keys=vote_dfs.keys())
+        if race_type not in RACE_TYPES:
+            continue
+        print(race['race_id'][:-11])
+        timeseries = race['timeseries']
+        if len(timeseries) == 0:
+            continue
+        candidates = eval_candidates(race['candidates'], [*timeseries[0]['vote_shares'].keys()])
+        race_keys.append(race['race_id'][3:-11])
+        race_types.append(race_type)
+        lengths.append(len(timeseries))
+        columns['timestamp'].extend(vote_dict['timestamp'] for vote_dict in timeseries)
+        columns['votes2020'].extend(vote_dict['votes'] for vote_dict in timeseries)
+        for party in ('dem', 'rep', 'extra'):
+            candidate = candidates.get(party)
+            columns['vf_' + party].extend(vote_dict['vote_shares'].get(candidate, 0) for vote_dict in timeseries)
+        if race_type == 'G-P-':
+            past_elections_data = {column: race[column] for column in ('votes2016', 'margin2016', 'votes2012', 'margin2012')}
+    if 'G-P-' not in race_types:
+        raise ValueError('{} has no presidential timeseries to align the other races with'.format(state))
+
+    #all timestamps are parsed at once, and a point is dropped when it's later than the next point
+    #of its race (the first point always seems to be out of order and have zero votes)
+    dates = pd.to_datetime(columns['timestamp'], format='ISO8601')
+    race_codes = np.repeat(np.arange(len(lengths)), lengths)
+    keep = np.ones(len(dates), dtype=bool)
+    keep[:-1] = ~(dates[:-1] > dates[1:]) | (race_codes[:-1] != race_codes[1:])
+    points = pd.DataFrame({column: pd.Series(np.array(values, dtype=object)[keep]).infer_objects()
+                           for column, values in columns.items()})
+    points.insert(0, 'date', dates[keep])
+    points.insert(0, 'race', race_codes[keep])
+
+    #the presidential race sets the clock...
+    president = race_types.index('G-P-')
+    president_df = points[points['race'] == president].drop(columns='race')
+    for column, value in past_elections_data.items():
+        president_df[column] = value
+    synced_dates = president_df['date'].reset_index(drop=True)
+
+    #...and every other race is aligned to it (the latest point at or before each presidential
+    #timestamp) in a single asof join
+    others = [code for code in range(len(race_keys)) if code != president]
+    left = pd.DataFrame({'race': np.repeat(others, len(synced_dates)),
+                         'date': synced_dates.iloc[np.tile(np.arange(len(synced_dates)), len(others))].array})
+    left['position'] = np.arange(len(left))
+    right = points[points['race'] != president].sort_values('date', kind='stable')
+    aligned = pd.merge_asof(left.sort_values('date', kind='stable'), right, on='date', by='race',
+                            direction='backward').sort_values('position')
+
+    full_df = pd.concat([president_df, aligned[president_df.columns.intersection(aligned.columns)]])
+    race_ids = np.array(race_keys, dtype=object)[np.concatenate([np.full(len(president_df), president), aligned['race']])]
+    full_df.index = pd.MultiIndex.from_arrays([race_ids, full_df['date']], names=[None, 'date'])
+    full_df = full_df.drop(columns='date')
+    METRICS.record_rows('races', len(full_df), time.perf_counter() - build_start, state=state)
+    METRICS.observe('aggregate_seconds', time.perf_counter() - build_start, dataset='races', state=state)
     return state, full_df
 
-def load_state_data(state):
+def state_page_url(state):
+    return 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/state-page/{}.json'.format(state)
+
+def fetch_state_data(state, fetch=requests.get, cdx=None):
     State_Str = ' '.join([s[0].upper() + s[1:] for s in state.split('-')])
     print('Searching for the latest archived copy of the {} state page data'.format(State_Str))
+    if cdx is None:
+        search_hits = parse_cdx(fetch(cdx_query_url(state_page_url(state))).content)
+    else:
+        search_hits = cdx.search(state_page_url(state))
+
+    #the latest capture with a good url status code
+    search_hits = filter_hits(search_hits, mimetype=None, unique=None, dedup_digest=False)
+    latest_hit = search_hits.iloc[-1:]
+    archived_urlA, = archived_urls(latest_hit)
+    archived_urlB, = archived_urls(latest_hit, raw=False)
 
-    archive_api_url = 'http://web.archive.org/cdx/search/cdx?url='
-    archive_output_qualifier = '&output=json'
-    nyt_url = 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/state-page/{}.json'.format(state)
-    search_hits = requests.get(archive_api_url + nyt_url + archive_output_qualifier).json()
-
-    #loops through `search_hits` checking for the first hit with a good url status code
-    for url_group in reversed(search_hits):
-        if int(url_group[4]) < 400:
-            archived_urlA = 'http://web.archive.org/web/' + url_group[1] + 'if_/' + url_group[2]
-            archived_urlB = 'http://web.archive.org/web/' + url_group[1] + '/' + url_group[2]
-            
-            download_start = time.time()
-            try:
-                state_data = requests.get(archived_urlA).json()
-                print('Downloading {} data from {}'.format(State_Str, archived_urlA))
-            except:
-                state_data = requests.get(archived_urlB).json()
-                print('Downloading {} data from {}'.format(State_Str, archived_urlB))
-            download_finish = time.time()
-            print('Download successful, took {:.1f} seconds'.format(download_finish - download_start))
-            
-            state_abbrv, vote_df = build_state_dataframe(state_data['data']['races'])
-            
-            print('Waiting 5x length of previous download as courtesy before continuing...')
-            time.sleep(5 * (download_finish - download_start))
-            break
+    with Timer() as download_timer:
+        try:
+            state_data = fetch(archived_urlA).json()
+            print('Downloading {} data from {}'.format(State_Str, archived_urlA))
+        except:
+            state_data = fetch(archived_urlB).json()
+            print('Downloading {} data from {}'.format(State_Str, archived_urlB))
+    print('Download successful, took {:.1f} seconds'.format(download_timer.elapsed))
     
-    return state_abbrv, vote_df
+    return state_data['data']['races']
 
-if __name__=='__main__':
-    df_dict = {}
-    for state in states_list:
-        state_abbrv, vote_df = load_state_data(state.lower().replace(' ','-'))
-        df_dict[state_abbrv] = vote_df
+def load_state_data(state, fetch=requests.get, cdx=None):
+    return build_state_dataframe(fetch_state_data(state, fetch=fetch, cdx=cdx))
 
-    full_df = pd.concat(df_dict.values(), keys=df_dict.keys())
-    full_df.index.rename(['state', 'race_id', 'date'], inplace=True)
-    src_dir = '.'
-    full_df.to_csv(src_dir + '/' + 'election2020_house-senate-president.csv')
+def state_table(state_abbrv, vote_df):
+    #the rows written for a state: one per race and presidential timestamp
+    state_df = pd.concat([vote_df], keys=[state_abbrv])
+    state_df.index.rename(['state', 'race_id', 'date'], inplace=True)
+    return state_df.reset_index()
+
+def poll_state_races(state, output, poller, rollups=None):
+    """Appends the rows of the live page of `state` (e.g. 'new-york') at presidential timestamps
+    later than the ones already written (see `election2020.live.LivePoller`), and adds them to the
+    `rollups` (a `RollupCache`) if given; returns the rows appended."""
+    url = state_page_url(state)
+    response = poller.poll(url)
+    if response is None:
+        return 0
+    state_df = state_table(*build_state_dataframe(response.json()['data']['races']))
+    latest = poller.version(url, 'date')
+    if latest is not None:
+        state_df = state_df[state_df['date'] > pd.Timestamp(latest)]
+    if len(state_df):
+        with METRICS.timer('write_seconds', dataset='races', format=output.format):
+            output.write(state_df, key=state_df['state'].iloc[0])
+        if rollups is not None:
+            rollups.refresh('races', state_df)
+    poller.mark(url, response, {'date': state_df['date'].max().isoformat()} if len(state_df) else None)
+    return len(state_df)
 
+def run(src_dir='.', states=states_list, output_format='csv', workers=None, live=False, concurrency=4,
+        metrics_file=None):
+    """Builds the race tables of `states` (state names) from the latest archived state pages, or
+    with `live` polls every state's page each minute; see the settings in `__main__`, or
+    `python -m election2020 races --help`."""
+    src_dir = Path(src_dir)
+    if metrics_file is None:
+        metrics_file = src_dir / 'races_metrics.jsonl'
+
+    #the engine's politeness budget replaces the 5x-download-time courtesy wait, and raw archived
+    #responses are cached so that reruns replay from disk instead of the network
+    cache = ResponseCache(src_dir / 'archive_cache')
+    engine = FetchEngine(max_workers=concurrency, rate=0.5, cache=cache)
+    METRICS.export_every(metrics_file)
+
+    #each state is appended to the output as soon as it's built and recorded in the manifest,
+    #so an interrupted run resumes with the first state that wasn't written
+    if output_format == 'parquet':
+        output = ParquetSink(src_dir / 'election2020_house-senate-president')
+    else:
+        output = CsvSink(src_dir / 'election2020_house-senate-president.csv', index=False)
+
+    if live:
+        #one conditional request per state and minute; unchanged pages aren't parsed
+        poller = LivePoller(engine, src_dir / 'races_live.sqlite')
+        #the charts' rollups are refreshed with each new snapshot
+        rollups = RollupCache(src_dir / 'election2020_rollups.sqlite')
+        feeds = [functools.partial(poll_state_races, state.lower().replace(' ','-'), output, poller, rollups)
+                 for state in states]
+        try:
+            poller.run(feeds, interval=60)
+        except KeyboardInterrupt:
+            pass
+        poller.close()
+        rollups.close()
+    else:
+        scope = output.path.name
+        manifest = ScrapeManifest(src_dir / 'races_manifest.sqlite')
+        #every state's CDX search runs up front (concurrently), and the results are reused for a day
+        cdx = CdxIndex(engine, src_dir / 'cdx_cache.sqlite')
+        cdx.search_all([state_page_url(state.lower().replace(' ','-')) for state in states])
+        manifest.recover(scope)
+        #per-race vote updates (differences between timestamps), for fast anomaly queries
+        update_index = UpdateIndex(src_dir / 'vote_updates.sqlite')
+        #and every row, indexed by state, race and time (e.g. to reconcile with the county totals)
+        store = ResultsStore(src_dir / 'election2020_results.sqlite')
+        #and each race's curve in minute to daily buckets, for charts
+        rollups = RollupCache(src_dir / 'election2020_rollups.sqlite')
+        if not manifest.summary(scope).get('written'):
+            output.reset()
+
+        def write_state(state_str, state_tables, error):
+            if error is not None:
+                print('!!! Building the tables failed for {}: {}'.format(state_str, error))
+                return
+            state_abbrv, vote_df = state_tables
+            state_df = state_table(state_abbrv, vote_df)
+
+            manifest.begin_write(scope, state_str, output.path)
+            with METRICS.timer('write_seconds', dataset='races', format=output.format):
+                output.write(state_df, key=state_abbrv)
+            manifest.mark(scope, state_str, 'written', rows=len(state_df))
+            update_index.add('races', state_df)
+            store.add('races', state_df)
+            rollups.add('races', state_df)
+
+        #the state pages download concurrently, and each is handed to the pool's workers as soon
+        #as it arrives; states are written in the order their pages arrived
+        pool = StatePool(workers)
+        pending_states = [state.lower().replace(' ','-') for state in states]
+        pending_states = [state_str for state_str in pending_states if not manifest.is_written(scope, state_str)]
+        fetch_state = functools.partial(fetch_state_data, fetch=engine.get, cdx=cdx)
+        for state_str, races, error in engine.map(fetch_state, pending_states):
+            if error is not None:
+                print('!!! Download failed for {}: {}'.format(state_str, error))
+                continue
+            pool.submit(state_str, build_state_dataframe, races)
+            for result in pool.completed():
+                write_state(*result)
+        for result in pool.results():
+            write_state(*result)
+
+        pool.close()
+        update_index.close()
+        store.close()
+        rollups.close()
+        cdx.close()
+        manifest.close()
+    engine.close()
+    METRICS.stop_export()
+
+
+if __name__=='__main__':
+    src_dir = '.'
+    output_format = 'csv'   #or 'parquet' for a typed dataset partitioned by state (needs pyarrow)
+    workers = None   #processes that build the state tables while the next state downloads (None uses every cpu)
+    #counters and timings of the run (bytes fetched, backoff time, build time per state, ...),
+    #rewritten every minute; use a '.prom' file for the Prometheus text format
+    metrics_file = Path(src_dir) / 'races_metrics.jsonl'
+    #to follow an election live, poll every state's page each minute (appending only the new
+    #timestamps) instead of backfilling the latest archived copies
+    live = False
 
+    run(src_dir, output_format=output_format, workers=workers, live=live, metrics_file=metrics_file)
@@ -1,39 +1,108 @@
-from bs4 import BeautifulSoup
-import requests
-import itertools
-
-##########################################################################################
-#The src folder needs to be set here before the file i/o will work properly
-src_dir = ''
-##########################################################################################
-
-
-data_urls = []
-visited_urls = []
-
-with open(src_dir + '/' + 'archived_nyt_election2020_urls.txt', 'r') as file_handle:
-    for archived_url in file_handle:
-        if archived_url in visited_urls:
-            continue
-        else:
-            visited_urls.append(archived_url)
-        
-        soup = BeautifulSoup(requests.get(archived_url).content, 'html.parser')
-        
-        #This line is the key to grabbing the timestamped url.  I found the "e-map-data"
-        #<div> class by searching for 'static01.nyt.com/elections-assets/2020/data/api/*' 
-        #at https://www.nytimes.com/interactive/2020/11/03/us/election/results-president.html
-        script_text = soup.find("script", class_="e-map-data").string
-        
-        #a hackish and opaque, but fast way to extract the timestamped urls
-        for url_str in script_text.split('"timestamped_url":"')[1:]:
-            nyt_url = url_str[:171].split('"')[0]
-            if not nyt_url in data_urls:
-                data_urls.append(nyt_url)
-        print('extracted urls for archived NY Times source files from %s' %archived_url)
-
-with open(src_dir + '/' + 'archived_nyt_timestamped_data_urls.txt', 'w') as data_dump_file:
-    for url in data_urls:
-        data_dump_file.write(url + '\n')
+import re
+import functools
+import sys
+from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.fetch import FetchEngine
+from election2020.manifest import ScrapeManifest
+from election2020.metrics import METRICS, Timer
 
+
+#I found the "e-map-data" <script> by searching for 'static01.nyt.com/elections-assets/2020/data/api/*'
+#at https://www.nytimes.com/interactive/2020/11/03/us/election/results-president.html.  It holds
+#the timestamped url of every NYT source file, so the page is scanned for that one block instead
+#of being parsed whole (its class may be quoted either way, and listed with others)
+MAP_DATA_SCRIPT = re.compile(rb'<script[^>]*\bclass=["\'][^"\']*\be-map-data\b[^>]*>(.*?)</script>', re.S)
+TIMESTAMPED_URL = re.compile(rb'"timestamped_url":"([^"]*)"')
+
+
+def extract_timestamped_urls(content):
+    #the timestamped urls in the e-map-data script of an archived results page (raw bytes)
+    script = MAP_DATA_SCRIPT.search(content)
+    if script is None:
+        raise ValueError('No e-map-data script in the page')
+    return [url.decode('utf-8') for url in TIMESTAMPED_URL.findall(script.group(1))]
+
+def harvest_page(archived_url, fetch):
+    response = fetch(archived_url)
+    with Timer() as parse_timer:
+        urls = extract_timestamped_urls(response.content)
+    METRICS.record_rows('timestamped_urls', len(urls), parse_timer.elapsed)
+    return urls
+
+def harvest_urls(archived_urls, output_path, engine, manifest=None, scope='timestamped_urls'):
+    """Extracts the timestamped NYT urls from every archived results page, fetched concurrently on
+    the `engine`, and appends the ones not seen before to the file at `output_path` as each page
+    is done.
+
+    With a `manifest`, the pages whose urls were written are skipped when the harvest is run again
+    (e.g. after it was killed), and the urls already in the file are never written twice.
+    Returns the pages that failed.
+    """
+    output_path = Path(output_path)
+    archived_urls = list(dict.fromkeys(url.strip() for url in archived_urls if url.strip()))
+    if manifest is not None:
+        manifest.recover(scope)
+        manifest.add(scope, archived_urls)
+        archived_urls = manifest.remaining(scope, archived_urls)
+    data_urls = set(output_path.read_text().split()) if output_path.is_file() else set()
+
+    failed_urls = []
+    extract_urls = functools.partial(harvest_page, fetch=engine.get)
+    with open(output_path, 'a') as data_dump_file:
+        for archived_url, urls, error in engine.map(extract_urls, archived_urls):
+            if error is not None:
+                print('Failed to extract urls from {} with error: {}'.format(archived_url, str(error)))
+                failed_urls.append(archived_url)
+                if manifest is not None:
+                    manifest.mark(scope, archived_url, 'failed', error=str(error))
+                continue
+            new_urls = [url for url in dict.fromkeys(urls) if url not in data_urls]
+            data_urls.update(new_urls)
+            if manifest is not None:
+                manifest.begin_write(scope, archived_url, output_path)
+            data_dump_file.write(''.join(url + '\n' for url in new_urls))
+            data_dump_file.flush()
+            if manifest is not None:
+                manifest.mark(scope, archived_url, 'written', rows=len(new_urls))
+            print('extracted {} new urls for archived NY Times source files from {}'.format(len(new_urls), archived_url))
+    return failed_urls
+
+
+def run(src_dir='.', concurrency=4, metrics_file=None):
+    """Harvests the timestamped urls of the archived results pages listed in `src_dir`'s
+    archived_nyt_election2020_urls.txt into archived_nyt_timestamped_data_urls.txt (see
+    `python -m election2020 crawl --help`)."""
+    src_dir = Path(src_dir)
+    if metrics_file is None:
+        metrics_file = src_dir / 'url_harvest_metrics.jsonl'
+
+    #pages are fetched concurrently within the engine's politeness budget (raise `rate` for a
+    #faster harvest of tens of thousands of pages, if the archive tolerates it)
+    engine = FetchEngine(max_workers=concurrency, rate=0.5, burst=4, per_host=concurrency)
+    #tracks which pages' urls made it into the output, so a killed harvest resumes where it stopped
+    manifest = ScrapeManifest(src_dir / 'url_harvest_manifest.sqlite')
+    METRICS.export_every(metrics_file)
+
+    archived_urls = (src_dir / 'archived_nyt_election2020_urls.txt').read_text().split()
+    failed_urls = harvest_urls(archived_urls, src_dir / 'archived_nyt_timestamped_data_urls.txt',
+                               engine=engine, manifest=manifest)
+    #failed pages are retried once more, now that the rest are done
+    if failed_urls:
+        failed_urls = harvest_urls(failed_urls, src_dir / 'archived_nyt_timestamped_data_urls.txt',
+                                   engine=engine, manifest=manifest)
+    print('{} pages failed'.format(len(failed_urls)))
+
+    engine.close()
+    manifest.close()
+    METRICS.stop_export()
+
+
+if __name__=='__main__':
+    ##########################################################################################
+    #The src folder needs to be set here before the file i/o will work properly
+    src_dir = Path('.')
+    ##########################################################################################
+
+    run(src_dir)
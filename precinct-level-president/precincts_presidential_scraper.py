@@ -1,10 +1,25 @@
 import requests
 import itertools
+import functools
+import sys
 from pathlib import Path
-import time
 import pandas as pd
 import numpy as np
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.fetch import FetchEngine
+from election2020.cache import ResponseCache
+from election2020.manifest import ScrapeManifest
+from election2020.streamline import streamline_precincts
+from election2020.jsonstream import iter_text_chunks, iter_json_arrays, iter_batches
+from election2020.records import RecordBuffer, PRECINCT_SCHEMA, concat_records
+from election2020.metrics import METRICS, Timer
+from election2020.deltas import DeltaSink
+from election2020.parallel import StatePool
+from election2020.updates import UpdateIndex
+from election2020.rollup import RollupCache
+from election2020.sinks import CsvSink, ParquetSink
+
 
 def extract_vote_record(state, timestamp, data_dict):
     vote_info = {}
@@ -28,24 +43,67 @@ def extract_vote_record(state, timestamp, data_dict):
     
     return vote_info
 
-def load_data(url, state, out=None):
+def load_data(url, state, out=None, fetch=requests.get):
     return_data = True if out is None else False
     if return_data:
         out = []
     
     try:
         print('Attempting to download: {}'.format(url))
-        json_data = requests.get(url).json()
+        json_data = fetch(url).json()
     except:
         raise IOError
 
-    for record in itertools.chain(json_data.get('precincts', []),
-                                  json_data.get('precinct_by_vote_type', [])):
-        out.append( extract_vote_record(state, url[-29:-6], record) )
+    num_rows = len(out)
+    with Timer() as parse_timer:
+        for record in itertools.chain(json_data.get('precincts', []),
+                                      json_data.get('precinct_by_vote_type', [])):
+            out.append( extract_vote_record(state, url[-29:-6], record) )
+    METRICS.record_rows('precincts', len(out) - num_rows, parse_timer.elapsed, state=state)
     
     if return_data:
         return out
 
+def extract_vote_columns(state, timestamp, rows):
+    #column-wise equivalent of `extract_vote_record` for a batch of rows (see `RecordBuffer.extend`)
+    results = [{k: v if not v in (None, 'null') else np.nan for k, v in row['results'].items()} for row in rows]
+    vote_types = [row.get('vote_type', 'null') for row in rows]
+    return {
+        'state':           state,
+        'county':          [row['locality_name'].lower().replace(' ','-').replace('-county','') for row in rows],
+        'precinct':        [row['precinct_id'].lower().replace(' ','-') for row in rows],
+        'fips':            [row['locality_fips'] for row in rows],
+        'timestamp':       timestamp,
+        'vote_type':       [vote_type if vote_type != 'null' else None for vote_type in vote_types],
+        'votes':           [row.get('votes', np.nan) for row in rows],
+        'votes_biden':     [r.pop('bidenj') for r in results],
+        'votes_trump':     [r.pop('trumpd') for r in results],
+        'votes_jorgensen': [r.pop('jorgensenj') for r in results],
+        'votes_other':     [sum(r.values()) for r in results],
+    }
+
+def load_data_streaming(url, state, fetch=requests.get, batch_size=5000, chunk_size=1 << 20):
+    #same rows as `load_data`, but the response is streamed and its json parsed incrementally and
+    #converted to columns `batch_size` rows at a time, so neither the raw body, the fully parsed
+    #document nor a dict per row is ever held in memory (`chunk_size` bytes of the body are at a
+    #time; a response replayed from the cache is already in memory).  Labels come back
+    #categorical and vote counts as nullable integers
+    try:
+        print('Attempting to download: {}'.format(url))
+        response = fetch(url, stream=True)
+    except:
+        raise IOError
+
+    with Timer() as parse_timer:
+        records = (record for key, record in iter_json_arrays(iter_text_chunks(response.iter_content(chunk_size)))
+                          if key in ('precincts', 'precinct_by_vote_type'))
+        vote_records = RecordBuffer(PRECINCT_SCHEMA)
+        for rows in iter_batches(records, batch_size):
+            vote_records.extend(extract_vote_columns(state, url[-29:-6], rows), len(rows))
+        results_df = vote_records.to_frame()
+    METRICS.record_rows('precincts', len(results_df), parse_timer.elapsed, state=state)
+    return results_df
+
 def fill_missing_timestamps(df, uniq_size, template_df):
     if df.shape[0] < uniq_size:
         first_row = df.iloc[0]
@@ -135,51 +193,147 @@ def streamline_data(precinct_records, sum_counties=True):
     
     return results_df
 
+def streamline_state(state, precinct_records, output, update_index_path=None, rollup_path=None):
+    #runs in a worker process: `precinct_records` is the state's rows (or a sink holding its
+    #snapshots), and the streamlined results are written straight to `output` (and their vote
+    #updates to the update index, and their county and state curves to the chart rollups)
+    if hasattr(precinct_records, 'read'):
+        precinct_records = precinct_records.read(state)
 
-if __name__=='__main__':
-    ##########################################################################################
-    #The src folder needs to be set here before the file i/o will work properly
-    src_dir = '.'
-    ##########################################################################################
+    #`streamline_precincts` is a vectorized drop-in for `streamline_data` (same output, see
+    #benchmarks/bench_streamline.py)
+    with METRICS.timer('aggregate_seconds', dataset='precincts', state=state):
+        if state in ('GA', 'NC'):
+            results_df = streamline_precincts(precinct_records)
+        else:
+            results_df = streamline_precincts(precinct_records, sum_counties=False)
 
-    json_urls_file = src_dir + '/' + 'archived_nyt_timestamped_precinct_urls.txt'
-    json_urls_all = Path(json_urls_file).read_text().split()
+    output.replace(results_df, key=state)
+    if update_index_path is not None:
+        update_index = UpdateIndex(update_index_path)
+        update_index.add('precincts', results_df)
+        update_index.close()
+    if rollup_path is not None:
+        rollups = RollupCache(rollup_path)
+        rollups.add('precincts', results_df)
+        rollups.close()
+    return len(results_df)
 
-    for state in ('GA','NC','FL','MI','PA'):
-        json_urls = [u for u in json_urls_all if state in u]
 
-        precinct_records = []
-        unique_src_urls = []
+def run(src_dir='.', states=('GA','NC','FL','MI','PA'), output_format='csv', delta_only=False, workers=None,
+        concurrency=4, metrics_file=None):
+    """Downloads every archived precinct file of `states` listed in `src_dir`'s
+    archived_nyt_timestamped_precinct_urls.txt and writes each state's streamlined timeseries
+    (see the settings in `__main__`, or `python -m election2020 precinct --original --help`)."""
+    src_dir = Path(src_dir)
+    if metrics_file is None:
+        metrics_file = src_dir / 'precincts_metrics.jsonl'
+    json_urls_file = src_dir / 'archived_nyt_timestamped_precinct_urls.txt'
+    json_urls_all = json_urls_file.read_text().split()
 
-        num_urls = len(json_urls) + 1
-        while len(json_urls) < num_urls:
-            num_urls = len(json_urls)
+    #downloads run concurrently, throttled by the engine's politeness budget instead of sleeping
+    #5x the length of each download.  Raw archived responses are cached so that reruns replay
+    #from disk instead of the network
+    cache = ResponseCache(src_dir / 'archive_cache')
+    engine = FetchEngine(max_workers=concurrency, rate=0.5, burst=4, per_host=concurrency, cache=cache)
+    #records which archived files were parsed and which state csv files are complete, so an
+    #interrupted run picks up at the first unfinished state
+    manifest = ScrapeManifest(src_dir / 'precincts_manifest.sqlite')
+    pool = StatePool(workers)
+    METRICS.export_every(metrics_file)
+    outputs = {}
 
-            for line in json_urls:
-                #this should download from the Internet Archive <web.archive.org>, not the NY Times
-                #the `nyt_src_url` is only used here for bookkeeping to weed out redundant archived copies
-                url = line.strip()
-                nyt_src_url = url[43:]
-                if nyt_src_url in unique_src_urls:
-                    json_urls.remove(url)
-                    continue
+    def finish_state(state, num_rows, error):
+        if error is not None:
+            print('!!! Streamlining failed for {}: {}'.format(state, error))
+            return
+        json_urls, output_id = outputs.pop(state)
+        for url in json_urls:
+            if manifest.status(state, url) == 'parsed':
+                manifest.mark(state, url, 'written')
+        manifest.mark('outputs', output_id, 'written', rows=num_rows)
+
+    for state in states:
+        if output_format == 'parquet':
+            output = ParquetSink(src_dir / 'precincts_timeseries_2020')
+        else:
+            output = CsvSink(src_dir / '{}_precincts_timeseries_2020.csv'.format(state), index=False)
+        output_id = '{}:{}'.format(output.path, state)
+        if manifest.is_written('outputs', output_id) and output.exists():
+            print('{} was already written to {}, skipping'.format(state, output.path))
+            continue
+
+        json_urls = [u.strip() for u in json_urls_all if state in u]
+        manifest.add(state, json_urls)
 
-                download_start = time.time()
-                try:
-                    load_data(url, state, out=precinct_records)
-                    unique_src_urls.append(nyt_src_url)
-                    json_urls.remove(url)
-                except IOError:
+        #this should download from the Internet Archive <web.archive.org>, not the NY Times
+        #the `nyt_src_url` is only used here for bookkeeping to weed out redundant archived copies
+        archived_copies = {}
+        for url in json_urls:
+            nyt_src_url = url[43:]
+            archived_copies.setdefault(nyt_src_url, []).append(url)
+
+        #each pass downloads one archived copy of every NYT source file that is still missing,
+        #falling back to the next archived copy if the previous one failed
+        records_by_src_url = {}
+        if delta_only:
+            snapshots = DeltaSink(CsvSink(src_dir / '{}_precincts_snapshots.csv'.format(state)))
+        while archived_copies:
+            batch = {urls.pop(0): nyt_src_url for nyt_src_url, urls in archived_copies.items()}
+            load_state_data = functools.partial(load_data_streaming, state=state, fetch=engine.get)
+            for url, records, error in engine.map(load_state_data, batch):
+                if error is not None:
                     print('!!! Download failed for {}'.format(url))
-                download_finish = time.time()
-                print('Download successful, took {:.1f} seconds'.format(download_finish - download_start))
-                print('Waiting 5x length of previous download as courtesy before continuing...')
-                time.sleep(5 * (download_finish - download_start))
+                    manifest.mark(state, url, 'failed', error=str(error))
+                    continue
+                manifest.mark(state, url, 'parsed', rows=len(records))
+                if delta_only:
+                    snapshots.write(records, key=url)
+                else:
+                    records_by_src_url[batch[url]] = records
+                archived_copies.pop(batch[url])
+            archived_copies = {k: urls for k, urls in archived_copies.items() if urls}
 
-        if state in ('GA', 'NC'):
-            results_df = streamline_data(precinct_records)
+        if delta_only:
+            #the worker rebuilds the dense rows of every snapshot from the stored deltas
+            precinct_records = snapshots
         else:
-            results_df = streamline_data(precinct_records, sum_counties=False)
+            precinct_records = concat_records(records_by_src_url.values())
+            del records_by_src_url
+
+        #the state is streamlined on the pool while the next state downloads, and the manifest
+        #is updated once it's written (in the same order as the states were submitted)
+        outputs[state] = (json_urls, output_id)
+        pool.submit(state, streamline_state, state, precinct_records, output,
+                    update_index_path=src_dir / 'vote_updates.sqlite',
+                    rollup_path=src_dir / 'election2020_rollups.sqlite')
+        del precinct_records
+        for done_state, num_rows, error in pool.completed():
+            finish_state(done_state, num_rows, error)
 
-        results_df.to_csv(src_dir + '/' + '{}_precincts_timeseries_2020.csv'.format(state), index=False, encoding='utf-8')
+    for done_state, num_rows, error in pool.results():
+        finish_state(done_state, num_rows, error)
+
+    pool.close()
+    engine.close()
+    manifest.close()
+    METRICS.stop_export()
+
+
+if __name__=='__main__':
+    ##########################################################################################
+    #The src folder needs to be set here before the file i/o will work properly
+    src_dir = '.'
+    #'csv' writes one file per state; 'parquet' writes a typed dataset partitioned by state (needs pyarrow)
+    output_format = 'csv'
+    #keep each state's snapshots on disk as deltas (only the rows that changed since the previous
+    #snapshot) instead of holding every snapshot in memory until the state is streamlined
+    delta_only = False
+    #processes that streamline finished states while the next state downloads (None uses every cpu)
+    workers = None
+    #counters and timings of the run (bytes fetched, rows parsed per second, backoff time, ...),
+    #rewritten every minute; use a '.prom' file for the Prometheus text format
+    metrics_file = src_dir + '/' + 'precincts_metrics.jsonl'
+    ##########################################################################################
 
+    run(src_dir, output_format=output_format, delta_only=delta_only, workers=workers, metrics_file=metrics_file)
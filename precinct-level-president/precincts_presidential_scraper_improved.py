@@ -1,10 +1,29 @@
 import requests
 import itertools
+import functools
+import sys
+import tempfile
 from pathlib import Path
-import time
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.fetch import FetchEngine
+from election2020.live import LivePoller, response_timestamp
+from election2020.cache import ResponseCache
+from election2020.cdx import CdxIndex, filter_hits, archived_urls
+from election2020.manifest import ScrapeManifest
+from election2020.jsonstream import iter_text_chunks, iter_json_arrays, iter_batches
+from election2020.records import RecordBuffer, PRECINCT_SCHEMA
+from election2020.metrics import METRICS, Timer
+from election2020.deltas import ChangedRows, DeltaSink
+from election2020.external import DEFAULT_MEMORY_BUDGET, iter_csv_by_ranges
+from election2020.parallel import StatePool
+from election2020.updates import UpdateIndex
+from election2020.store import ResultsStore
+from election2020.rollup import RollupCache
+from election2020.wide import wide_table
+from election2020.sinks import CsvSink, ParquetSink, as_sink, uncategorize
 
 
 def extract_vote_record(state, timestamp, data_dict):
@@ -33,30 +52,138 @@ def extract_vote_record(state, timestamp, data_dict):
 
     return vote_info
 
-def load_precinct_data(nyt_url, csv_path, state, extra_only=False, extra_urls=[]):
+def extract_vote_columns(state, timestamp, rows):
+    #column-wise equivalent of `extract_vote_record` for a batch of rows (see `RecordBuffer.extend`)
+    results = [{k: v if not v in (None, 'null') else np.nan for k, v in row['results'].items()} for row in rows]
+    precincts = [row['precinct_id'] for row in rows]
+    return {
+        'state':           state,
+        'county':          [row['locality_name'].lower().replace(' ','-').replace('-county','') for row in rows],
+        'precinct':        [p if p == 'COUNTY' else p.lower().replace(' ','-') for p in precincts],
+        'fips':            [-9999 if p == 'COUNTY' else row['locality_fips'] for p, row in zip(precincts, rows)],
+        'timestamp':       timestamp,
+        'vote_type':       [row.get('vote_type', 'null') for row in rows],
+        'votes':           [row.get('votes', np.nan) for row in rows],
+        'votes_biden':     [r.pop('bidenj', np.nan) for r in results],
+        'votes_trump':     [r.pop('trumpd', np.nan) for r in results],
+        'votes_jorgensen': [r.pop('jorgensenj', np.nan) for r in results],
+        'votes_other':     [sum(r.values()) if r else np.nan for r in results],
+    }
+
+def iter_precinct_rows(content):
+    #streams the rows of every record type (except 'meta') out of the raw json
+    record_type = None
+    for key, row in iter_json_arrays(iter_text_chunks(content), skip_keys=('meta',)):
+        if key != record_type:
+            record_type = key
+            print('Extracting {} data...'.format(record_type))
+        yield row
+
+def parse_precinct_data(content, state, timestamp, batch_size=5000):
+    #the json is parsed incrementally and converted to columns `batch_size` rows at a time, so
+    #neither the fully parsed document nor a dict per row is ever held in memory.  `content` is
+    #the raw body, or the chunks of a streamed one (so the body isn't held whole either).  Labels
+    #are interned as categorical codes and vote counts kept as nullable integers
+    vote_records = RecordBuffer(PRECINCT_SCHEMA)
+    for rows in iter_batches(iter_precinct_rows(content), batch_size):
+        vote_records.extend(extract_vote_columns(state, timestamp, rows), len(rows))
+    return vote_records.to_frame() if len(vote_records) else pd.DataFrame()
+
+def extract_precinct_data(archived_url, state, fetch=requests.get, manifest=None, batch_size=5000,
+                          chunk_size=1 << 20):
+    #the response is streamed, and parsed `chunk_size` bytes at a time as they're downloaded
+    print('\nDownloading data from {}'.format(archived_url))
+    with Timer() as download_timer:
+        race_data = fetch(archived_url, stream=True)
+    print('Download started, took {:.1f} seconds'.format(download_timer.elapsed))
+
+    num_bytes = 0
+    def body():
+        nonlocal num_bytes
+        for chunk in race_data.iter_content(chunk_size):
+            num_bytes += len(chunk)
+            yield chunk
+
+    timestamp = archived_url[-29:-5]
+    with Timer() as parse_timer:
+        results_df = parse_precinct_data(body(), state, timestamp, batch_size=batch_size)
+    METRICS.record_rows('precincts', len(results_df), parse_timer.elapsed, state=state)
+    if manifest is not None:
+        manifest.mark(state, archived_url, 'fetched', bytes=num_bytes, fetch_time=download_timer.elapsed)
+        manifest.mark(state, archived_url, 'parsed', rows=len(results_df), parse_time=parse_timer.elapsed)
+
+    print('Data extraction successful, took {:.1f} seconds'.format(parse_timer.elapsed))
+    return results_df
+
+def precinct_file_timestamp(content):
+    #the timestamp in the `meta` block of a precinct file (which comes first, so the rows
+    #aren't parsed), or None
+    for key, meta in iter_json_arrays(iter_text_chunks(content), skip_keys=('precincts', 'precinct_by_vote_type'),
+                                      value_keys=('meta',)):
+        return meta.get('timestamp') if isinstance(meta, dict) else None
+    return None
+
+def poll_precinct_data(nyt_url, state, output, poller, batch_size=5000, rollups=None, changes=None):
+    """Appends the precincts of the live file at `nyt_url` that changed since its previous snapshot,
+    if the file changed since the last poll (see `election2020.live.LivePoller`), and adds them to
+    the `rollups` (a `RollupCache`) if given; returns the rows appended.
+
+    Snapshots are timestamped with the file's own `meta` timestamp, or else its Last-Modified
+    time; a file with neither is skipped, and one whose timestamp was already written isn't
+    appended again.  Only the rows that changed since the previous snapshot are appended: with a
+    `DeltaSink` output the sink diffs them, and otherwise `changes` (a `ChangedRows` of the
+    output, kept between polls; made from the output's rows when not given) does."""
+    output = as_sink(output)
+    response = poller.poll(nyt_url)
+    if response is None:
+        return 0
+    timestamp = precinct_file_timestamp(response.content) or response_timestamp(response)
+    if timestamp is None:
+        METRICS.inc('live_polls_total', result='untimestamped')
+        print('!!! Skipped {}: it has neither a meta timestamp nor a Last-Modified header'.format(nyt_url))
+        return 0
+    if not poller.is_new(nyt_url, 'timestamp', timestamp):
+        poller.mark(nyt_url, response)
+        return 0
+
+    with Timer() as parse_timer:
+        results_df = parse_precinct_data(response.content, state, timestamp, batch_size=batch_size)
+    METRICS.record_rows('precincts', len(results_df), parse_timer.elapsed, state=state)
+    if len(results_df) and not isinstance(output, DeltaSink):
+        changes = changes or ChangedRows(output)
+        results_df = changes.changed(state, results_df)
+    if len(results_df):
+        with METRICS.timer('write_seconds', dataset='precincts', format=output.format):
+            output.write(results_df, key=timestamp)
+        if rollups is not None:
+            rollups.refresh('precincts', results_df)
+    poller.mark(nyt_url, response, {'timestamp': timestamp})
+    return len(results_df)
+
+SEARCH_DATES = {'from_date': '20201104', 'to_date': '20201111'}   #limit search to election day +4
+
+
+def load_precinct_data(nyt_url, output, state, extra_only=False, extra_urls=[], engine=None, manifest=None,
+                       cdx=None):
+    #`output` is the path of the csv file to append to, or any output sink (see election2020/sinks.py)
     print('Searching for archived copies of the U.S. presidential election results')
+    output = as_sink(output)
 
-    uniq_nyt_urls = []
+    uniq_nyt_urls = set()
     urls_to_search = []
     failed_urls = []
+
+    close_engine = engine is None
+    if engine is None:
+        engine = FetchEngine()
     
     if not extra_only:
-        archive_api_url = 'http://web.archive.org/cdx/search/cdx?url='
-        archive_output_qualifier = '&output=json&from=20201104&to=20201111'   #limit search to election day +4
-        search_hits = requests.get(archive_api_url + nyt_url + archive_output_qualifier).json()[1:]
-
-        for url_group in search_hits:
-            archived_url = 'https://web.archive.org/web/' + url_group[1] + 'if_/' + url_group[2]
-            try:
-                good_url_status = int(url_group[4]) < 400
-                correct_data_type = url_group[3] == 'application/json'
-                url_is_new = not url_group[2] in uniq_nyt_urls
-                if good_url_status and correct_data_type and url_is_new:
-                    uniq_nyt_urls.append(url_group[2])
-                    if not extra_only:
-                        urls_to_search.append(archived_url)
-            except:
-                continue
+        if cdx is None:
+            cdx = CdxIndex(engine)
+        #the first good json capture of every NYT file (and of every distinct body)
+        search_hits = filter_hits(cdx.search(nyt_url, **SEARCH_DATES))
+        uniq_nyt_urls.update(search_hits['original'])
+        urls_to_search += archived_urls(search_hits)
     
     for i, url in enumerate(extra_urls):
         url_pieces = url.split('/')
@@ -64,42 +191,42 @@ def load_precinct_data(nyt_url, csv_path, state, extra_only=False, extra_urls=[]
         url = '/'.join(url_pieces)
         orig_src_url = '/'.join(url_pieces[5:])
         if (state in url) and (not orig_src_url in uniq_nyt_urls):
-            uniq_nyt_urls.append(orig_src_url)
+            uniq_nyt_urls.add(orig_src_url)
             urls_to_search.append(url)
             print(i, url)
+
+    #skip source files that a previous (possibly interrupted) run already wrote to the output
+    if manifest is not None:
+        manifest.recover(state)
+        manifest.add(state, urls_to_search)
+        urls_to_search = manifest.remaining(state, urls_to_search)
     
-    for archived_url in urls_to_search:
-        try:
-            print('\nDownloading data from {}'.format(archived_url))
-            download_start = time.time()
-            race_data = requests.get(archived_url)
-            download_finish = time.time()
-            print('Download successful, took {:.1f} seconds'.format(download_finish - download_start))
-
-            precinct_records = []
-            for record_type, record in race_data.json().items():
-                if record_type == 'meta':
-                    continue
-                print('Extracting {} data...'.format(record_type))
-                for row in record:
-                    precinct_records.append( extract_vote_record(state, archived_url[-29:-5], row) )
-            results_df = pd.DataFrame.from_records(precinct_records)
-            results_df.to_csv(csv_path, mode='a', header=not csv_path.is_file())
-
-            print('Data extraction successful, took {:.1f} seconds'.format(time.time() - download_finish))
-            print('Waiting 3x length of previous download as courtesy before continuing...')
-            time.sleep(3 * (download_finish - download_start))
-
-        except Exception as e:
-            print('Failed to extract data from {} with error: {}'.format(archived_url, str(e)))
+    #downloads and extraction run concurrently on the engine's thread pool, while the output
+    #is only ever appended to from this thread
+    extract_state_data = functools.partial(extract_precinct_data, state=state, fetch=engine.get,
+                                           manifest=manifest)
+    for archived_url, results_df, error in engine.map(extract_state_data, urls_to_search):
+        if error is not None:
+            print('Failed to extract data from {} with error: {}'.format(archived_url, str(error)))
             failed_urls.append(archived_url)
+            if manifest is not None:
+                manifest.mark(state, archived_url, 'failed', error=str(error))
+            continue
+        if manifest is not None:
+            manifest.begin_write(state, archived_url, output.path)
+        with METRICS.timer('write_seconds', dataset='precincts', format=output.format):
+            output.write(results_df, key=archived_url)
+        if manifest is not None:
+            manifest.end_write(state, archived_url)
+
+    if close_engine:
+        engine.close()
                 
     return failed_urls
 
-def fill_missing_totals(inputfile, outputfile):
-    df = pd.read_csv(inputfile, index_col=0)
-    df.dropna(subset=['votes_biden', 'votes_trump'], how='all', inplace=True)
-    df['vote_type'].fillna(value='null', inplace=True)
+def add_missing_totals(df):
+    df = df.dropna(subset=['votes_biden', 'votes_trump'], how='all')
+    df['vote_type'] = df['vote_type'].fillna(value='null')
 
     df['vtype_bool'] = (df['vote_type'] == 'total') | (df['vote_type'] == 'null')
     df['has_total_vtype'] = df.groupby(['county','precinct','timestamp'])['vtype_bool'].transform(sum)
@@ -116,29 +243,233 @@ def fill_missing_totals(inputfile, outputfile):
     ordered_cols = df.columns.tolist()
     full_df = pd.concat([df, totals_df[ordered_cols]], axis=0)
 
-    full_df.sort_values(by=['county', 'precinct', 'timestamp', 'vote_type'], inplace=True)
-    full_df['votes_other'].fillna(value=0, inplace=True)
+    full_df.sort_values(by=['county', 'precinct', 'timestamp', 'vote_type'], inplace=True, kind='stable')
+    full_df['votes_other'] = full_df['votes_other'].fillna(value=0)
     full_df.reset_index(drop=True, inplace=True)
+    return full_df
+
+def fill_missing_totals(inputfile, outputfile, state=None):
+    #`inputfile`/`outputfile` are csv paths or output sinks; sinks holding several states
+    #(i.e., parquet datasets) are processed one `state` at a time
+    inputfile, outputfile = as_sink(inputfile), as_sink(outputfile)
+    df = add_missing_totals(uncategorize(inputfile.read(state=state)))
+    outputfile.replace(df, key=state)
+    return df
+
+def iter_missing_totals(inputfile, outputfile, state=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """`fill_missing_totals` with about `memory_budget` bytes of rows in memory at a time.
 
-    full_df.to_csv(outputfile)
+    Csv files are read out of core in ranges of counties (see `iter_csv_by_ranges`) and the filled
+    rows of each range are yielded as they're appended to the output, which ends up identical to
+    `fill_missing_totals`'s.  Other sinks are processed in memory (parquet datasets are already
+    read one state at a time).
+    """
+    inputfile, outputfile = as_sink(inputfile), as_sink(outputfile)
+    if inputfile.format != 'csv' or outputfile.format != 'csv':
+        yield fill_missing_totals(inputfile, outputfile, state=state)
+        return
+
+    temp = tempfile.NamedTemporaryFile('w', prefix=outputfile.path.name, dir=outputfile.path.parent,
+                                       newline='', delete=False)
+    num_rows = 0
+    with temp:
+        for df in iter_csv_by_ranges(inputfile.path, 'county', memory_budget, where={'state': state},
+                                     index_col=0 if inputfile.index else None):
+            df = add_missing_totals(df)
+            df.index = pd.RangeIndex(num_rows, num_rows + len(df))
+            df.to_csv(temp, header=temp.tell() == 0, index=outputfile.index)
+            num_rows += len(df)
+            yield df
+    Path(temp.name).replace(outputfile.path)
+
+def postprocess_state(inputfile, outputfile, state, update_index_path=None, memory_budget=None, store_path=None,
+                      wide_output=None, rollup_path=None):
+    #runs in a worker process: fills in the missing totals and records the state's vote updates
+    #(and, with a `store_path`, its rows in the queryable results store, with a `wide_output`, the
+    #wide table of `wide_table` that PQ/script.pq.txt used to build, and with a `rollup_path`, its
+    #county and state curves for charts); with a `memory_budget` (in bytes), csv files are
+    #processed out of core
+    update_index = UpdateIndex(update_index_path) if update_index_path is not None else None
+    store = ResultsStore(store_path) if store_path is not None else None
+    rollups = RollupCache(rollup_path) if rollup_path is not None else None
+    wide_output = as_sink(wide_output, index=False) if wide_output is not None else None
+    if update_index is not None:
+        update_index.clear('precincts', [state])
+    if store is not None:
+        store.clear('precincts', [state])
+    if rollups is not None:
+        rollups.clear('precincts', [state])
+    num_rows = 0
+    with METRICS.timer('aggregate_seconds', dataset='precincts', state=state):
+        if memory_budget is None:
+            frames = [fill_missing_totals(inputfile, outputfile, state=state)]
+        else:
+            frames = iter_missing_totals(inputfile, outputfile, state=state, memory_budget=memory_budget)
+        for df in frames:
+            if update_index is not None:
+                update_index.add('precincts', df, replace=False)
+            if store is not None:
+                store.add('precincts', df, replace=False)
+            if rollups is not None:
+                rollups.add('precincts', df, replace=False)
+            if wide_output is not None:
+                #the ranges of counties never split a precinct, so their wide rows are appended
+                wide_df = wide_table(df)
+                if num_rows == 0:
+                    wide_output.replace(wide_df, key=state)
+                else:
+                    wide_output.write(wide_df, key=state)
+            num_rows += len(df)
+    if update_index is not None:
+        update_index.close()
+    if store is not None:
+        store.close()
+    if rollups is not None:
+        rollups.roll_up_states('precincts', [state])
+        rollups.close()
+    return num_rows
+
+def precinct_search_url(state):
+    #the CDX search pattern of every timestamped precinct file of a state
+    state_str = state + ('General' if state in ('GA', 'NC') else 'GeneralConcatenator')
+    return 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/precincts/{}-2020-11*'.format(state_str)
+
+def state_outputs(src_dir, state, output_format='csv', delta_only=False):
+    #the unprocessed, processed and wide outputs of a state under `src_dir`
+    src_dir = Path(src_dir)
+    if output_format == 'parquet':
+        unprocessed = ParquetSink(src_dir / 'precincts_timeseries_2020_unprocessed')
+        processed = ParquetSink(src_dir / 'precincts_timeseries_2020_processed')
+        wide = ParquetSink(src_dir / 'precincts_timeseries_2020_wide')
+    else:
+        unprocessed = CsvSink(src_dir / '{}_precincts_timeseries_2020_unprocessed.csv'.format(state))
+        processed = CsvSink(src_dir / '{}_precincts_timeseries_2020_processed.csv'.format(state))
+        wide = CsvSink(src_dir / '{}_precincts_timeseries_2020_wide.csv'.format(state), index=False)
+    if delta_only:
+        unprocessed = DeltaSink(unprocessed)
+    return unprocessed, processed, wide
+
+def submit_postprocess(pool, src_dir, state, outputs, memory_budget=DEFAULT_MEMORY_BUDGET):
+    #`postprocess_state` on the `pool`, with the update index, results store and rollups of `src_dir`
+    src_dir = Path(src_dir)
+    unprocessed, processed, wide = outputs
+    pool.submit(state, postprocess_state, unprocessed, processed, state,
+                update_index_path=src_dir / 'vote_updates.sqlite', memory_budget=memory_budget,
+                store_path=src_dir / 'election2020_results.sqlite', wide_output=wide,
+                rollup_path=src_dir / 'election2020_rollups.sqlite')
+
+def report_failures(results):
+    for done_state, _, error in results:
+        if error is not None:
+            print('!!! Filling in the missing totals failed for {}: {}'.format(done_state, error))
+
+def postprocess_states(src_dir='.', states=('PA','MI','FL','GA','NC'), output_format='csv', delta_only=False,
+                       workers=None, memory_budget=512 * 1024**2):
+    """Fills in the missing totals of unprocessed outputs that were already downloaded (and
+    rebuilds their wide tables, vote updates, results store rows and rollups), a state per
+    worker process."""
+    pool = StatePool(workers)
+    for state in states:
+        submit_postprocess(pool, src_dir, state, state_outputs(src_dir, state, output_format, delta_only),
+                           memory_budget=memory_budget)
+        report_failures(pool.completed())
+    report_failures(pool.results())
+    pool.close()
+
+def run(src_dir='.', states=('PA','MI','FL','GA','NC'), output_format='csv', delta_only=False, workers=None,
+        memory_budget=512 * 1024**2, live_urls=None, concurrency=4, metrics_file=None):
+    """Backfills the precinct timeseries of `states` from their archived copies (or, with
+    `live_urls`, polls each state's live file every minute); see the settings in `__main__`,
+    or `python -m election2020 precinct --help`."""
+    src_dir = Path(src_dir)
+    if metrics_file is None:
+        metrics_file = src_dir / 'precincts_metrics.jsonl'
+    stored_url_file = src_dir / 'archived_nyt_timestamped_precinct_urls.txt'
+    pre_collected_urls = stored_url_file.read_text().split()
+
+    #raw archived responses are cached so that reruns replay from disk instead of the network
+    cache = ResponseCache(src_dir / 'archive_cache')
+    engine = FetchEngine(max_workers=concurrency, rate=0.5, burst=4, per_host=concurrency, cache=cache)
+    #tracks which archived files made it into the unprocessed outputs, so reruns resume
+    manifest = ScrapeManifest(src_dir / 'precincts_unprocessed_manifest.sqlite')
+    pool = StatePool(workers)
+    METRICS.export_every(metrics_file)
+
+    if live_urls:
+        #one conditional request per state and minute; unchanged files aren't parsed
+        poller = LivePoller(engine, src_dir / 'precincts_live.sqlite')
+        #the charts' rollups are refreshed with each new snapshot
+        rollups = RollupCache(src_dir / 'election2020_rollups.sqlite')
+        feeds = []
+        for state, live_url in live_urls.items():
+            if output_format == 'parquet':
+                unprocessed = ParquetSink(src_dir / 'precincts_timeseries_2020_live')
+            else:
+                unprocessed = CsvSink(src_dir / Path('{}_precincts_timeseries_2020_live.csv'.format(state)))
+            #only the rows that changed since the previous snapshot are appended
+            changes = None
+            if delta_only:
+                unprocessed = DeltaSink(unprocessed)
+            else:
+                changes = ChangedRows(unprocessed)
+            feeds.append(functools.partial(poll_precinct_data, live_url, state, unprocessed, poller, rollups=rollups,
+                                           changes=changes))
+        try:
+            poller.run(feeds, interval=60)
+        except KeyboardInterrupt:
+            pass
+        poller.close()
+        rollups.close()
+    else:
+        #every state's CDX search runs up front (concurrently), and the results are reused for a day
+        nyt_urls = {state: precinct_search_url(state) for state in states}
+        cdx = CdxIndex(engine, src_dir / 'cdx_cache.sqlite')
+        cdx.search_all(nyt_urls.values(), **SEARCH_DATES)
+
+        for state in states:
+            nyt_url = nyt_urls[state]
+            outputs = state_outputs(src_dir, state, output_format, delta_only)
+            unprocessed = outputs[0]
+
+            failed_urls = load_precinct_data(nyt_url, unprocessed, state, extra_urls=pre_collected_urls, engine=engine,
+                                             manifest=manifest, cdx=cdx)
+            num_failed = len(failed_urls) + 1
+            while len(failed_urls) < num_failed:
+                num_failed = len(failed_urls)
+                failed_urls = load_precinct_data(nyt_url, unprocessed, state, extra_urls=failed_urls, extra_only=True,
+                                                 engine=engine, manifest=manifest)
+
+            submit_postprocess(pool, src_dir, state, outputs, memory_budget=memory_budget)
+            report_failures(pool.completed())
+        report_failures(pool.results())
+
+        cdx.close()
+    pool.close()
+    engine.close()
+    manifest.close()
+    METRICS.stop_export()
 
 
 if __name__=='__main__':
     src_dir = Path('.')
-    stored_url_file = src_dir / Path('archived_nyt_timestamped_precinct_urls.txt')
-    pre_collected_urls = stored_url_file.read_text().split()
+    #'csv' writes files per state; 'parquet' writes typed datasets partitioned by state (needs pyarrow)
+    output_format = 'csv'
+    #store only the rows that changed since the previous snapshot in the unprocessed outputs (plus
+    #an index of snapshots); `fill_missing_totals` reads them back as the dense timeseries
+    delta_only = False
+    #processes that fill in the missing totals of finished states while the next state downloads
+    #(None uses every cpu)
+    workers = None
+    #bytes of rows that filling in the missing totals of a state's csv file may hold in memory at a
+    #time (None reads the whole file)
+    memory_budget = 512 * 1024**2
+    #counters and timings of the run (bytes fetched, rows parsed per second, backoff time, CDX hits
+    #filtered, ...), rewritten every minute; use a '.prom' file for the Prometheus text format
+    metrics_file = src_dir / 'precincts_metrics.jsonl'
+    #to follow an election live, each state's live precinct file (e.g. {'GA': 'https://static01.nyt.com/
+    #elections-assets/.../precincts/GAGeneral.json'}), polled every minute instead of backfilling
+    #archived copies; with `delta_only` only the precincts that changed are stored
+    live_urls = {}
 
-    for state in ('PA','MI','FL','GA','NC'):
-        state_str = state + ('General' if state in ('GA', 'NC') else 'GeneralConcatenator')
-        nyt_url = 'https://static01.nyt.com/elections-assets/2020/data/api/2020-11-03/precincts/{}-2020-11*'.format(state_str)
-        csv_path = src_dir / Path('{}_precincts_timeseries_2020_unprocessed.csv'.format(state))
-        
-        failed_urls = load_precinct_data(nyt_url, csv_path, state, extra_urls=pre_collected_urls)
-        num_failed = len(failed_urls) + 1
-        while len(failed_urls) < num_failed:
-            num_failed = len(failed_urls)
-            failed_urls = load_precinct_data(nyt_url, csv_path, state, extra_urls=failed_urls, extra_only=True)
-
-        outputfile = src_dir / Path('{}_precincts_timeseries_2020_processed.csv'.format(state))
-        fill_missing_totals(csv_path, outputfile)
-        
+    run(src_dir, output_format=output_format, delta_only=delta_only, workers=workers, memory_budget=memory_budget,
+        live_urls=live_urls, metrics_file=metrics_file)
@@ -0,0 +1,179 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+VOTE_TYPES = ['absentee', 'early', 'electionday', 'provisional']
+
+
+def precinct_timestamps(num_timestamps, start='2020-11-04T00:00:00', freq='7min'):
+    return pd.date_range(start, periods=num_timestamps, freq=freq).strftime('%Y-%m-%dT%H:%M:%S').to_numpy()
+
+def precinct_frame(num_precincts=1000, num_timestamps=50, num_counties=None, state='GA',
+                   vote_types=VOTE_TYPES, missing_fraction=0.02, update_fraction=0.3, seed=0):
+    """Synthetic rows shaped like the records of `extract_vote_record` (in the original precinct
+    scraper): cumulative, non-decreasing vote counts for every precinct, vote type and timestamp,
+    with `missing_fraction` of the rows dropped so that gaps have to be filled.  Each series
+    changes at `update_fraction` of the timestamps.
+    """
+    rng = np.random.default_rng(seed)
+    if num_counties is None:
+        num_counties = max(1, num_precincts // 150)
+    timestamps = precinct_timestamps(num_timestamps)
+    num_series = num_precincts * len(vote_types)
+
+    #each precinct/vote type series grows by random increments at each timestamp
+    increments = rng.poisson(3, size=(num_series, num_timestamps, 4)) * (rng.random((num_series, num_timestamps, 1)) < update_fraction)
+    counts = increments.cumsum(axis=1).reshape(-1, 4)
+
+    precinct_ids = np.repeat(np.arange(num_precincts), len(vote_types) * num_timestamps)
+    county_ids = precinct_ids % num_counties
+    df = pd.DataFrame({
+        'state':           state,
+        'county':          pd.Series(county_ids).map('county-{}'.format).to_numpy(),
+        'precinct':        pd.Series(precinct_ids).map('precinct-{}'.format).to_numpy(),
+        'fips':            13000 + county_ids,
+        'timestamp':       np.tile(timestamps, num_series),
+        'vote_type':       np.tile(np.repeat(np.asarray(vote_types, dtype=object), num_timestamps), num_precincts),
+        'votes':           counts.sum(axis=1),
+        'votes_biden':     counts[:, 0],
+        'votes_trump':     counts[:, 1],
+        'votes_jorgensen': counts[:, 2],
+        'votes_other':     counts[:, 3],
+    })
+
+    if missing_fraction:
+        df = df[rng.random(len(df)) >= missing_fraction].reset_index(drop=True)
+    return df
+
+def precinct_records(*args, **kwargs):
+    return precinct_frame(*args, **kwargs).to_dict('records')
+
+def precinct_json(num_precincts=9000, vote_types=VOTE_TYPES, num_counties=None, seed=0):
+    """Synthetic NYT precinct file (raw bytes) with a `precincts` array holding the total for every
+    precinct and a `precinct_by_vote_type` array holding every precinct/vote type pair.  The
+    defaults are about the size of the PA/FL files.
+    """
+    rng = np.random.default_rng(seed)
+    if num_counties is None:
+        num_counties = max(1, num_precincts // 150)
+
+    def row(i, vote_type=None):
+        results = {'bidenj': int(rng.integers(0, 900)), 'trumpd': int(rng.integers(0, 900)),
+                   'jorgensenj': int(rng.integers(0, 30)), 'hawkinsh': None if i % 7 else int(rng.integers(0, 5))}
+        record = {'locality_name': 'County {} County'.format(i % num_counties),
+                  'locality_fips': str(42001 + 2 * (i % num_counties)),
+                  'precinct_id': 'Precinct {}'.format(i),
+                  'votes': sum(v for v in results.values() if v is not None),
+                  'results': results}
+        if vote_type is not None:
+            record['vote_type'] = vote_type
+        return record
+
+    doc = {'meta': {'timestamp': '2020-11-04T05:18:09.130Z', 'precincts': num_precincts},
+           'precincts': [row(i) for i in range(num_precincts)],
+           'precinct_by_vote_type': [row(i, v) for i in range(num_precincts) for v in vote_types]}
+    return json.dumps(doc).encode('utf-8')
+
+STATES = ['AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'IA', 'ID', 'IL', 'IN', 'KS',
+          'KY', 'LA', 'MA', 'MD', 'ME', 'MI', 'MN', 'MO', 'MS', 'MT', 'NC', 'ND', 'NE', 'NH', 'NJ', 'NM',
+          'NV', 'NY', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI',
+          'WV', 'WY']
+CANDIDATES = [('bidenj', 'democrat'), ('trumpd', 'republican'), ('jorgensenj', 'libertarian')]
+
+
+def _race_timeseries(rng, timestamps, total_votes):
+    #cumulative votes with rounded vote shares; like the NYT's, the first entry has no votes
+    #and is out of order
+    votes = np.sort(rng.integers(0, total_votes, size=len(timestamps)))
+    shares = rng.dirichlet([40, 40, 2], size=len(timestamps)).round(3)
+    series = [{'timestamp': timestamps[-1], 'votes': 0, 'vote_shares': {c: 0 for c, _ in CANDIDATES}}]
+    for timestamp, v, s in zip(timestamps[:-1], votes, shares):
+        series.append({'timestamp': timestamp, 'votes': int(v),
+                       'vote_shares': {c: float(share) for (c, _), share in zip(CANDIDATES, s)}})
+    return series
+
+def state_page_races(state='GA', num_timestamps=100, num_house=14, seed=0):
+    """Synthetic `data.races` of a NYT state page (what `build_state_dataframe` parses): the
+    presidential race, a senate race and `num_house` house races, each with its own timeseries of
+    total votes and rounded vote shares.
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range('2020-11-04T00:00:00Z', periods=num_timestamps, freq='13min')
+    candidates = [{'candidate_key': c, 'party_id': party, 'order': i} for i, (c, party) in enumerate(CANDIDATES)]
+
+    race_ids = ['G-P', 'G-S'] + ['G-H-{:02d}'.format(i + 1) for i in range(num_house)]
+    races = []
+    for race_id in race_ids:
+        #races other than the presidential race are updated at their own times
+        race_timestamps = timestamps if race_id == 'G-P' else timestamps + pd.to_timedelta(
+            rng.integers(-300, 300, size=num_timestamps), unit='s')
+        race_timestamps = np.sort(race_timestamps.strftime('%Y-%m-%dT%H:%M:%SZ').to_numpy())
+        race = {'race_id': '{}-{}-2020-11-03'.format(state, race_id), 'candidates': candidates,
+                'timeseries': _race_timeseries(rng, list(race_timestamps), 5000000 // (1 + num_house))}
+        if race_id == 'G-P':
+            race.update(votes2016=4000000, margin2016=5.1, votes2012=3800000, margin2012=7.8)
+        races.append(race)
+    return races
+
+def county_page_json(num_states=50, counties_per_state=60, timestamp='2020-11-04T05:18:09Z', seed=0):
+    """Synthetic NYT national map page (raw bytes) with the presidential race of `num_states`
+    states, each broken down into `counties_per_state` counties (what `extract_county_data` parses).
+    """
+    rng = np.random.default_rng(seed)
+    races = []
+    for s, state in enumerate(STATES[:num_states]):
+        counties = []
+        for i in range(counties_per_state):
+            results = {c: int(rng.integers(0, 50000)) for c, _ in CANDIDATES}
+            absentee = {c: int(v * rng.random() * 0.5) for c, v in results.items()}
+            counties.append({'name': 'County {}'.format(i), 'fips': '{:02d}{:03d}'.format(s + 1, 2 * i + 1),
+                             'last_updated': timestamp, 'results': results, 'results_absentee': absentee,
+                             'absentee_votes': sum(absentee.values()), 'votes': sum(results.values()),
+                             'margin2020': None, 'votes2016': int(rng.integers(0, 150000)),
+                             'margin2016': float(rng.normal(0, 20)), 'votes2012': int(rng.integers(0, 150000)),
+                             'margin2012': float(rng.normal(0, 20))})
+        races.append({'race_id': '{}-G-P-2020-11-03'.format(state), 'state_id': state,
+                      'last_updated': timestamp, 'counties': counties})
+    return json.dumps({'data': {'races': races}}).encode('utf-8')
+
+def county_frame(num_states=50, counties_per_state=60, num_snapshots=50, duplicate_fraction=0.5, seed=0):
+    """Synthetic rows shaped like the county scraper's output before `remove_duplicates`: every
+    county at every archived snapshot, where `duplicate_fraction` of the snapshots were archived
+    again before the page was updated (so they repeat the previous snapshot's timestamp).
+    """
+    rng = np.random.default_rng(seed)
+    num_counties = num_states * counties_per_state
+    updated = np.append(True, rng.random(num_snapshots - 1) >= duplicate_fraction)
+    latest_update = np.maximum.accumulate(np.where(updated, np.arange(num_snapshots), 0))
+    timestamps = precinct_timestamps(num_snapshots, freq='17min')[latest_update]
+
+    votes = rng.poisson(40, size=(num_snapshots, num_counties, 3)).cumsum(axis=0).reshape(-1, 3)
+    state_ids = np.repeat(np.arange(num_states), counties_per_state)
+    county_ids = np.tile(np.arange(counties_per_state), num_states)
+    return pd.DataFrame({
+        'state':              np.tile(np.asarray(STATES, dtype=object)[state_ids], num_snapshots),
+        'county':             np.tile(pd.Series(county_ids).map('county-{}'.format).to_numpy(), num_snapshots),
+        'fips':               np.tile(1000 * (state_ids + 1) + 2 * county_ids + 1, num_snapshots),
+        'timestamp':          np.repeat(timestamps, num_counties),
+        'last_updated':       np.repeat(timestamps, num_counties),
+        'absentee_dem':       votes[:, 0] // 3,
+        'absentee_rep':       votes[:, 1] // 3,
+        'absentee_jorgensen': votes[:, 2] // 3,
+        'votes_dem':          votes[:, 0],
+        'votes_rep':          votes[:, 1],
+        'votes_jorgensen':    votes[:, 2],
+        'absentee2020':       votes.sum(axis=1) // 3,
+        'votes2020':          votes.sum(axis=1),
+        'margin2020':         np.nan,
+        'votes2016':          np.tile(rng.integers(0, 150000, size=num_counties), num_snapshots),
+        'margin2016':         np.tile(rng.normal(0, 20, size=num_counties), num_snapshots),
+        'votes2012':          np.tile(rng.integers(0, 150000, size=num_counties), num_snapshots),
+        'margin2012':         np.tile(rng.normal(0, 20, size=num_counties), num_snapshots),
+    })
+
+
+def assert_same_output(expected_df, actual_df):
+    #the same rows in the same order, with the same columns and dtypes (the index aside)
+    pd.testing.assert_frame_equal(expected_df.reset_index(drop=True), actual_df.reset_index(drop=True))
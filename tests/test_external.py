@@ -0,0 +1,63 @@
+"""The out-of-core dedup and totals against the in-memory ones (see benchmarks/bench_external.py)."""
+import filecmp
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.sinks import CsvSink
+from election2020.scripts import load_script
+from tests.synthetic import county_frame, precinct_frame
+
+
+#the smallest budget, so the files are read in chunks of 1000 rows
+MEMORY_BUDGET = 1
+
+
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_remove_duplicates(tmp_path):
+    #county output appended a snapshot at a time (so the index repeats), with a few missing
+    #counties and a column that changes dtype near the end
+    rng = np.random.default_rng(0)
+    states, counties = 4, 10
+    df = county_frame(states, counties, 100)
+    df['county'] = df['county'].where(rng.random(len(df)) >= 0.01)
+    df.loc[df.index[-len(df) // 10:], 'margin2020'] = 1.5
+    source = CsvSink(tmp_path / 'county_source.csv')
+    for _, snapshot in df.groupby(np.arange(len(df)) // (states * counties)):
+        source.write(snapshot.reset_index(drop=True))
+
+    outputs = [tmp_path / 'county_in_memory.csv', tmp_path / 'county_out_of_core.csv']
+    for path in outputs:
+        shutil.copy(source.path, path)
+    county_scraper = load_script('county')
+    county_scraper.remove_duplicates(CsvSink(outputs[0]))
+    county_scraper.remove_duplicates(CsvSink(outputs[1]), memory_budget=MEMORY_BUDGET)
+    assert filecmp.cmp(*outputs, shallow=False)
+
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_fill_missing_totals(tmp_path):
+    #a state's unprocessed precinct rows, some without a total row, with numeric-looking
+    #precinct ids, missing counties and vote types, and a column that's only missing near the end
+    rng = np.random.default_rng(0)
+    df = precinct_frame(100, 20, vote_types=['absentee', 'electionday', 'total'])
+    df = df[(df['vote_type'] != 'total') | (rng.random(len(df)) >= 0.3)].reset_index(drop=True)
+    numeric = df['precinct'].str.endswith('7')
+    df.loc[numeric, 'precinct'] = df.loc[numeric, 'precinct'].str.replace('precinct-', '000')
+    df['vote_type'] = df['vote_type'].where(rng.random(len(df)) >= 0.01)
+    df['county'] = df['county'].where(rng.random(len(df)) >= 0.01)
+    df['votes_jorgensen'] = df['votes_jorgensen'].astype(float)
+    df.loc[df.index[-len(df) // 10:], 'votes_jorgensen'] = np.nan
+    unprocessed = tmp_path / 'precincts_unprocessed.csv'
+    df.iloc[::2].to_csv(unprocessed)
+
+    outputs = [tmp_path / 'precincts_in_memory.csv', tmp_path / 'precincts_out_of_core.csv']
+    precinct_scraper = load_script('precincts_improved')
+    precinct_scraper.fill_missing_totals(unprocessed, outputs[0], state='GA')
+    rows = sum(len(chunk) for chunk in precinct_scraper.iter_missing_totals(
+        unprocessed, outputs[1], state='GA', memory_budget=MEMORY_BUDGET))
+    assert rows > 0
+    assert filecmp.cmp(*outputs, shallow=False)
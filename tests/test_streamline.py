@@ -0,0 +1,21 @@
+"""`streamline_precincts` against the original `streamline_data`: the same rows in the same order,
+with the same dtypes (see benchmarks/bench_streamline.py)."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from election2020.scripts import load_script
+from election2020.streamline import streamline_precincts
+from tests.synthetic import assert_same_output, precinct_frame
+
+
+@pytest.mark.parametrize('sum_counties', [True, False])
+def test_streamline_parity(sum_counties):
+    streamline_data = load_script('precincts').streamline_data
+    records = precinct_frame(40, 10, seed=1).to_dict('records')
+    expected_df = streamline_data(records, sum_counties=sum_counties)
+    actual_df = streamline_precincts(records, sum_counties=sum_counties)
+    assert len(actual_df)
+    assert_same_output(expected_df, actual_df)